@@ -0,0 +1,110 @@
+"""Bagging on class balanced samples, for training sets where churners are a small minority
+
+Each estimator is fitted to all the rows of the minority class and a sample, without replacement,
+of as many rows of the majority class. Most of the majority rows are left out of each fit, which is
+where the time goes, while the ensemble as a whole still sees most of them.
+
+Downsampling the majority class by a rate beta inflates the probabilities of the minority class.
+They are mapped back to the class balance of the training set by
+
+    p = beta * p_s / (beta * p_s - p_s + 1)
+
+(Dal Pozzolo et al., Calibrating Probability with Undersampling for Unbalanced Classification),
+which preserves the ranking of the rows. The correction assumes each sample keeps the minority
+rows at their rate in the training set, so they aren't bootstrapped, and that the estimates of the
+sampled rows are calibrated, so the default trees stop at leaves of MIN_SAMPLES_LEAF rows rather
+than predicting only 0 or 1.
+
+    clf = balanced.BalancedBaggingClassifier(n_estimators=10, random_state=0).fit(X, y)
+    churn_probabilities = clf.predict_proba(test_X)[:, 1]
+"""
+from __future__ import division
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.tree import DecisionTreeClassifier
+
+MAJORITY_RATIO = 1.0
+MIN_SAMPLES_LEAF = 3
+
+
+def calibrate(probabilities, beta):
+    """Correct the minority class probabilities of a model fitted to a sample keeping a fraction
+    beta of the majority class
+
+    :param np.array[np.float64] probabilities: of the minority class, under the sampled balance
+    :param float beta: the fraction of the majority rows sampled
+    :rtype: np.array[np.float64]
+    """
+    calibrated = beta * probabilities / (beta * probabilities - probabilities + 1)
+    # Rounding can take a certain prediction just past 1
+    return np.clip(calibrated, 0.0, 1.0)
+
+
+class BalancedBaggingClassifier(object):
+    """Bagging with the majority class downsampled for each estimator, and calibrated
+    probabilities"""
+
+    def __init__(self, base_estimator=None, n_estimators=10, majority_ratio=MAJORITY_RATIO,
+                 random_state=None):
+        """
+        :param base_estimator: an unfitted sklearn classifier, by default a decision tree with
+            leaves of at least MIN_SAMPLES_LEAF rows
+        :param int n_estimators: the number of estimators
+        :param float majority_ratio: the majority rows sampled for each estimator, per minority
+            row, and at least one
+        """
+        self.base_estimator = base_estimator
+        self.n_estimators = n_estimators
+        self.majority_ratio = majority_ratio
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        """
+        :param np.array[np.float64] X:
+        :param np.array y: binary labels
+        :rtype: BalancedBaggingClassifier
+        """
+        y = np.asarray(y)
+        self.classes_, counts = np.unique(y, return_counts=True)
+        if len(self.classes_) != 2:
+            raise ValueError('Expected 2 classes, got %s' % len(self.classes_))
+        self.minority_column_ = int(np.argmin(counts))
+        is_minority = y == self.classes_[self.minority_column_]
+        minority = np.flatnonzero(is_minority)
+        majority = np.flatnonzero(~is_minority)
+
+        # Each sample needs both classes, so at least one majority row
+        majority_size = min(len(majority),
+                            max(1, int(round(self.majority_ratio * len(minority)))))
+        self.beta_ = majority_size / len(majority)
+        # The estimators predict whether a row is in the minority class
+        labels = is_minority.astype(np.float64)
+        base_estimator = (self.base_estimator if self.base_estimator is not None
+                          else DecisionTreeClassifier(min_samples_leaf=MIN_SAMPLES_LEAF))
+
+        rng = np.random.RandomState(self.random_state)
+        self.estimators_ = []
+        for _ in xrange(self.n_estimators):
+            sample = np.concatenate([minority,
+                                     rng.choice(majority, majority_size, replace=False)])
+            estimator = clone(base_estimator)
+            if 'random_state' in estimator.get_params():
+                estimator.set_params(random_state=rng.randint(2 ** 31))
+            self.estimators_.append(estimator.fit(X[sample], labels[sample]))
+        return self
+
+    def predict_proba(self, X):
+        """
+        :rtype: np.array[np.float64]
+        """
+        sampled = np.mean([estimator.predict_proba(X)[:, 1] for estimator in self.estimators_],
+                          axis=0)
+        minority = calibrate(sampled, self.beta_)
+        probabilities = np.empty((len(minority), 2))
+        probabilities[:, self.minority_column_] = minority
+        probabilities[:, 1 - self.minority_column_] = 1 - minority
+        return probabilities
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
@@ -0,0 +1,96 @@
+import cPickle
+import unittest
+
+import numpy as np
+from sklearn.datasets import make_classification
+from sklearn.ensemble import BaggingClassifier
+from sklearn.metrics import roc_auc_score
+
+import balanced
+
+
+class BalancedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.X, self.y = make_classification(6000, 10, n_informative=5, weights=[0.9],
+                                             flip_y=0.02, random_state=0)
+
+    def test_calibrate_undoes_the_sampling(self):
+        # A row with probability p of the minority class, in a sample keeping beta of the majority
+        p = np.linspace(0, 1, 11)
+        for beta in (1.0, 0.5, 0.1):
+            sampled = p / (p + beta * (1 - p))
+            np.testing.assert_array_almost_equal(p, balanced.calibrate(sampled, beta))
+
+    def test_samples_are_balanced(self):
+        clf = balanced.BalancedBaggingClassifier(n_estimators=3, random_state=0)
+        clf.fit(self.X, self.y)
+        minority = (self.y == 1).sum()
+
+        self.assertEqual(1, clf.minority_column_)
+        self.assertAlmostEqual(minority / float(len(self.y) - minority), clf.beta_)
+        for tree in clf.estimators_:
+            self.assertEqual(2 * minority, tree.tree_.weighted_n_node_samples[0])
+
+    def test_probabilities_are_calibrated_and_rank_as_bagging(self):
+        train, test = slice(0, 4000), slice(4000, None)
+        clf = balanced.BalancedBaggingClassifier(n_estimators=20, random_state=0)
+        probabilities = clf.fit(self.X[train], self.y[train]).predict_proba(self.X[test])
+        bagging = BaggingClassifier(n_estimators=20, random_state=0).fit(self.X[train],
+                                                                         self.y[train])
+
+        np.testing.assert_array_almost_equal(np.ones(len(probabilities)),
+                                             probabilities.sum(axis=1))
+        self.assertGreater(roc_auc_score(self.y[test], probabilities[:, 1]),
+                           roc_auc_score(self.y[test], bagging.predict_proba(self.X[test])[:, 1])
+                           - 0.02)
+
+    def test_mean_probability_is_the_churn_rate(self):
+        X, y = make_classification(50000, 10, n_informative=5, weights=[0.875], flip_y=0.02,
+                                   random_state=1)
+        train, test = slice(0, 25000), slice(25000, None)
+        clf = balanced.BalancedBaggingClassifier(n_estimators=10, random_state=0)
+        probabilities = clf.fit(X[train], y[train]).predict_proba(X[test])[:, 1]
+
+        # Within 5%, about twice the standard error of the churn rate of the test rows
+        self.assertAlmostEqual(1.0, probabilities.mean() / y[test].mean(), delta=0.05)
+
+    def test_minority_can_be_either_class(self):
+        y = np.where(self.y == 1, 'churned', 'stayed')
+        clf = balanced.BalancedBaggingClassifier(n_estimators=5, random_state=0).fit(self.X, y)
+
+        np.testing.assert_array_equal(['churned', 'stayed'], clf.classes_)
+        self.assertEqual(0, clf.minority_column_)
+        # The same fit as with 0 and 1 labels, with the columns in the order of the classes
+        numeric = balanced.BalancedBaggingClassifier(n_estimators=5, random_state=0)
+        numeric.fit(self.X, self.y)
+        np.testing.assert_array_almost_equal(numeric.predict_proba(self.X)[:, ::-1],
+                                             clf.predict_proba(self.X))
+        self.assertEqual(set(clf.classes_), set(clf.predict(self.X)))
+
+    def test_reproducible_and_picklable(self):
+        first = balanced.BalancedBaggingClassifier(random_state=3).fit(self.X, self.y)
+        second = balanced.BalancedBaggingClassifier(random_state=3).fit(self.X, self.y)
+        restored = cPickle.loads(cPickle.dumps(first, cPickle.HIGHEST_PROTOCOL))
+
+        np.testing.assert_array_equal(first.predict_proba(self.X), second.predict_proba(self.X))
+        np.testing.assert_array_equal(first.predict_proba(self.X), restored.predict_proba(self.X))
+
+    def test_single_minority_row(self):
+        y = np.zeros(len(self.y))
+        y[0] = 1
+        clf = balanced.BalancedBaggingClassifier(n_estimators=3, majority_ratio=0.2,
+                                                 random_state=0).fit(self.X, y)
+
+        self.assertAlmostEqual(1.0 / (len(y) - 1), clf.beta_)
+        probabilities = clf.predict_proba(self.X)
+        self.assertEqual((len(y), 2), probabilities.shape)
+        self.assertTrue(np.isfinite(probabilities).all())
+
+    def test_rejects_more_than_two_classes(self):
+        with self.assertRaises(ValueError):
+            balanced.BalancedBaggingClassifier().fit(self.X, np.arange(len(self.X)) % 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+"""Integer coded storage of categorical features
+
+Each distinct value of a feature is interned and stored once, and the rows hold small integer
+codes in a NumPy array. Codes start at 1, in order of first appearance, as
+transform_categorical_features numbers them; 0 is reserved for values unknown to a column that
+is no longer growing, e.g. categories of the test data not seen in training.
+"""
+import numpy as np
+
+UNKNOWN_CODE = 0
+
+CODE_DTYPES = [np.uint8, np.uint16, np.uint32, np.uint64]
+
+INITIAL_CAPACITY = 1024
+
+
+def code_dtype(max_code):
+    """The smallest unsigned integer dtype that can hold the code"""
+    for dtype in CODE_DTYPES:
+        if max_code <= np.iinfo(dtype).max:
+            return dtype
+    raise OverflowError('Too many categories: %s' % max_code)
+
+
+class CategoricalColumn(object):
+    """The values of one categorical feature as integer codes
+
+    Encoding and decoding a single value are O(1) in both directions: a dict maps values to codes
+    and a list maps codes to values.
+    """
+
+    def __init__(self, values=(), grow=True):
+        self._codes_by_value = {}
+        self._values = [None]
+        self._codes = np.zeros(INITIAL_CAPACITY, dtype=CODE_DTYPES[0])
+        self._length = 0
+        self.grow = grow
+        self.extend(values)
+
+    @classmethod
+    def from_categories(cls, categories):
+        """A column which encodes only the given categories, e.g. those seen in training
+
+        :param iterable[str] categories: in code order, as returned by categories()
+        :rtype: CategoricalColumn
+        """
+        column = cls()
+        for category in categories:
+            column.encode(category)
+        column.grow = False
+        return column
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def cardinality(self):
+        return len(self._values) - 1
+
+    @property
+    def codes(self):
+        """The code of each value appended, a view of the underlying array
+
+        :rtype: np.array
+        """
+        return self._codes[:self._length]
+
+    def categories(self):
+        """The distinct values, in code order starting from code 1
+
+        :rtype: list[str]
+        """
+        return self._values[1:]
+
+    def encode(self, value):
+        """Return the code for a value, adding it as a new category if the column grows
+
+        :rtype: int
+        """
+        code = self._codes_by_value.get(value)
+        if code is not None:
+            return code
+        if not self.grow:
+            return UNKNOWN_CODE
+        if isinstance(value, str):
+            value = intern(value)
+        code = len(self._values)
+        self._codes_by_value[value] = code
+        self._values.append(value)
+        if code > np.iinfo(self._codes.dtype).max:
+            self._codes = self._codes.astype(code_dtype(code))
+        return code
+
+    def decode(self, code):
+        """Return the value for a code, None for the unknown code
+
+        :rtype: str
+        """
+        return self._values[code]
+
+    def encode_values(self, values):
+        """Return the codes for values without appending them to the codes of the column. A
+        growing column still adds unseen values as categories, a frozen one codes them as
+        UNKNOWN_CODE.
+
+        :rtype: np.array
+        """
+        codes = [self.encode(value) for value in values]
+        return np.array(codes, dtype=code_dtype(self.cardinality))
+
+    def decode_codes(self, codes):
+        return [self._values[code] for code in codes]
+
+    def append(self, value):
+        code = self.encode(value)
+        if self._length == len(self._codes):
+            self._codes = np.resize(self._codes, 2 * len(self._codes))
+        self._codes[self._length] = code
+        self._length += 1
+        return code
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def value_map(self):
+        """A mapping from code to value, as returned by transform_categorical_features
+
+        :rtype: dict[int, str]
+        """
+        return {code: value for code, value in enumerate(self._values) if code != UNKNOWN_CODE}
+
+
+class CategoricalStore(object):
+    """Categorical columns for each categorical feature of a set of rows"""
+
+    def __init__(self, columns):
+        """
+        :param dict[str, CategoricalColumn] columns: by feature name
+        """
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows, features, exclude=('id',)):
+        """Encode the categorical features present in the rows
+
+        :param list[dict[str, Any]] rows:
+        :param dict[str, dict[str, bool] features:
+        :param exclude: names of categorical features not to encode
+        :rtype: CategoricalStore
+        """
+        present = rows[0] if rows else {}
+        names = [name for name, feature in features.iteritems()
+                 if int(feature['is_categorical']) and name not in exclude and name in present]
+        store = cls({name: CategoricalColumn() for name in names})
+        store.extend(rows)
+        return store
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def frozen(self):
+        """An empty store with the same categories, which encodes unknown values as UNKNOWN_CODE
+
+        Use it to encode test or scoring data with the codes of the training data.
+
+        :rtype: CategoricalStore
+        """
+        return CategoricalStore({name: CategoricalColumn.from_categories(column.categories())
+                                 for name, column in self.columns.iteritems()})
+
+    def extend(self, rows):
+        """Append the values of the rows, which aren't modified
+
+        :param list[dict[str, Any]] rows:
+        """
+        for row in rows:
+            for name, column in self.columns.iteritems():
+                column.append(row.get(name, ''))
+
+    def matrix(self, names=None):
+        """The codes of the features, a column per feature
+
+        :param list[str] names: the features, all of them sorted by name by default
+        :rtype: np.array
+        """
+        names = names or sorted(self.columns)
+        if not names:
+            return np.zeros((0, 0))
+        return np.column_stack([self.columns[name].codes for name in names])
+
+    def value_maps(self):
+        """
+        :rtype: dict[str, dict[int, str]]
+        """
+        return {name: column.value_map() for name, column in self.columns.iteritems()}
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+import categorical
+import rowview
+
+
+class CategoricalTest(unittest.TestCase):
+
+    def test_codes_in_order_of_first_appearance(self):
+        column = categorical.CategoricalColumn(['small', 'big', 'small', '', 'big'])
+
+        self.assertEqual(5, len(column))
+        self.assertEqual(3, column.cardinality)
+        self.assertEqual(np.uint8, column.codes.dtype)
+        self.assertEqual([1, 2, 1, 3, 2], list(column.codes))
+        self.assertEqual(['small', 'big', ''], column.categories())
+        self.assertEqual({1: 'small', 2: 'big', 3: ''}, column.value_map())
+        self.assertEqual('big', column.decode(2))
+        self.assertEqual(2, column.encode('big'))
+
+    def test_values_are_interned(self):
+        column = categorical.CategoricalColumn([''.join(['a', 'b'])])
+        self.assertIs(intern('ab'), column.decode(1))
+
+    def test_store_leaves_the_rows_alone(self):
+        features = {'type': {'is_categorical': '1'}}
+        values = [''.join(['sm', 'all']), ''.join(['s', 'mall']), ''.join(['smal', 'l'])]
+        rows = [{'type': values[0]}, {'type': values[1]}, rowview.RowView({'type': values[2]})]
+        store = categorical.CategoricalStore.from_rows(rows, features)
+
+        self.assertIs(intern('small'), store['type'].decode(1))
+        for row, value in zip(rows, values):
+            self.assertIs(value, row['type'])
+        self.assertEqual({}, rows[2].overrides)
+
+    def test_dtype_grows_with_cardinality(self):
+        column = categorical.CategoricalColumn(str(i) for i in range(300))
+        self.assertEqual(np.uint16, column.codes.dtype)
+        self.assertEqual(range(1, 301), list(column.codes))
+        self.assertEqual('299', column.decode(300))
+
+    def test_frozen_store_encodes_unknown_values(self):
+        features = {'id': {'is_categorical': '1'},
+                    'type': {'is_categorical': '1'},
+                    'weight': {'is_categorical': '0'}}
+        rows = [{'id': 'a', 'type': 'small', 'weight': 1},
+                {'id': 'b', 'type': 'big', 'weight': 2}]
+        store = categorical.CategoricalStore.from_rows(rows, features)
+        self.assertEqual(['type'], list(store.columns))
+
+        test_store = store.frozen()
+        test_store.extend([{'type': 'big'}, {'type': 'huge'}])
+        self.assertEqual([2, categorical.UNKNOWN_CODE], list(test_store['type'].codes))
+        self.assertEqual([[2], [0]], test_store.matrix().tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
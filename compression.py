@@ -0,0 +1,229 @@
+"""Read and write compressed files, recognising compressed inputs by their first bytes
+
+Inputs are detected from their magic numbers whatever they are called, and decompressed as a
+stream straight into the csv reader, in a background thread so that decompression overlaps
+parsing. Nothing is decompressed to disk. gzip and bz2 are in the standard library; xz needs the
+backports.lzma package and zstd the zstandard package.
+
+    with compression.open_file('hist_data.csv') as f:  # plain, .gz, .bz2, .xz or .zst
+        rows = list(csv.DictReader(f))
+"""
+import bz2
+import gzip
+import os
+import zlib
+
+import prefetch
+
+try:
+    from backports import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+BZ2 = 'bz2'
+XZ = 'xz'
+ZSTD = 'zstd'
+
+MAGIC_NUMBERS = [(GZIP, '\x1f\x8b'),
+                 (BZ2, 'BZh'),
+                 (XZ, '\xfd7zXZ\x00'),
+                 (ZSTD, '\x28\xb5\x2f\xfd')]
+
+EXTENSIONS = {GZIP: '.gz', BZ2: '.bz2', XZ: '.xz', ZSTD: '.zst'}
+
+MODULES = {XZ: ('backports.lzma', lambda: lzma), ZSTD: ('zstandard', lambda: zstandard)}
+
+BLOCK_SIZE = 2 ** 20
+MAX_QUEUED_BLOCKS = 4
+
+# A rough ratio of the csv text to its compressed size, for budgeting memory before reading
+ESTIMATED_COMPRESSION_RATIO = 6
+
+
+def detect_compression(file_path):
+    """The compression of a file from its magic number
+
+    :rtype: str
+    :return: One of GZIP, BZ2, XZ or ZSTD, or None for an uncompressed file
+    """
+    with open(file_path, 'rb') as f:
+        start = f.read(max(len(magic) for _, magic in MAGIC_NUMBERS))
+    for compression, magic in MAGIC_NUMBERS:
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def compression_for_path(file_path):
+    """The compression implied by a file name's extension, or None"""
+    extension = os.path.splitext(file_path)[1]
+    for compression, compression_extension in EXTENSIONS.iteritems():
+        if extension == compression_extension:
+            return compression
+    return None
+
+
+def estimated_size(file_path):
+    """The size of a file's contents once decompressed, estimated for compressed files
+
+    :rtype: int
+    """
+    size = os.path.getsize(file_path)
+    if detect_compression(file_path):
+        return size * ESTIMATED_COMPRESSION_RATIO
+    return size
+
+
+def _require(compression):
+    if compression not in (GZIP, BZ2, XZ, ZSTD):
+        raise ValueError('Unknown compression %r' % (compression,))
+    if compression in MODULES:
+        package, module = MODULES[compression]
+        if module() is None:
+            raise ImportError('%s files need the %s package' % (compression, package))
+
+
+def _new_decompressor(compression):
+    if compression == GZIP:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if compression == BZ2:
+        return bz2.BZ2Decompressor()
+    if compression == XZ:
+        return lzma.LZMADecompressor()
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def _stream_ended(decompressor, compression):
+    """Whether a decompressor has reached the end of its stream
+
+    Python 2's zlib and bz2 decompressors don't say, so they are asked indirectly: once a zlib
+    stream has ended any further input is left unused, and a bz2 decompressor refuses any.
+    """
+    if compression == GZIP:
+        probe = decompressor.copy()
+        try:
+            probe.decompress('\x00')
+        except zlib.error:
+            return False
+        return probe.unused_data == '\x00'
+    if compression == BZ2:
+        try:
+            decompressor.decompress('')
+        except EOFError:
+            return True
+        return False
+    # Versions of zstandard before eof was added can't tell
+    return getattr(decompressor, 'eof', True)
+
+
+def iter_decompressed_blocks(f, compression, block_size=BLOCK_SIZE):
+    """Decompress a file a block at a time
+
+    Concatenated streams, e.g. from appending gzip files, are decompressed one after another.
+
+    :param file f: the compressed file, opened in binary mode
+    :param str compression: one of GZIP, BZ2, XZ or ZSTD
+    :rtype: iterable[str]
+    :raises EOFError: if the file ends part way through a stream, e.g. it was truncated
+    """
+    _require(compression)
+    decompressor = _new_decompressor(compression)
+    started = False
+    while True:
+        data = f.read(block_size)
+        if not data:
+            break
+        started = True
+        while data:
+            try:
+                output = decompressor.decompress(data)
+            except EOFError:
+                # The previous stream ended exactly at the end of a block
+                decompressor = _new_decompressor(compression)
+                continue
+            data = getattr(decompressor, 'unused_data', '')
+            if data:
+                decompressor = _new_decompressor(compression)
+            if output:
+                yield output
+    if started and not _stream_ended(decompressor, compression):
+        raise EOFError('%s file ended before the end of its stream' % compression)
+
+
+class DecompressingReader(object):
+    """A read only file of the decompressed contents of a compressed file
+
+    The file is decompressed in a background thread, a few blocks ahead of the reader. Iterating
+    gives lines, as csv.reader expects.
+    """
+
+    def __init__(self, file_path, compression, block_size=BLOCK_SIZE,
+                 max_queued=MAX_QUEUED_BLOCKS):
+        _require(compression)
+        self.name = file_path
+        self._file = open(file_path, 'rb')
+        self._blocks = prefetch.Prefetcher(
+            lambda: iter_decompressed_blocks(self._file, compression, block_size), max_queued)
+
+    def __iter__(self):
+        pending = ''
+        for block in self._blocks:
+            lines = (pending + block).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def read(self):
+        return ''.join(self._blocks)
+
+    def readlines(self):
+        return list(self)
+
+    def close(self):
+        # Stop the thread before closing the file it reads
+        self._blocks.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_file(file_path, mode='r', compression=None):
+    """Open a file for reading, decompressing it if it is compressed, or for writing, compressing
+    it if asked to
+
+    :param str mode: 'r' or 'rb' to read, 'w' or 'wb' to write. Compressed files are always
+        binary.
+    :param str compression: when writing, one of GZIP, BZ2, XZ or ZSTD, by default the
+        compression implied by the file's extension. Ignored when reading, as the compression is
+        detected from the file's contents.
+    :rtype: file
+    """
+    if 'r' in mode:
+        compression = detect_compression(file_path)
+        if compression is None:
+            return open(file_path, mode)
+        return DecompressingReader(file_path, compression)
+
+    compression = compression or compression_for_path(file_path)
+    if compression is None:
+        return open(file_path, mode)
+    _require(compression)
+    if compression == GZIP:
+        return gzip.open(file_path, 'wb')
+    if compression == BZ2:
+        return bz2.BZ2File(file_path, 'wb')
+    if compression == XZ:
+        return lzma.LZMAFile(file_path, 'wb')
+    return zstandard.ZstdCompressor().stream_writer(open(file_path, 'wb'))
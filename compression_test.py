@@ -0,0 +1,129 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import compression
+import load
+
+
+def available(name):
+    try:
+        compression._require(name)
+    except ImportError:
+        return False
+    return True
+
+
+class CompressionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rows = [{'id': 'id%04d' % i, 'value': str(i * 7), 'note': 'a, "quoted" note'}
+                     for i in range(2000)]
+        self.plain_path = self.path('rows.csv')
+        with open(self.plain_path, 'wb') as f:
+            writer = csv.DictWriter(f, ['id', 'value', 'note'])
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def compressed_copy(self, name, file_compression=None):
+        path = self.path(name)
+        with open(self.plain_path, 'rb') as f, \
+                compression.open_file(path, 'wb', file_compression) as g:
+            g.write(f.read())
+        return path
+
+    def check_round_trip(self, file_compression):
+        path = self.compressed_copy('rows.csv' + compression.EXTENSIONS[file_compression])
+        self.assertEqual(file_compression, compression.detect_compression(path))
+        self.assertLess(os.path.getsize(path), os.path.getsize(self.plain_path))
+        self.assertEqual(self.rows, load.extract_rows(path))
+        chunks = list(load.iter_row_chunks(path, 300))
+        self.assertEqual(self.rows, [row for chunk in chunks for row in chunk])
+
+    def test_gzip(self):
+        self.check_round_trip(compression.GZIP)
+
+    def test_bz2(self):
+        self.check_round_trip(compression.BZ2)
+
+    @unittest.skipUnless(available(compression.XZ), 'backports.lzma is not installed')
+    def test_xz(self):
+        self.check_round_trip(compression.XZ)
+
+    @unittest.skipUnless(available(compression.ZSTD), 'zstandard is not installed')
+    def test_zstd(self):
+        self.check_round_trip(compression.ZSTD)
+
+    def test_detected_by_contents_not_name(self):
+        path = self.compressed_copy('rows_without_extension', compression.GZIP)
+        self.assertEqual(compression.GZIP, compression.detect_compression(path))
+        self.assertIsNone(compression.detect_compression(self.plain_path))
+        self.assertEqual(self.rows, load.extract_rows(path))
+
+    def test_lines_split_across_blocks(self):
+        path = self.compressed_copy('rows.csv.gz')
+        with open(self.plain_path) as f:
+            expected = f.readlines()
+        for block_size in (1, 10, 333):
+            reader = compression.DecompressingReader(path, compression.GZIP, block_size)
+            with reader:
+                self.assertEqual(expected, reader.readlines())
+
+    def test_concatenated_streams(self):
+        first = self.compressed_copy('first.gz')
+        with open(first, 'rb') as f:
+            member = f.read()
+        path = self.path('concatenated.gz')
+        with open(path, 'wb') as f:
+            f.write(member + member)
+        with open(self.plain_path) as f:
+            expected = f.read()
+
+        for block_size in (len(member), 64):
+            with open(path, 'rb') as f:
+                blocks = compression.iter_decompressed_blocks(f, compression.GZIP, block_size)
+                self.assertEqual(expected * 2, ''.join(blocks))
+
+    def test_errors_are_raised_in_the_reader(self):
+        path = self.path('corrupt.gz')
+        with open(path, 'wb') as f:
+            f.write('\x1f\x8b' + 'not really gzip' * 10)
+        self.assertRaises(Exception, load.extract_rows, path)
+
+    def test_truncated_files_are_errors(self):
+        for file_compression in (compression.GZIP, compression.BZ2):
+            path = self.compressed_copy('rows.csv' + compression.EXTENSIONS[file_compression])
+            with open(path, 'rb') as f:
+                contents = f.read()
+            for length in (len(contents) // 2, len(contents) - 1):
+                with open(path, 'wb') as f:
+                    f.write(contents[:length])
+                self.assertRaises(EOFError, load.extract_rows, path)
+
+    def test_closing_before_the_end_stops_the_thread(self):
+        path = self.compressed_copy('rows.csv.gz')
+        reader = compression.DecompressingReader(path, compression.GZIP, block_size=16,
+                                                 max_queued=1)
+        with reader:
+            self.assertEqual('id,value,note\r\n', next(iter(reader)))
+        self.assertFalse(reader._blocks._thread.is_alive())
+        self.assertTrue(reader._file.closed)
+
+    def test_compression_for_path(self):
+        self.assertEqual(compression.XZ, compression.compression_for_path('scores.xz'))
+        self.assertIsNone(compression.compression_for_path('scores.csv'))
+        with self.assertRaises(ValueError):
+            compression.open_file(self.path('scores'), 'w', 'rar')
+
+
+if __name__ == '__main__':
+    unittest.main()
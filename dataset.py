@@ -0,0 +1,125 @@
+"""A binary format for vectorised datasets, written once and memory mapped by each process
+
+Layout: the magic bytes, the length of a JSON header, the header, then the raw buffers, each
+aligned to ALIGNMENT bytes. The header records the column names, the number of rows and the
+offset, dtype and shape of each buffer. The matrix X is stored column by column (Fortran order)
+so each feature is one contiguous buffer. Opening a dataset parses only the header; the arrays
+are np.memmap views, so processes opening the same file share one page cached copy.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = 'PMDS\x01'
+ALIGNMENT = 64
+X_DTYPE = '<f8'
+Y_DTYPE = '<f8'
+ID_DTYPE = 'S32'
+
+
+class Dataset(object):
+    """An opened dataset
+
+    :ivar np.memmap X: the matrix, one row per sample and one column per feature
+    :ivar np.memmap y: the labels, or None
+    :ivar np.memmap ids: the ids of the rows, or None
+    :ivar list[str] columns: the feature name of each column of X
+    :ivar dict metadata: anything else saved with the dataset
+    """
+
+    def __init__(self, file_path, header, arrays):
+        self.file_path = file_path
+        self.columns = header['columns']
+        self.metadata = header.get('metadata', {})
+        self.X = arrays['X']
+        self.y = arrays.get('y')
+        self.ids = arrays.get('ids')
+
+    def __len__(self):
+        return self.X.shape[0]
+
+    def column(self, name):
+        """The values of one feature, a contiguous view of the file
+
+        :rtype: np.memmap
+        """
+        return self.X[:, self.columns.index(name)]
+
+
+def _align(offset):
+    return offset + (-offset % ALIGNMENT)
+
+
+def write_dataset(file_path, X, columns, y=None, ids=None, metadata=None):
+    """Write a vectorised dataset
+
+    :param np.array X: a 2d array with a column per feature
+    :param list[str] columns: the feature name of each column of X
+    :param np.array y: the labels
+    :param list[str] ids: the id of each row
+    :param dict metadata: JSON serialisable details to store alongside, e.g. the features
+    """
+    rows = X.shape[0]
+    if len(columns) != X.shape[1]:
+        raise ValueError('Expected %s column names, got %s' % (X.shape[1], len(columns)))
+
+    arrays = [('X', X_DTYPE, [rows, len(columns)])]
+    if y is not None:
+        arrays.append(('y', Y_DTYPE, [rows]))
+    if ids is not None:
+        arrays.append(('ids', ID_DTYPE, [rows]))
+
+    # The offsets depend on the length of the header, which depends on the offsets, so place the
+    # buffers after the largest the header could be
+    specs = {name: {'dtype': dtype, 'shape': shape, 'offset': 0} for name, dtype, shape in arrays}
+    header = {'columns': list(columns), 'rows': rows, 'arrays': specs, 'metadata': metadata or {}}
+    offset = _align(len(MAGIC) + 8 + len(json.dumps(header)) + 32 * len(arrays))
+    for name, dtype, shape in arrays:
+        specs[name]['offset'] = offset
+        offset = _align(offset + np.dtype(dtype).itemsize * int(np.prod(shape)))
+    encoded_header = json.dumps(header)
+
+    with open(file_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(encoded_header)))
+        f.write(encoded_header)
+
+        f.seek(specs['X']['offset'])
+        for j in xrange(X.shape[1]):
+            np.asarray(X[:, j], dtype=X_DTYPE).tofile(f)
+        if y is not None:
+            f.seek(specs['y']['offset'])
+            np.asarray(y, dtype=Y_DTYPE).tofile(f)
+        if ids is not None:
+            f.seek(specs['ids']['offset'])
+            np.asarray(ids, dtype=ID_DTYPE).tofile(f)
+        f.truncate(offset)
+
+
+def read_header(file_path):
+    with open(file_path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a dataset file' % file_path)
+        length, = struct.unpack('<Q', f.read(8))
+        return json.loads(f.read(length))
+
+
+def open_dataset(file_path, mode='r'):
+    """Memory map a dataset written by write_dataset
+
+    :param str file_path:
+    :param str mode: the np.memmap mode, read only by default
+    :rtype: Dataset
+    """
+    header = read_header(file_path)
+    arrays = {}
+    for name, spec in header['arrays'].iteritems():
+        shape = tuple(spec['shape'])
+        if not all(shape):
+            arrays[name] = np.empty(shape, dtype=spec['dtype'])
+            continue
+        arrays[name] = np.memmap(file_path, dtype=spec['dtype'], mode=mode,
+                                 offset=spec['offset'], shape=shape,
+                                 order='F' if name == 'X' else 'C')
+    return Dataset(file_path, header, arrays)
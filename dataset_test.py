@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import dataset
+
+
+class DatasetTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.file_path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def test_round_trip(self):
+        X = np.arange(15, dtype=np.float64).reshape(5, 3)
+        y = np.array([0, 1, 0, 0, 1])
+        ids = ['%032x' % i for i in range(5)]
+        dataset.write_dataset(self.file_path, X, ['a', 'b', 'c'], y, ids,
+                              metadata={'features': {'a': {'is_date': 0}}})
+
+        model_dataset = dataset.open_dataset(self.file_path)
+        self.assertEqual(5, len(model_dataset))
+        self.assertEqual(['a', 'b', 'c'], model_dataset.columns)
+        self.assertEqual({'features': {'a': {'is_date': 0}}}, model_dataset.metadata)
+        self.assertIsInstance(model_dataset.X, np.memmap)
+        np.testing.assert_array_equal(X, model_dataset.X)
+        np.testing.assert_array_equal(y, model_dataset.y)
+        self.assertEqual(ids, list(model_dataset.ids))
+
+        column = model_dataset.column('b')
+        self.assertTrue(column.flags['C_CONTIGUOUS'])
+        np.testing.assert_array_equal([1, 4, 7, 10, 13], column)
+        self.assertFalse(model_dataset.X.flags['WRITEABLE'])
+
+    def test_without_labels(self):
+        dataset.write_dataset(self.file_path, np.ones((2, 1)), ['a'])
+        model_dataset = dataset.open_dataset(self.file_path)
+        self.assertIsNone(model_dataset.y)
+        self.assertIsNone(model_dataset.ids)
+
+    def test_not_a_dataset(self):
+        with open(self.file_path, 'w') as f:
+            f.write('id,name\n')
+        with self.assertRaises(ValueError):
+            dataset.open_dataset(self.file_path)
+
+    def test_column_count_mismatch(self):
+        with self.assertRaises(ValueError):
+            dataset.write_dataset(self.file_path, np.ones((2, 2)), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,356 @@
+"""Profile extracts as they load, and flag drift from the profile of the training extract
+
+A DataProfile is updated a chunk of rows at a time, in one pass and in bounded memory. For each
+column it keeps the missing rate, and either the category frequencies or, for the quantiles, a
+fixed size reservoir sample of the values that aren't missing. For the price history it keeps the
+coverage of each timeseries by date. Comparing a profile with the stored training profile flags:
+
+    - columns added or removed
+    - changes in the missing rates
+    - shifted distributions, by the population stability index (PSI) of the samples or the
+      category frequencies. The PSI of two samples of the same distribution grows as the samples
+      get smaller, so the threshold for samples is raised by that noise, and samples too small
+      to bin aren't compared.
+    - categories not seen in training
+    - changes in the coverage of the price history
+
+    profile = drift.profile_files(load.TEST_DATA_FILE, load.TEST_HISTORICAL_DATA_FILE, features)
+    print drift.format_drift(drift.compare_profiles(drift.load_profile('training.json'), profile))
+"""
+from __future__ import division
+
+import collections
+import json
+import math
+import operator
+import random
+
+import numpy as np
+from scipy.stats import chi2
+
+import load
+import preprocessing
+
+SAMPLE_SIZE = 1000
+MAX_CATEGORIES = 1000
+OTHER_CATEGORY = '__other__'
+QUANTILES = range(0, 101, 5)
+PSI_BINS = 10
+
+PSI_THRESHOLD = 0.2
+MIN_PSI_SAMPLE_SIZE = 100
+# The chance that two samples of the same distribution exceed the raised threshold
+PSI_NOISE_P_VALUE = 0.001
+MISSING_RATE_TOLERANCE = 0.05
+COVERAGE_TOLERANCE = 0.05
+NEW_CATEGORY_RATE = 0.05
+MIN_CATEGORY_SHARE = 0.01
+
+# Keeps empty bins from giving an infinite PSI
+PSI_EPSILON = 1e-4
+
+Drift = collections.namedtuple('Drift', ['column', 'statistic', 'reference', 'current'])
+
+
+class ReservoirSample(object):
+    """A uniform sample of fixed size from a stream, by Li's algorithm L, which only draws random
+    numbers for the values that are kept"""
+
+    def __init__(self, size=SAMPLE_SIZE, rng=None):
+        self.size = size
+        self.rng = rng or random.Random(0)
+        self.values = []
+        self.seen = 0
+        self._w = None
+        self._next = None
+
+    def _skip(self):
+        self._w *= math.exp(math.log(self.rng.random()) / self.size)
+        self._next += int(math.floor(math.log(self.rng.random()) / math.log(1 - self._w))) + 1
+
+    def extend(self, values):
+        """Sample from the next values of the stream
+
+        :param list values:
+        """
+        start = self.seen
+        self.seen += len(values)
+        if len(self.values) < self.size:
+            self.values.extend(values[:self.size - len(self.values)])
+            if len(self.values) < self.size:
+                return
+        if self._next is None:
+            self._w = 1.0
+            self._next = self.size - 1
+            self._skip()
+        while self._next < self.seen:
+            self.values[self.rng.randrange(self.size)] = values[self._next - start]
+            self._skip()
+
+
+class DataProfile(object):
+    """Summaries of the columns of an extract and of its price history, updated a chunk of rows
+    at a time"""
+
+    def __init__(self, features, timeseries_features=load.TIMESERIES_FEATURES,
+                 sample_size=SAMPLE_SIZE, seed=0):
+        """
+        :param dict[str, dict[str, Any]] features: as returned by load.load_features, to tell
+            the dates and categories from the numeric columns
+        :param timeseries_features: the names of the timeseries in the price history
+        """
+        self.features = features
+        self.timeseries_features = timeseries_features
+        self.sample_size = sample_size
+        self.rng = random.Random(seed)
+        self.rows = 0
+        self.kinds = {}
+        self.missing = collections.Counter()
+        # The values of the numeric and date columns, unparsed until the summary
+        self.samples = {}
+        self.frequencies = {}
+        self.price_dates = collections.defaultdict(collections.Counter)
+        self.price_dates_missing = collections.defaultdict(collections.Counter)
+
+    def kind(self, column):
+        feature = self.features.get(column)
+        if feature is None or int(feature['is_categorical']):
+            return 'categorical'
+        return 'date' if int(feature['is_date']) else 'numeric'
+
+    def update(self, rows):
+        """Add a chunk of data rows, as read by load, before any transforms
+
+        :param list[dict[str, str]] rows:
+        """
+        if not rows:
+            return
+        self.rows += len(rows)
+        for column in rows[0]:
+            if column == 'id':
+                continue
+            if column not in self.kinds:
+                self.kinds[column] = self.kind(column)
+            values = map(operator.itemgetter(column), rows)
+            self.missing[column] += values.count('')
+            if self.kinds[column] == 'categorical':
+                self._count(column, values)
+            else:
+                sample = self.samples.get(column)
+                if sample is None:
+                    sample = self.samples[column] = ReservoirSample(self.sample_size, self.rng)
+                sample.extend([value for value in values if value != ''])
+
+    def _count(self, column, values):
+        frequencies = self.frequencies.setdefault(column, collections.Counter())
+        frequencies.update(values)
+        if len(frequencies) > MAX_CATEGORIES:
+            kept = dict(frequencies.most_common(MAX_CATEGORIES - 1))
+            other = sum(frequencies.itervalues()) - sum(kept.itervalues())
+            frequencies.clear()
+            frequencies.update(kept)
+            frequencies[OTHER_CATEGORY] += other
+
+    def update_historical(self, rows):
+        """Add a chunk of price history rows
+
+        :param list[dict[str, str]] rows:
+        """
+        dates = [row['price_date'] for row in rows]
+        for price_date, count in collections.Counter(dates).iteritems():
+            self.price_dates[price_date]['rows'] += count
+        # Prices are rarely missing, so count those rather than the ones present
+        for name in self.timeseries_features:
+            missing = collections.Counter(dates[i] for i, row in enumerate(rows)
+                                          if row[name] == '')
+            for price_date, count in missing.iteritems():
+                self.price_dates_missing[price_date][name] += count
+
+    def summary(self):
+        """The profile, in a form that can be saved as json
+
+        :rtype: dict[str, Any]
+        """
+        columns = {}
+        for column, kind in self.kinds.iteritems():
+            summary = {'kind': kind,
+                       'missing_rate': self.missing[column] / self.rows if self.rows else 0.0}
+            if kind == 'categorical':
+                summary['frequencies'] = dict(self.frequencies[column])
+            else:
+                parse = preprocessing.parse_date if kind == 'date' else float
+                # Values that can't be parsed are left out
+                sample = sorted(value for value in (_parse(parse, value)
+                                                    for value in self.samples[column].values)
+                                if not math.isnan(value))
+                summary['sample'] = sample
+                summary['quantiles'] = list(np.percentile(sample, QUANTILES)) if sample else []
+            columns[column] = summary
+        price_dates = {}
+        for price_date, counts in self.price_dates.iteritems():
+            missing = self.price_dates_missing[price_date]
+            coverage = {name: counts['rows'] - missing[name] for name in self.timeseries_features}
+            coverage['rows'] = counts['rows']
+            price_dates[price_date] = coverage
+        return {'rows': self.rows, 'columns': columns, 'price_dates': price_dates}
+
+
+def _parse(parse, value):
+    try:
+        return parse(value)
+    except ValueError:
+        return float('nan')
+
+
+def profile_files(data_file, historical_file=None, features=None, chunk_size=10000):
+    """Profile an extract, streaming the files a chunk at a time
+
+    :rtype: dict[str, Any]
+    """
+    profile = DataProfile(features if features is not None else load.load_features())
+    for chunk in load.iter_row_chunks(data_file, chunk_size):
+        profile.update(chunk)
+    if historical_file:
+        for chunk in load.iter_row_chunks(historical_file, chunk_size):
+            profile.update_historical(chunk)
+    return profile.summary()
+
+
+def save_profile(summary, file_path):
+    with open(file_path, 'w') as f:
+        json.dump(summary, f)
+
+
+def load_profile(file_path):
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def population_stability_index(reference, current):
+    """
+    :param np.array reference: the proportions in each bin
+    :param np.array current:
+    :rtype: float
+    """
+    reference = np.maximum(reference, PSI_EPSILON)
+    current = np.maximum(current, PSI_EPSILON)
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+
+def sample_psi(reference_sample, current_sample, bins=PSI_BINS):
+    """The PSI of two samples, binned by the quantiles of the reference sample"""
+    edges = np.unique(np.percentile(reference_sample, np.linspace(0, 100, bins + 1)[1:-1]))
+
+    def proportions(sample):
+        counts = np.bincount(np.searchsorted(edges, sample, side='right'),
+                             minlength=len(edges) + 1)
+        return counts / len(sample)
+
+    return population_stability_index(proportions(reference_sample), proportions(current_sample))
+
+
+def sample_psi_threshold(reference_size, current_size, psi_threshold=PSI_THRESHOLD,
+                         bins=PSI_BINS, p_value=PSI_NOISE_P_VALUE):
+    """The PSI threshold for samples of the given sizes: psi_threshold plus the PSI that two
+    samples of the same distribution exceed with probability p_value. PSI * n1 n2 / (n1 + n2) is
+    about chi-squared distributed, with bins - 1 degrees of freedom.
+
+    :rtype: float
+    """
+    noise = chi2.ppf(1 - p_value, bins - 1) * (1 / reference_size + 1 / current_size)
+    return psi_threshold + noise
+
+
+def frequency_psi(reference_frequencies, current_frequencies,
+                  min_category_share=MIN_CATEGORY_SHARE):
+    """The PSI of two category frequencies. The categories with less than min_category_share of
+    the reference, or not in it, share a bin, as the PSI of sparse categories is mostly noise."""
+    total = sum(reference_frequencies.itervalues())
+    categories = sorted(category for category, count in reference_frequencies.iteritems()
+                        if count >= min_category_share * total)
+
+    def proportions(frequencies):
+        counts = [frequencies.get(category, 0) for category in categories]
+        counts.append(sum(frequencies.itervalues()) - sum(counts))
+        counts = np.array(counts, dtype=float)
+        return counts / counts.sum()
+
+    return population_stability_index(proportions(reference_frequencies),
+                                      proportions(current_frequencies))
+
+
+def _coverage(price_dates, name):
+    rows = sum(coverage['rows'] for coverage in price_dates.itervalues())
+    return sum(coverage.get(name, 0) for coverage in price_dates.itervalues()) / rows
+
+
+def compare_profiles(reference, current, psi_threshold=PSI_THRESHOLD,
+                     missing_rate_tolerance=MISSING_RATE_TOLERANCE,
+                     coverage_tolerance=COVERAGE_TOLERANCE, new_category_rate=NEW_CATEGORY_RATE):
+    """Flag the drift of an extract from the reference, e.g. training, extract
+
+    :param dict[str, Any] reference: as returned by DataProfile.summary
+    :param dict[str, Any] current:
+    :rtype: list[Drift]
+    """
+    drifts = []
+    reference_columns, current_columns = reference['columns'], current['columns']
+    for column in sorted(set(reference_columns) - set(current_columns)):
+        drifts.append(Drift(column, 'removed', True, False))
+    for column in sorted(set(current_columns) - set(reference_columns)):
+        drifts.append(Drift(column, 'added', False, True))
+
+    for column in sorted(set(reference_columns) & set(current_columns)):
+        before, after = reference_columns[column], current_columns[column]
+        if abs(after['missing_rate'] - before['missing_rate']) > missing_rate_tolerance:
+            drifts.append(Drift(column, 'missing_rate', before['missing_rate'],
+                                after['missing_rate']))
+
+        if before['kind'] == 'categorical':
+            psi = frequency_psi(before['frequencies'], after['frequencies'])
+            total = sum(after['frequencies'].itervalues())
+            new = sum(count for category, count in after['frequencies'].iteritems()
+                      if category not in before['frequencies'])
+            if total and new / total > new_category_rate:
+                drifts.append(Drift(column, 'new_categories', 0.0, new / total))
+            threshold = psi_threshold
+        elif min(len(before['sample']), len(after['sample'])) >= MIN_PSI_SAMPLE_SIZE:
+            psi = sample_psi(before['sample'], after['sample'])
+            threshold = sample_psi_threshold(len(before['sample']), len(after['sample']),
+                                             psi_threshold)
+        else:
+            continue
+        if psi > threshold:
+            drifts.append(Drift(column, 'psi', 0.0, psi))
+
+    before_dates, after_dates = reference['price_dates'], current['price_dates']
+    if before_dates and after_dates:
+        if len(before_dates) != len(after_dates):
+            drifts.append(Drift('price_date', 'dates', len(before_dates), len(after_dates)))
+        names = set(key for price_dates in (before_dates, after_dates)
+                    for coverage in price_dates.itervalues() for key in coverage) - {'rows'}
+        for name in sorted(names):
+            before_coverage = _coverage(before_dates, name)
+            after_coverage = _coverage(after_dates, name)
+            if abs(after_coverage - before_coverage) > coverage_tolerance:
+                drifts.append(Drift(name, 'coverage', before_coverage, after_coverage))
+    return drifts
+
+
+def format_drift(drifts):
+    """
+    :param list[Drift] drifts:
+    :rtype: str
+    """
+    if not drifts:
+        return 'No drift'
+    lines = ['%-30s %-15s %12s %12s' % ('column', 'statistic', 'reference', 'current')]
+    for drift in drifts:
+        lines.append('%-30s %-15s %12s %12s' % (drift.column, drift.statistic,
+                                                _format_value(drift.reference),
+                                                _format_value(drift.current)))
+    return '\n'.join(lines)
+
+
+def _format_value(value):
+    return '%.4g' % value if isinstance(value, float) else str(value)
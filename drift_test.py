@@ -0,0 +1,145 @@
+import random
+import unittest
+
+import numpy as np
+
+import drift
+import fixtures
+
+
+def feature(is_date=0, is_categorical=0):
+    return {'is_date': is_date, 'is_categorical': is_categorical}
+
+
+class DriftTest(unittest.TestCase):
+
+    features = {'id': feature(is_categorical=1), 'date_activ': feature(is_date=1),
+                'cons_12m': feature(), 'channel_sales': feature(is_categorical=1)}
+    timeseries_features = ['price_p1_var']
+
+    def rows(self, n, seed=0, shift=0.0, missing_rate=0.0, channels='abc'):
+        rng = random.Random(seed)
+        return [{'id': 'id%d' % i,
+                 'date_activ': '2012-%02d-%02d' % (rng.randint(1, 12), rng.randint(1, 28)),
+                 'cons_12m': '' if rng.random() < missing_rate else str(rng.gauss(shift, 1)),
+                 'channel_sales': rng.choice(channels)} for i in range(n)]
+
+    def historical_rows(self, n, missing_rate=0.0, seed=0):
+        rng = random.Random(seed)
+        return [{'id': 'id%d' % i, 'price_date': '2015-%02d-01' % month,
+                 'price_p1_var': '' if rng.random() < missing_rate else '0.1'}
+                for i in range(n) for month in range(1, 13)]
+
+    def profile(self, rows, historical_rows=None, chunk_size=1000):
+        profile = drift.DataProfile(self.features, self.timeseries_features)
+        for start in range(0, len(rows), chunk_size):
+            profile.update(rows[start:start + chunk_size])
+        if historical_rows:
+            profile.update_historical(historical_rows)
+        return profile.summary()
+
+    def test_reservoir_sample_is_uniform(self):
+        counts = np.zeros(100)
+        for seed in range(200):
+            sample = drift.ReservoirSample(10, random.Random(seed))
+            for start in range(0, 100, 7):
+                sample.extend(range(start, min(start + 7, 100)))
+            self.assertEqual(10, len(sample.values))
+            self.assertEqual(10, len(set(sample.values)))
+            self.assertEqual(100, sample.seen)
+            counts[sample.values] += 1
+        # Each value is kept with probability 0.1, so about 20 times out of 200
+        self.assertLess(np.abs(counts - 20).max(), 20)
+        self.assertGreater(counts[:50].sum() / counts.sum(), 0.4)
+        self.assertLess(counts[:50].sum() / counts.sum(), 0.6)
+
+    def test_summary(self):
+        summary = self.profile(self.rows(3000, missing_rate=0.1),
+                               self.historical_rows(100, missing_rate=0.5))
+
+        self.assertEqual(3000, summary['rows'])
+        columns = summary['columns']
+        self.assertEqual({'date_activ', 'cons_12m', 'channel_sales'}, set(columns))
+        self.assertAlmostEqual(0.1, columns['cons_12m']['missing_rate'], delta=0.02)
+        self.assertEqual(0.0, columns['date_activ']['missing_rate'])
+        self.assertEqual('numeric', columns['cons_12m']['kind'])
+        self.assertEqual('date', columns['date_activ']['kind'])
+        self.assertEqual(set('abc'), set(columns['channel_sales']['frequencies']))
+        self.assertEqual(3000, sum(columns['channel_sales']['frequencies'].values()))
+        # The sample leaves out missing values
+        self.assertLessEqual(len(columns['cons_12m']['sample']), drift.SAMPLE_SIZE)
+        self.assertGreater(len(columns['cons_12m']['sample']), 0.8 * drift.SAMPLE_SIZE)
+        self.assertAlmostEqual(0.0, columns['cons_12m']['quantiles'][10], delta=0.15)
+
+        self.assertEqual(12, len(summary['price_dates']))
+        january = summary['price_dates']['2015-01-01']
+        self.assertEqual(100, january['rows'])
+        self.assertAlmostEqual(50, january['price_p1_var'], delta=15)
+
+    def test_categories_are_bounded(self):
+        rows = self.rows(10, channels='ab')
+        for i, row in enumerate(rows):
+            row['channel_sales'] = str(i % 3)
+        original, drift.MAX_CATEGORIES = drift.MAX_CATEGORIES, 2
+        try:
+            frequencies = self.profile(rows)['columns']['channel_sales']['frequencies']
+        finally:
+            drift.MAX_CATEGORIES = original
+        self.assertEqual(2, len(frequencies))
+        self.assertEqual(10, sum(frequencies.values()))
+        self.assertIn(drift.OTHER_CATEGORY, frequencies)
+
+    def test_no_drift_between_samples_of_the_same_extract(self):
+        reference = self.profile(self.rows(5000, seed=0), self.historical_rows(100))
+        current = self.profile(self.rows(2000, seed=1), self.historical_rows(40))
+        self.assertEqual([], drift.compare_profiles(reference, current))
+        self.assertEqual('No drift', drift.format_drift([]))
+
+    def test_no_drift_between_samples_of_sparse_columns(self):
+        # Generated from the distributions of the real extract, in which forecast_bill_12m and
+        # date_first_activ are mostly missing
+        features = fixtures.features()
+
+        def profile(rows):
+            profile = drift.DataProfile(features)
+            profile.update(rows)
+            return profile.summary()
+
+        reference = profile(fixtures.random_data_rows(seed=0, n=4000))
+        current = profile(fixtures.random_data_rows(seed=2, n=1000))
+        self.assertLess(len(current['columns']['forecast_bill_12m']['sample']), 300)
+        self.assertEqual([], drift.compare_profiles(reference, current))
+
+    def test_drift(self):
+        reference = self.profile(self.rows(5000, seed=0), self.historical_rows(100))
+        current = self.profile(self.rows(2000, seed=1, shift=1.0, missing_rate=0.2,
+                                         channels='abcd'),
+                               self.historical_rows(40, missing_rate=0.3))
+        flagged = {(d.column, d.statistic) for d in drift.compare_profiles(reference, current)}
+
+        self.assertEqual({('cons_12m', 'missing_rate'), ('cons_12m', 'psi'),
+                          ('channel_sales', 'new_categories'), ('channel_sales', 'psi'),
+                          ('price_p1_var', 'coverage')}, flagged)
+
+    def test_columns_added_and_removed(self):
+        reference = self.profile(self.rows(100))
+        rows = self.rows(100)
+        for row in rows:
+            row['forecast_meter_rent_12m'] = row.pop('cons_12m')
+        drifts = drift.compare_profiles(reference, self.profile(rows))
+
+        self.assertEqual([drift.Drift('cons_12m', 'removed', True, False),
+                          drift.Drift('forecast_meter_rent_12m', 'added', False, True)], drifts)
+        self.assertIn('forecast_meter_rent_12m', drift.format_drift(drifts))
+
+    def test_population_stability_index(self):
+        self.assertEqual(0.0, drift.population_stability_index(np.array([0.5, 0.5]),
+                                                                np.array([0.5, 0.5])))
+        rng = np.random.RandomState(0)
+        self.assertLess(drift.sample_psi(rng.normal(size=2000), rng.normal(size=2000)), 0.05)
+        self.assertGreater(drift.sample_psi(rng.normal(size=2000), rng.normal(1, size=2000)),
+                           drift.PSI_THRESHOLD)
+
+
+if __name__ == '__main__':
+    unittest.main()
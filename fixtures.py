@@ -0,0 +1,189 @@
+"""Test data shared by the test modules, built once per test run
+
+The real training extract at the root of the repository is parsed and preprocessed on first use
+and kept for the rest of the run, however many tests or test modules ask for it. The repository
+doesn't ship the price history, so a history is generated for the training ids with a fixed seed,
+unless hist_data.csv is there too.
+
+Tests get views of the shared data: each call returns new RowViews of the rows, so writes to them
+stay in the test, and non-writeable views of the arrays. The timeseries dicts inside the rows are
+shared, and mustn't be modified.
+
+The preprocessed matrix can also come from a feature cache, a dataset file as written by
+dataset.write_dataset or main.write_model_dataset. Name it in the FIXTURES_FEATURE_CACHE
+environment variable: the first run writes it if it doesn't exist, later runs memory map it.
+
+    X, y, columns = fixtures.model_data()
+    rows = fixtures.random_data_rows(seed=3, n=50)
+"""
+import os
+
+import numpy as np
+
+import dataset
+import generate
+import load
+import preprocessing
+import rowview
+
+DATA_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+FEATURE_CACHE_VARIABLE = 'FIXTURES_FEATURE_CACHE'
+HISTORICAL_SEED = 0
+HISTORICAL_MONTHS = 12
+
+_cache = {}
+
+
+def _cached(name, build):
+    if name not in _cache:
+        _cache[name] = build()
+    return _cache[name]
+
+
+def _path(file_name):
+    return os.path.join(DATA_DIRECTORY, file_name)
+
+
+def read_only(array):
+    """A view of an array that can't be written through
+
+    :rtype: np.array
+    """
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def _row_views(rows):
+    return [rowview.RowView(row) for row in rows]
+
+
+def features():
+    """
+    :rtype: dict[str, dict[str, str]]
+    """
+    loaded = _cached('features', lambda: {row['name']: row for row in
+                                          load.extract_rows(_path(load.FEATURES_FILE))})
+    return {name: dict(feature) for name, feature in loaded.iteritems()}
+
+
+def _loaded_data_rows():
+    return _cached('data_rows', lambda: load.extract_rows(_path(load.TRAINING_DATA_FILE)))
+
+
+def data_rows():
+    """The rows of the real training extract, as read by load
+
+    :rtype: list[rowview.RowView]
+    """
+    return _row_views(_loaded_data_rows())
+
+
+def label_rows():
+    """
+    :rtype: list[dict[str, Any]]
+    """
+    def build():
+        ids = [row['id'] for row in data_rows()]
+        return load.label_rows(ids, load.load_label_values(_path(load.TRAINING_LABELS_FILE)))
+
+    return [dict(row) for row in _cached('label_rows', build)]
+
+
+def _build_historical_rows():
+    file_path = _path(load.TRAINING_HISTORICAL_DATA_FILE)
+    if os.path.exists(file_path):
+        return load.extract_rows(file_path)
+    rng = np.random.RandomState(HISTORICAL_SEED)
+    ids = [row['id'] for row in data_rows()]
+    dates = generate.historical_dates(HISTORICAL_MONTHS)
+    return [dict(zip(generate.HISTORICAL_COLUMNS, row))
+            for row in generate.historical_rows(rng, ids, dates)]
+
+
+def historical_rows():
+    """The price history of the training customers, grouped by id
+
+    :rtype: list[rowview.RowView]
+    """
+    return _row_views(_cached('historical_rows', _build_historical_rows))
+
+
+def timeseries_rows():
+    """The historical rows collected into timeseries, as by preprocessing.extract_timeseries_rows
+
+    :rtype: list[rowview.RowView]
+    """
+    return _row_views(_cached('timeseries_rows', lambda: preprocessing.extract_timeseries_rows(
+        historical_rows(), features(), load.TIMESERIES_FEATURES)))
+
+
+def _build_model_data():
+    rows = preprocessing.transform_dates(data_rows(), features())
+    rows, model_features = preprocessing.add_timeseries_features(
+        rows, timeseries_rows(), features(), load.TIMESERIES_FEATURES)
+    X, y = preprocessing.labelled_training_data(rows, label_rows(), model_features,
+                                                load.LABEL_NAME)
+    return X, y, preprocessing.model_columns(rows[0], model_features)
+
+
+def _load_model_data():
+    feature_cache = os.environ.get(FEATURE_CACHE_VARIABLE)
+    if not feature_cache:
+        return _build_model_data()
+    if not os.path.exists(feature_cache):
+        X, y, columns = _build_model_data()
+        dataset.write_dataset(feature_cache, X, columns, y)
+    model_dataset = dataset.open_dataset(feature_cache)
+    return model_dataset.X, model_dataset.y, model_dataset.columns
+
+
+def model_data():
+    """The vectorised training data, with dates transformed and timeseries features added
+
+    :return: X, y and the feature name of each column of X
+    :rtype: tuple[np.array[np.float64], np.array[np.float64], list[str]]
+    """
+    X, y, columns = _cached('model_data', _load_model_data)
+    return read_only(X), read_only(y), list(columns)
+
+
+def _spec():
+    def build():
+        rows = _loaded_data_rows()
+        columns = sorted(rows[0])
+        return columns, generate.profile_columns(rows, features(), columns)
+
+    return _cached('spec', build)
+
+
+def random_data_rows(seed, n):
+    """Data rows sampled from the distributions of the real extract, including missing values
+
+    :param int seed:
+    :param int n:
+    :rtype: list[dict[str, str]]
+    """
+    rng = np.random.RandomState(seed)
+    columns, spec = _spec()
+    values = [generate.sample_column(rng, spec[column], n) for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def random_historical_rows(seed, ids, months=HISTORICAL_MONTHS):
+    """Price histories for the ids, grouped by id, with missing and zero prices. The dates of each
+    id are shuffled, as nothing guarantees their order.
+
+    :param int seed:
+    :param list[str] ids:
+    :rtype: list[dict[str, str]]
+    """
+    rng = np.random.RandomState(seed)
+    rows = [dict(zip(generate.HISTORICAL_COLUMNS, row)) for row in
+            generate.historical_rows(rng, ids, generate.historical_dates(months))]
+    output = []
+    for start in range(0, len(rows), months):
+        id_rows = rows[start:start + months]
+        rng.shuffle(id_rows)
+        output.extend(id_rows)
+    return output
@@ -0,0 +1,245 @@
+"""Generate synthetic datasets with the same schema as the real extracts.
+
+The column types come from features.csv and the distributions (category frequencies, numeric and
+date quantiles, missing-value rates) are profiled from a sample extract, train_data.csv by default.
+Rows are generated and written in chunks so the output can be much larger than memory.
+"""
+from __future__ import division
+
+import argparse
+import binascii
+import csv
+from datetime import date
+import os
+
+import numpy as np
+
+import compression
+import load
+
+HISTORICAL_COLUMNS = ['id', 'price_date'] + load.TIMESERIES_FEATURES
+
+# Plausible (low, high) starting prices for each historical series, with the fraction of customers
+# whose tariff doesn't use the series (a constant zero price, which make_xy filters out)
+HISTORICAL_PRICE_RANGES = {
+    'price_p1_var': (0.1, 0.2, 0.0),
+    'price_p2_var': (0.08, 0.11, 0.45),
+    'price_p3_var': (0.06, 0.08, 0.55),
+    'price_p1_fix': (40.0, 45.0, 0.0),
+    'price_p2_fix': (16.0, 25.0, 0.45),
+    'price_p3_fix': (10.0, 17.0, 0.55),
+}
+HISTORICAL_MISSING_RATE = 0.007
+HISTORICAL_START = date(2015, 1, 1)
+HISTORICAL_MONTHS = 12
+
+CHURN_RATE = 0.1
+CHUNK_SIZE = 10000
+QUANTILES = 101
+MAX_DECIMALS = 8
+
+
+def profile_columns(rows, features, columns):
+    """Describe the distribution of each column so that it can be sampled from
+
+    :param list[dict[str, str]] rows: a sample of raw rows, as returned by load.extract_rows
+    :param dict[str, dict[str, str]] features:
+    :param list[str] columns: the column names, in file order
+    :rtype: dict[str, dict[str, Any]]
+    """
+    spec = {}
+    for column in columns:
+        values = [row[column] for row in rows]
+        present = [value for value in values if value != '']
+        column_spec = {'missing_rate': 1 - len(present) / len(values) if values else 0.0}
+        feature = features[column]
+
+        if column == 'id':
+            column_spec['kind'] = 'id'
+        elif int(feature['is_categorical']):
+            categories = sorted(set(present))
+            counts = np.array([present.count(category) for category in categories], dtype=float)
+            column_spec.update({'kind': 'categorical', 'categories': categories,
+                                'weights': list(counts / counts.sum()) if present else []})
+        elif int(feature['is_date']):
+            ordinals = [_parse_ordinal(value) for value in present]
+            column_spec.update({'kind': 'date', 'quantiles': _quantiles(ordinals)})
+        else:
+            column_spec.update({'kind': 'numeric', 'quantiles': _quantiles(map(float, present)),
+                                'decimals': max([_decimals(value) for value in present] or [0])})
+        spec[column] = column_spec
+    return spec
+
+
+def _parse_ordinal(value):
+    year, month, day = map(int, value.split('-'))
+    return date(year, month, day).toordinal()
+
+
+def _quantiles(values):
+    if not values:
+        return []
+    return list(np.percentile(values, np.linspace(0, 100, QUANTILES)))
+
+
+def _decimals(value):
+    if 'e' in value.lower() or '.' not in value:
+        return 0
+    return min(len(value.split('.')[1]), MAX_DECIMALS)
+
+
+def load_spec(sample_file=load.TRAINING_DATA_FILE):
+    """Profile the sample extract
+
+    :rtype: tuple[list[str], dict[str, dict[str, Any]]]
+    """
+    with compression.open_file(sample_file) as f:
+        columns = csv.reader(f).next()
+    rows = load.extract_rows(sample_file)
+    return columns, profile_columns(rows, load.load_features(), columns)
+
+
+def random_ids(rng, n):
+    return [binascii.hexlify(rng.bytes(16)) for _ in xrange(n)]
+
+
+def sample_column(rng, column_spec, n):
+    """Sample n string values for a column
+
+    :param np.random.RandomState rng:
+    :param dict[str, Any] column_spec: as produced by profile_columns
+    :param int n:
+    :rtype: list[str]
+    """
+    kind = column_spec['kind']
+    if kind == 'id':
+        return random_ids(rng, n)
+
+    if kind == 'categorical':
+        if column_spec['categories']:
+            codes = rng.choice(len(column_spec['categories']), size=n, p=column_spec['weights'])
+            values = [column_spec['categories'][code] for code in codes]
+        else:
+            values = [''] * n
+    elif not column_spec['quantiles']:
+        values = [''] * n
+    else:
+        grid = np.linspace(0, 100, len(column_spec['quantiles']))
+        samples = np.interp(rng.uniform(0, 100, n), grid, column_spec['quantiles'])
+        if kind == 'date':
+            values = [date.fromordinal(int(sample)).isoformat() for sample in samples]
+        elif column_spec['decimals']:
+            values = [repr(round(sample, column_spec['decimals'])) for sample in samples]
+        else:
+            values = [str(int(round(sample))) for sample in samples]
+
+    missing = rng.random_sample(n) < column_spec['missing_rate']
+    return ['' if is_missing else value for value, is_missing in zip(values, missing)]
+
+
+def historical_dates(months=HISTORICAL_MONTHS, start=HISTORICAL_START):
+    dates = []
+    for i in xrange(months):
+        year, month = divmod(start.month - 1 + i, 12)
+        dates.append(date(start.year + year, month + 1, 1).isoformat())
+    return dates
+
+
+def historical_rows(rng, ids, dates):
+    """Yield the price history of each customer, grouped by id and ordered by date
+
+    Prices follow a random walk with occasional jumps, as tariffs are revised.
+    """
+    for _id in ids:
+        series = {}
+        for name in load.TIMESERIES_FEATURES:
+            low, high, unused_rate = HISTORICAL_PRICE_RANGES[name]
+            if rng.random_sample() < unused_rate:
+                series[name] = np.zeros(len(dates))
+                continue
+            steps = rng.normal(0, (high - low) * 0.01, len(dates))
+            jumps = (rng.random_sample(len(dates)) < 0.1) * rng.normal(0, (high - low) * 0.1,
+                                                                     len(dates))
+            steps[0] = rng.uniform(low, high)
+            series[name] = np.maximum(np.cumsum(steps + jumps), 0)
+
+        for i, price_date in enumerate(dates):
+            row = [_id, price_date]
+            for name in load.TIMESERIES_FEATURES:
+                missing = rng.random_sample() < HISTORICAL_MISSING_RATE
+                row.append('' if missing else repr(round(series[name][i], 6)))
+            yield row
+
+
+def write_dataset(data_file, historical_file, n_rows, columns, spec, rng, labels_file=None,
+                  churn_rate=CHURN_RATE, months=HISTORICAL_MONTHS, chunk_size=CHUNK_SIZE,
+                  file_compression=None):
+    """Stream a synthetic extract, its price history and optionally its labels to disk
+
+    :param str file_compression: if given, compress the files, e.g. compression.GZIP
+    """
+    dates = historical_dates(months)
+
+    def open_file(file_path):
+        return compression.open_file(file_path, 'wb', file_compression)
+
+    labels = open_file(labels_file) if labels_file else None
+    try:
+        with open_file(data_file) as data_f, open_file(historical_file) as historical_f:
+            data_writer = csv.writer(data_f)
+            historical_writer = csv.writer(historical_f)
+            data_writer.writerow(columns)
+            historical_writer.writerow(HISTORICAL_COLUMNS)
+
+            for chunk_start in xrange(0, n_rows, chunk_size):
+                n = min(chunk_size, n_rows - chunk_start)
+                values = {column: sample_column(rng, spec[column], n) for column in columns}
+                data_writer.writerows(zip(*[values[column] for column in columns]))
+                historical_writer.writerows(historical_rows(rng, values['id'], dates))
+                if labels:
+                    churned = rng.random_sample(n) < churn_rate
+                    labels.writelines('%d\n' % label for label in churned)
+    finally:
+        if labels:
+            labels.close()
+
+
+def generate(directory, n_training_rows, n_test_rows=0, seed=0, churn_rate=CHURN_RATE,
+             months=HISTORICAL_MONTHS, sample_file=load.TRAINING_DATA_FILE, file_compression=None):
+    """Write synthetic training and test files to a directory, named as the load module expects
+
+    The same seed always produces the same files. Compressed files keep the same names, since
+    the loader recognises them from their contents.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    columns, spec = load_spec(sample_file)
+
+    def path(name):
+        return os.path.join(directory, name)
+
+    print 'Generating %s training rows' % n_training_rows
+    write_dataset(path(load.TRAINING_DATA_FILE), path(load.TRAINING_HISTORICAL_DATA_FILE),
+                  n_training_rows, columns, spec, np.random.RandomState(seed),
+                  labels_file=path(load.TRAINING_LABELS_FILE), churn_rate=churn_rate,
+                  months=months, file_compression=file_compression)
+    if n_test_rows:
+        print 'Generating %s test rows' % n_test_rows
+        write_dataset(path(load.TEST_DATA_FILE), path(load.TEST_HISTORICAL_DATA_FILE),
+                      n_test_rows, columns, spec, np.random.RandomState(seed + 1), months=months,
+                      file_compression=file_compression)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('training_rows', type=int)
+    parser.add_argument('--test-rows', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--churn-rate', type=float, default=CHURN_RATE)
+    parser.add_argument('--months', type=int, default=HISTORICAL_MONTHS)
+    parser.add_argument('--sample', default=load.TRAINING_DATA_FILE)
+    parser.add_argument('--compression', choices=sorted(compression.EXTENSIONS))
+    args = parser.parse_args()
+    generate(args.directory, args.training_rows, args.test_rows, args.seed, args.churn_rate,
+             args.months, args.sample, args.compression)
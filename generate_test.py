@@ -0,0 +1,91 @@
+from itertools import groupby
+import os
+import shutil
+import tempfile
+import unittest
+
+import compression
+import generate
+import load
+
+
+class GenerateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_schema(self):
+        generate.generate(self.directory, 50, 20, seed=1, months=3)
+
+        with open(load.TRAINING_DATA_FILE) as f:
+            expected_header = f.readline()
+        with open(self.path(load.TRAINING_DATA_FILE)) as f:
+            self.assertEqual(expected_header, f.readline())
+
+        rows = load.extract_rows(self.path(load.TRAINING_DATA_FILE))
+        self.assertEqual(50, len(rows))
+        self.assertEqual(50, len(set(row['id'] for row in rows)))
+        self.assertTrue(all(len(row['id']) == 32 for row in rows))
+        self.assertTrue(all(row['campaign_disc_ele'] == '' for row in rows))
+        self.assertTrue(all(row['has_gas'] in ('t', 'f') for row in rows))
+
+        with open(self.path(load.TRAINING_LABELS_FILE)) as f:
+            labels = [int(line) for line in f]
+        self.assertEqual(50, len(labels))
+        self.assertTrue(set(labels) <= {0, 1})
+
+        self.assertEqual(20, len(load.extract_rows(self.path(load.TEST_DATA_FILE))))
+
+    def test_historical_rows_grouped_by_id(self):
+        generate.generate(self.directory, 30, seed=2, months=4)
+
+        ids = [row['id'] for row in load.extract_rows(self.path(load.TRAINING_DATA_FILE))]
+        historical = load.extract_rows(self.path(load.TRAINING_HISTORICAL_DATA_FILE))
+        grouped = [(_id, [row['price_date'] for row in rows])
+                   for _id, rows in groupby(historical, key=lambda row: row['id'])]
+
+        self.assertEqual(ids, [_id for _id, _ in grouped])
+        for _, dates in grouped:
+            self.assertEqual(['2015-01-01', '2015-02-01', '2015-03-01', '2015-04-01'], dates)
+
+    def test_reproducible(self):
+        first = os.path.join(self.directory, 'first')
+        second = os.path.join(self.directory, 'second')
+        generate.generate(first, 40, seed=3, months=2)
+        generate.generate(second, 40, seed=3, months=2)
+
+        for name in (load.TRAINING_DATA_FILE, load.TRAINING_HISTORICAL_DATA_FILE,
+                     load.TRAINING_LABELS_FILE):
+            with open(os.path.join(first, name)) as f, open(os.path.join(second, name)) as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_compressed_files_load_like_plain_files(self):
+        plain = os.path.join(self.directory, 'plain')
+        compressed = os.path.join(self.directory, 'compressed')
+        generate.generate(plain, 40, seed=4, months=2)
+        generate.generate(compressed, 40, seed=4, months=2, file_compression=compression.GZIP)
+
+        for name in (load.TRAINING_DATA_FILE, load.TRAINING_HISTORICAL_DATA_FILE):
+            path = os.path.join(compressed, name)
+            self.assertEqual(compression.GZIP, compression.detect_compression(path))
+            self.assertEqual(load.extract_rows(os.path.join(plain, name)), load.extract_rows(path))
+        self.assertEqual(
+            load.load_label_values(os.path.join(plain, load.TRAINING_LABELS_FILE)),
+            load.load_label_values(os.path.join(compressed, load.TRAINING_LABELS_FILE)))
+
+    def test_compressed_sample_file(self):
+        path = os.path.join(self.directory, 'sample.csv.gz')
+        with open(load.TRAINING_DATA_FILE, 'rb') as f, \
+                compression.open_file(path, 'wb') as g:
+            g.write(f.read())
+        self.assertEqual(generate.load_spec(), generate.load_spec(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
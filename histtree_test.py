@@ -0,0 +1,90 @@
+import cPickle
+import unittest
+
+import numpy as np
+
+import histtree
+
+
+class HistTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X = rng.normal(size=(3000, 5))
+        self.X[:, 3] = rng.randint(4, size=3000)
+        self.y = (self.X[:, 0] + self.X[:, 1] ** 2 + rng.normal(scale=0.5, size=3000) > 1)
+        self.y = self.y.astype(np.float64)
+
+    def test_quantile_bins(self):
+        binner = histtree.QuantileBinner(max_bins=16)
+        binned = binner.fit_transform(self.X)
+
+        self.assertEqual(np.uint8, binned.dtype)
+        self.assertTrue(binned.flags['F_CONTIGUOUS'])
+        self.assertEqual(16, binner.n_bins(0))
+        # A few distinct values get a bin each
+        self.assertEqual(4, binner.n_bins(3))
+        np.testing.assert_array_equal(self.X[:, 3], binned[:, 3])
+        # Quantile bins are about equally full, and keep the order of the values
+        counts = np.bincount(binned[:, 0])
+        self.assertLess(counts.max() - counts.min(), 0.01 * len(self.X))
+        order = np.argsort(self.X[:, 0])
+        self.assertTrue((np.diff(binned[order, 0].astype(int)) >= 0).all())
+
+    def test_separable_data_is_learnt_exactly(self):
+        y = (self.X[:, 3] >= 2).astype(np.float64)
+        clf = histtree.HistogramBaggingClassifier(n_estimators=1, bootstrap=False).fit(self.X, y)
+
+        np.testing.assert_array_equal(y, clf.predict(self.X))
+        self.assertEqual(3, clf.estimators_[0].node_count)
+
+    def test_sorted_splits_match_histogram_splits(self):
+        binned = histtree.QuantileBinner().fit_transform(self.X)
+        weights = np.random.RandomState(1).poisson(1, len(self.X)).astype(np.float64)
+        trees = []
+        for sorted_split_rows in (0, len(self.X)):
+            original, histtree.SORTED_SPLIT_ROWS = histtree.SORTED_SPLIT_ROWS, sorted_split_rows
+            try:
+                trees.append(histtree.HistogramTree(max_depth=6).fit_binned(binned, self.y,
+                                                                            weights))
+            finally:
+                histtree.SORTED_SPLIT_ROWS = original
+
+        for attribute in ('feature', 'split_bin', 'left', 'right', 'value'):
+            np.testing.assert_array_almost_equal(getattr(trees[0], attribute),
+                                                 getattr(trees[1], attribute))
+
+    def test_limits(self):
+        binned = histtree.QuantileBinner().fit_transform(self.X)
+        tree = histtree.HistogramTree(max_depth=3, min_samples_leaf=50).fit_binned(binned,
+                                                                                   self.y)
+        leaves = tree.leaves(binned)
+        self.assertLessEqual(tree.node_count, 15)
+        self.assertGreaterEqual(np.bincount(leaves)[np.unique(leaves)].min(), 50)
+
+    def test_classifier_interface(self):
+        y = np.where(self.y, 1.0, 0.0)
+        clf = histtree.HistogramBaggingClassifier(n_estimators=5, random_state=0)
+        clf.fit(self.X[:2000], y[:2000])
+        probabilities = clf.predict_proba(self.X[2000:])
+
+        np.testing.assert_array_equal([0.0, 1.0], clf.classes_)
+        self.assertEqual((1000, 2), probabilities.shape)
+        np.testing.assert_array_almost_equal(np.ones(1000), probabilities.sum(axis=1))
+        self.assertGreater((clf.predict(self.X[2000:]) == y[2000:]).mean(), 0.8)
+
+        restored = cPickle.loads(cPickle.dumps(clf, cPickle.HIGHEST_PROTOCOL))
+        np.testing.assert_array_equal(probabilities, restored.predict_proba(self.X[2000:]))
+
+    def test_reproducible(self):
+        first = histtree.HistogramBaggingClassifier(random_state=3).fit(self.X, self.y)
+        second = histtree.HistogramBaggingClassifier(random_state=3).fit(self.X, self.y)
+        np.testing.assert_array_equal(first.predict_proba(self.X), second.predict_proba(self.X))
+
+    def test_rejects_more_than_two_classes(self):
+        with self.assertRaises(ValueError):
+            histtree.HistogramBaggingClassifier().fit(self.X, np.arange(len(self.X)) % 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
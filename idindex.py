@@ -0,0 +1,129 @@
+"""An index from customer ids to dense integer positions, for joining data, labels and timeseries
+
+Ids get positions in the order they are first added, so joins through the index produce rows in
+a deterministic order. Optionally the 32 character hex ids are stored as 16 byte binary strings,
+halving the space taken by the keys.
+"""
+import binascii
+
+import numpy as np
+
+MISSING = -1
+
+
+class IdIndex(object):
+    """Positions of ids, in the order they were added"""
+
+    def __init__(self, ids=(), binary=False):
+        """
+        :param iterable ids: the ids to index. Repeated ids keep their first position.
+        :param bool binary: store the ids as 16 byte binary strings, which requires 32 character
+            hex ids
+        """
+        self.binary = binary
+        self._positions = {}
+        self._keys = []
+        for id in ids:
+            self.add(id)
+
+    @classmethod
+    def from_rows(cls, rows, key='id', binary=False):
+        """Index the ids of rows, so that an id's position is that of its first row
+
+        :param list[dict[str, Any]] rows:
+        :rtype: IdIndex
+        """
+        return cls((row[key] for row in rows), binary)
+
+    def _key(self, id):
+        if not self.binary:
+            return id
+        try:
+            return binascii.unhexlify(id)
+        except (TypeError, binascii.Error):
+            raise ValueError('%r is not a hex id' % (id,))
+
+    def add(self, id):
+        """Add an id if it is new
+
+        :return: The position of the id
+        :rtype: int
+        """
+        key = self._key(id)
+        position = self._positions.get(key)
+        if position is None:
+            position = len(self._keys)
+            self._positions[key] = position
+            self._keys.append(key)
+        return position
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, id):
+        try:
+            return self._key(id) in self._positions
+        except ValueError:
+            return False
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def position(self, id):
+        """
+        :rtype: int
+        :raises KeyError: if the id isn't in the index
+        """
+        try:
+            return self._positions[self._key(id)]
+        except ValueError:
+            raise KeyError(id)
+
+    def get(self, id, default=MISSING):
+        try:
+            return self.position(id)
+        except KeyError:
+            return default
+
+    def positions(self, ids):
+        """The position of each id, or MISSING for ids not in the index
+
+        :rtype: np.array[np.int64]
+        """
+        return np.array([self.get(id) for id in ids], dtype=np.int64)
+
+    def id(self, position):
+        key = self._keys[position]
+        return binascii.hexlify(key) if self.binary else key
+
+    @property
+    def ids(self):
+        """The ids in position order
+
+        :rtype: list
+        """
+        if self.binary:
+            return [binascii.hexlify(key) for key in self._keys]
+        return list(self._keys)
+
+    def binary_ids(self):
+        """The ids in position order as a fixed width array, e.g. to save with a dataset
+
+        :rtype: np.array
+        """
+        if not self.binary:
+            raise ValueError('The index does not store binary ids')
+        return np.array(self._keys, dtype='S16')
+
+    def align(self, rows, key='id'):
+        """The rows of another table in position order, None where a position has no row
+
+        :param list[dict[str, Any]] rows: e.g. the label rows
+        :rtype: list[dict[str, Any]]
+        """
+        aligned = [None] * len(self)
+        for row in rows:
+            position = self.get(row[key])
+            if position != MISSING and aligned[position] is None:
+                aligned[position] = row
+        return aligned
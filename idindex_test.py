@@ -0,0 +1,44 @@
+import unittest
+
+import idindex
+
+
+class IdIndexTest(unittest.TestCase):
+
+    ids = ['cf81de72ff7997ed10729751059cf7a3', '000381698491fec6983d55828fe5ada6',
+           'ffeba4728db570a69c39c53323a6a5b4']
+
+    def test_positions_in_order_added(self):
+        for binary in (False, True):
+            index = idindex.IdIndex(self.ids + self.ids[:1], binary=binary)
+            self.assertEqual(3, len(index))
+            self.assertEqual(self.ids, index.ids)
+            self.assertEqual(1, index.position(self.ids[1]))
+            self.assertEqual(self.ids[2], index.id(2))
+            self.assertIn(self.ids[0], index)
+            self.assertNotIn('unknown', index)
+            self.assertEqual(idindex.MISSING, index.get('unknown'))
+            self.assertEqual([2, idindex.MISSING, 0],
+                             list(index.positions([self.ids[2], 'unknown', self.ids[0]])))
+            with self.assertRaises(KeyError):
+                index.position('unknown')
+
+    def test_binary_ids(self):
+        index = idindex.IdIndex(self.ids, binary=True)
+        binary_ids = index.binary_ids()
+        self.assertEqual('S16', binary_ids.dtype.str[1:])
+        self.assertEqual(self.ids[0], binary_ids[0].encode('hex'))
+        with self.assertRaises(ValueError):
+            index.add('not hex')
+        with self.assertRaises(ValueError):
+            idindex.IdIndex(self.ids).binary_ids()
+
+    def test_align(self):
+        index = idindex.IdIndex.from_rows([{'id': 3}, {'id': 1}, {'id': 2}])
+        label_rows = [{'id': 1, 'churned': 0}, {'id': 4, 'churned': 1}, {'id': 3, 'churned': 1}]
+        self.assertEqual([{'id': 3, 'churned': 1}, {'id': 1, 'churned': 0}, None],
+                         index.align(label_rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
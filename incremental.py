@@ -0,0 +1,156 @@
+"""Keep the derived timeseries features up to date as new months of price history arrive
+
+Rather than keeping each customer's full history, a persisted state store keeps running
+aggregates of each timeseries: the first, last, max and min of the positive prices (the values
+make_xy keeps). Those are enough to compute every derived feature, since the sum of returns
+telescopes to the last price minus the first. Applying a delta file only reads and rewrites the
+state of the customers it touches.
+
+    refreshed_rows = incremental.apply_delta('timeseries_state', 'hist_data_2016_01.csv',
+                                             load.TIMESERIES_FEATURES)
+"""
+from contextlib import closing
+import copy
+import csv
+import shelve
+
+import compression
+import idindex
+import preprocessing
+
+INCREMENTAL_FEATURES = {
+    'max': lambda aggregates: aggregates['max'],
+    'min': lambda aggregates: aggregates['min'],
+    'range': lambda aggregates: aggregates['max'] - aggregates['min'],
+    'sum_returns': lambda aggregates: aggregates['last'] - aggregates['first'],
+}
+
+
+def new_customer_state(timeseries_features):
+    return {'last_date': None,
+            'timeseries': {name: None for name in timeseries_features}}
+
+
+def update_customer_state(customer_state, id_rows, timeseries_features):
+    """Fold a customer's new historical rows into their running aggregates
+
+    Only dates after the last date already processed can be applied. Restated history needs a
+    rebuild of the state.
+
+    :param dict[str, Any] customer_state: as returned by new_customer_state
+    :param list[dict[str, str]] id_rows: the customer's new historical rows
+    :param timeseries_features: the names of the timeseries
+    :raises ValueError: if a row is not newer than the customer's last processed date
+    """
+    dated_rows = sorted(((preprocessing.parse_date(row['price_date']), row) for row in id_rows),
+                        key=lambda dated_row: dated_row[0])
+    for timestamp, row in dated_rows:
+        if customer_state['last_date'] is not None and timestamp <= customer_state['last_date']:
+            raise ValueError('Price history for %s on %s has already been processed'
+                             % (row['id'], row['price_date']))
+        customer_state['last_date'] = timestamp
+
+        for name in timeseries_features:
+            value = float(row[name] or 0)
+            if value <= 0.0:
+                continue
+            aggregates = customer_state['timeseries'].get(name)
+            if aggregates is None:
+                customer_state['timeseries'][name] = {'first': value, 'last': value,
+                                                      'max': value, 'min': value}
+            else:
+                aggregates['last'] = value
+                aggregates['max'] = max(aggregates['max'], value)
+                aggregates['min'] = min(aggregates['min'], value)
+    return customer_state
+
+
+def customer_features(customer_state, new_feature_names=None):
+    """The derived timeseries features of a customer, as add_timeseries_features would compute
+    them from their full history
+
+    :rtype: dict[str, float]
+    """
+    feature_names = new_feature_names or sorted(INCREMENTAL_FEATURES)
+    output = {}
+    for timeseries_name, aggregates in customer_state['timeseries'].iteritems():
+        for feature_name in feature_names:
+            value = INCREMENTAL_FEATURES[feature_name](aggregates) if aggregates else 0
+            output[timeseries_name + '_' + feature_name] = value
+    return output
+
+
+def update_state(state, delta_rows, timeseries_features):
+    """Apply historical rows to a state store
+
+    :param state: a mapping from id to customer state, e.g. an open shelf
+    :param iterable[dict[str, str]] delta_rows: the new historical rows, in any order
+    :param timeseries_features: the names of the timeseries
+    :return: The ids of the customers updated
+    :rtype: list[str]
+    :raises ValueError: if the delta has already been applied, in which case the state is left as
+        it was
+    """
+    rows_by_id = {}
+    for row in delta_rows:
+        rows_by_id.setdefault(row['id'], []).append(row)
+
+    # Every customer is updated before any is written, so a delta applies in full or not at all
+    new_states = {}
+    for id, id_rows in rows_by_id.iteritems():
+        customer_state = copy.deepcopy(state.get(id)) or new_customer_state(timeseries_features)
+        new_states[id] = update_customer_state(customer_state, id_rows, timeseries_features)
+    for id, customer_state in new_states.iteritems():
+        state[id] = customer_state
+    return sorted(rows_by_id)
+
+
+def feature_rows(state, ids, new_feature_names=None):
+    """Feature rows for the given customers, ready to merge into the data rows
+
+    :rtype: list[dict[str, Any]]
+    """
+    output = []
+    for id in ids:
+        output_row = customer_features(state[id], new_feature_names)
+        output_row['id'] = id
+        output.append(output_row)
+    return output
+
+
+def apply_delta(store_path, delta_file, timeseries_features, new_feature_names=None):
+    """Apply a historical data file to the state store at store_path, creating it if necessary
+
+    The first delta can be the full history, to build the store.
+
+    :param str store_path: the shelve file holding the state
+    :param str delta_file: a csv in the same format as the historical data, which may be
+        compressed
+    :param timeseries_features: the names of the timeseries
+    :return: Refreshed feature rows for the customers in the delta
+    :rtype: list[dict[str, Any]]
+    """
+    print 'Applying %s to %s' % (delta_file, store_path)
+    with closing(shelve.open(store_path)) as state, compression.open_file(delta_file) as f:
+        ids = update_state(state, csv.DictReader(f), timeseries_features)
+        return feature_rows(state, ids, new_feature_names)
+
+
+def merge_feature_rows(rows, refreshed_rows, index=None):
+    """Overwrite the timeseries features of the data rows with refreshed values
+
+    :param list[dict[str, Any]] rows: data rows, updated in place
+    :param list[dict[str, Any]] refreshed_rows: as returned by apply_delta
+    :param idindex.IdIndex index: the positions of the data rows, if already built
+    :return: The number of data rows updated
+    :rtype: int
+    """
+    row_index = index if index is not None else idindex.IdIndex.from_rows(rows)
+    rows_by_position = row_index.align(rows)
+    updated = 0
+    for refreshed_row in refreshed_rows:
+        position = row_index.get(refreshed_row['id'])
+        if position != idindex.MISSING:
+            rows_by_position[position].update(refreshed_row)
+            updated += 1
+    return updated
@@ -0,0 +1,92 @@
+import copy
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import incremental
+import preprocessing
+
+
+class IncrementalTest(unittest.TestCase):
+
+    timeseries_features = ['price_1', 'price_2']
+
+    rows = [
+        {'id': '1', 'price_date': '2015-01-01', 'price_1': '10', 'price_2': '0'},
+        {'id': '1', 'price_date': '2015-02-01', 'price_1': '20', 'price_2': '2'},
+        {'id': '2', 'price_date': '2015-01-01', 'price_1': '30', 'price_2': ''},
+        {'id': '2', 'price_date': '2015-02-01', 'price_1': '20', 'price_2': ''},
+        {'id': '1', 'price_date': '2015-03-01', 'price_1': '15', 'price_2': '5'},
+        {'id': '2', 'price_date': '2015-03-01', 'price_1': '10', 'price_2': ''},
+        {'id': '1', 'price_date': '2015-04-01', 'price_1': '0', 'price_2': '4'},
+    ]
+
+    def expected_features(self, id):
+        timeseries_row = preprocessing.build_timeseries_row(
+            id, [row for row in self.rows if row['id'] == id], self.timeseries_features)
+        return preprocessing.derive_timeseries_features(
+            timeseries_row, self.timeseries_features, preprocessing.DERIVED_FEATURES)
+
+    def test_deltas_match_full_history(self):
+        state = {}
+        self.assertEqual(['1', '2'], incremental.update_state(state, self.rows[:4],
+                                                              self.timeseries_features))
+        self.assertEqual(['1', '2'], incremental.update_state(state, self.rows[4:6],
+                                                              self.timeseries_features))
+        self.assertEqual(['1'], incremental.update_state(state, self.rows[6:],
+                                                         self.timeseries_features))
+
+        for id in ('1', '2'):
+            self.assertEqual(self.expected_features(id),
+                             incremental.customer_features(state[id]))
+
+    def test_processed_dates_are_rejected(self):
+        state = {}
+        incremental.update_state(state, self.rows[:4], self.timeseries_features)
+        with self.assertRaises(ValueError):
+            incremental.update_state(state, self.rows[:1], self.timeseries_features)
+
+    def test_failed_delta_leaves_the_state_unchanged(self):
+        state = {}
+        incremental.update_state(state, self.rows[:4], self.timeseries_features)
+        before = copy.deepcopy(state)
+        new_customer = {'id': '3', 'price_date': '2015-03-01', 'price_1': '1', 'price_2': '1'}
+        # Customer 2's last row was already applied
+        delta = self.rows[4:6] + [new_customer, self.rows[3]]
+
+        with self.assertRaises(ValueError):
+            incremental.update_state(state, delta, self.timeseries_features)
+        self.assertEqual(before, state)
+
+        # Without the bad row, the delta still applies
+        self.assertEqual(['1', '2', '3'], incremental.update_state(state, delta[:-1],
+                                                                   self.timeseries_features))
+
+    def test_apply_delta(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store_path = os.path.join(directory, 'state')
+            for i, delta in enumerate([self.rows[:4], self.rows[4:]]):
+                delta_file = os.path.join(directory, 'delta_%s.csv' % i)
+                with open(delta_file, 'wb') as f:
+                    writer = csv.DictWriter(f, ['id', 'price_date'] + self.timeseries_features)
+                    writer.writeheader()
+                    writer.writerows(delta)
+                refreshed_rows = incremental.apply_delta(store_path, delta_file,
+                                                         self.timeseries_features, ['max'])
+
+            self.assertEqual([{'id': '1', 'price_1_max': 20.0, 'price_2_max': 5.0},
+                              {'id': '2', 'price_1_max': 30.0, 'price_2_max': 0}],
+                             refreshed_rows)
+
+            rows = [{'id': '2', 'price_1_max': 1.0}, {'id': '3'}]
+            self.assertEqual(1, incremental.merge_feature_rows(rows, refreshed_rows))
+            self.assertEqual({'id': '2', 'price_1_max': 30.0, 'price_2_max': 0}, rows[0])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import csv
 
+import compression
+
 FEATURES_FILE = 'features.csv'
 
 TEST_DATA_FILE = 'test_data.csv'
@@ -15,16 +17,34 @@ TIMESERIES_FEATURES = ['price_p1_var', 'price_p2_var', 'price_p3_var',
 
 
 def extract_rows(file_path):
-    """Read data from a csv file.
+    """Read data from a csv file, which may be compressed.
 
     :param str file_path: The path to the file
     :rtype: list[dict[str, str]]
     """
-    with open(file_path) as f:
+    with compression.open_file(file_path) as f:
         reader = csv.DictReader(f)
         return [row for row in reader]
 
 
+def iter_row_chunks(file_path, chunk_size=10000):
+    """Read data from a csv file, which may be compressed, in chunks of rows
+
+    :param str file_path: The path to the file
+    :param int chunk_size: The number of rows in each chunk
+    :rtype: iterable[list[dict[str, str]]]
+    """
+    with compression.open_file(file_path) as f:
+        chunk = []
+        for row in csv.DictReader(f):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
 def load_test_data():
     return extract_rows(TEST_DATA_FILE)
 
@@ -51,6 +71,20 @@ def load_training_labels():
     :rtype: list[dict[str, int]]
     """
     ids = [row['id'] for row in extract_rows(TRAINING_DATA_FILE)]
-    with open(TRAINING_LABELS_FILE) as f:
-        labels = [int(r.strip()) for r in f.readlines()]
+    return label_rows(ids, load_label_values())
+
+
+def load_label_values(file_path=TRAINING_LABELS_FILE):
+    """Read in the labels, one per line, in the order of the training data
+
+    :rtype: list[int]
+    """
+    with compression.open_file(file_path) as f:
+        return [int(r.strip()) for r in f.readlines()]
+
+
+def label_rows(ids, labels):
+    """
+    :rtype: list[dict[str, int]]
+    """
     return [{'id': _id, LABEL_NAME: label} for _id, label in zip(ids, labels)]
@@ -1,124 +1,488 @@
+import numpy as np
+
+import categorical
+import compression
+import dataset
+import drift
+import idindex
 import load
 import models
+import outofcore
+import prefetch
 import preprocessing
+import profiling
+import ranking
+import scoring
+import sharding
 import visualisation
 
+OUTPUT_SCORES_FILE = 'output_scores'
 
-def classify_and_predict():
 
-    X, y = load_model_data()
-    test_X = load_test_data()
+def classify_and_predict(prefetch_files=False, output_file=OUTPUT_SCORES_FILE,
+                         fitter=models.fit_bagged_decision_tree, top_k=None, segment=None,
+                         dataset_path=None, test_dataset_path=None):
+    """
 
-    model = models.fit_bagged_decision_tree(X, y)
+    :param bool prefetch_files: read the input files in background threads
+    :param str output_file: where to write the scores, compressed if the name ends in .gz, .bz2,
+        .xz or .zst
+    :param callable fitter: fits a model to X, y e.g. models.fit_balanced_bagged_decision_tree
+    :param int top_k: if given, write only the top_k customers most likely to churn, ranked, as
+        csv
+    :param str segment: a column to rank the customers within e.g. channel_sales, otherwise
+        they're ranked together
+    :param str dataset_path: if given, memory map the training data written by
+        write_model_dataset instead of preprocessing the training files
+    :param str test_dataset_path: if given, memory map the test data written by
+        write_test_dataset instead of preprocessing the test files
+    """
+    X, y = load_model_data(prefetch_files=prefetch_files, dataset_path=dataset_path)
+    if test_dataset_path:
+        ids, segments, test_X = _open_test_dataset(test_dataset_path, segment)
+    else:
+        data_rows, features = load_test_rows(True, False, True, prefetch_files=prefetch_files)
+        test_X = _test_matrix(data_rows, features)
+        ids = [row['id'] for row in data_rows]
+        segments = [row[segment] for row in data_rows] if segment else None
+
+    with profiling.stage(fitter.__name__) as s:
+        model = fitter(X, y)
+        s.rows = len(X)
+
+    with profiling.stage('predict') as s:
+        output_labels = model.predict(test_X)
+        s.rows = len(test_X)
+
+    with profiling.stage('predict_proba') as s:
+        probabilities = model.predict_proba(test_X)
+        s.rows = len(test_X)
+
+    if top_k:
+        with profiling.stage('write_rankings') as s:
+            ranker = ranking.SegmentRanker(top_k)
+            ranker.add_batch(ids, segments, probabilities[:, list(model.classes_).index(1)])
+            ranking.write_rankings(ranker.ranked(), output_file)
+            s.rows = len(ids)
+        return output_labels, probabilities
+
+    with profiling.stage('write_output_scores') as s:
+        output = []
+        for i, id in enumerate(ids):
+            output.append((id, probabilities[i][0], output_labels[i]))
+
+        sorted_scores = sorted(output, key=lambda r: r[2])
+        with compression.open_file(output_file, 'w') as f:
+            f.writelines([str(r) + '\n' for r in sorted_scores])
+        s.rows = len(output)
 
-    output_labels = model.predict(test_X)
+    return output_labels, probabilities
 
-    probabilities = model.predict_proba(test_X)
 
-    data_rows, _ = load_test_rows(False, False, False)
+def train_and_save_model(model_directory, fitter=models.fit_bagged_decision_tree,
+                         prefetch_files=False):
+    """Fit a model to all the training data and save it, with its preprocessing state, for the
+    scoring service
 
-    output = []
-    for i, row in enumerate(data_rows):
-        output.append((row['id'], probabilities[i][0], output_labels[i]))
+    :param str model_directory: where to save the model
+    :param callable fitter: fits a model to X, y e.g. models.fit_bagged_decision_tree
+    """
+    data_rows, features, label_rows, index, categorical_store = _load_training_rows(
+        True, True, True, prefetch_files=prefetch_files)
+    with profiling.stage('labelled_training_data') as s:
+        X, y = preprocessing.labelled_training_data(data_rows, label_rows, features,
+                                                    load.LABEL_NAME, index)
+        s.rows = len(X)
 
-    sorted_scores = sorted(output, key=lambda r: r[2])
-    with open('output_scores', 'w') as f:
-        f.writelines([str(r) + '\n' for r in sorted_scores])
+    with profiling.stage('fit') as s:
+        model = fitter(X, y)
+        s.rows = len(X)
 
-    return output_labels, probabilities
+    scoring.save_model(model_directory, model, preprocessing.model_columns(data_rows[0], features),
+                       features, load.TIMESERIES_FEATURES, categorical_store=categorical_store)
+    return model
 
 
-def load_model_data():
+def load_model_data(processes=None, dataset_path=None, prefetch_files=False):
     """
 
+    :param int processes: if given, preprocess the rows in this many processes
+    :param str dataset_path: if given, memory map the preprocessed data written by
+        write_model_dataset instead
+    :param bool prefetch_files: read the input files in background threads
     """
-    data_rows, features, label_rows = load_training_rows(True, True, True)
+    if dataset_path:
+        with profiling.stage('open_dataset') as s:
+            model_dataset = dataset.open_dataset(dataset_path)
+            s.rows = len(model_dataset)
+        return model_dataset.X, model_dataset.y
+
+    if processes:
+        return load_sharded_model_data(processes)
+
+    data_rows, features, label_rows, index, _ = _load_training_rows(True, True, True,
+                                                                    prefetch_files=prefetch_files)
 
-    X, y = preprocessing.labelled_training_data(data_rows, label_rows, features, load.LABEL_NAME)
+    with profiling.stage('labelled_training_data') as s:
+        X, y = preprocessing.labelled_training_data(data_rows, label_rows, features,
+                                                    load.LABEL_NAME, index)
+        s.rows = len(X)
 
     return X, y
 
 
+def load_sharded_model_data(processes=None):
+    """Load the training data, preprocessing it in a pool of processes sharded by id"""
+    X, y, _, _, _ = _sharded_model_data(processes)
+    return X, y
+
+
+def _sharded_model_data(processes=None):
+    data_rows = _load('load_training_data', load.load_training_data)
+    historical_data = _load('load_historical_training_data', load.load_historical_training_data)
+    features = _load('load_features', load.load_features)
+    label_rows = _load('load_training_labels', load.load_training_labels)
+
+    with profiling.stage('sharded_matrix') as s:
+        X, columns, _ = sharding.sharded_matrix(data_rows, historical_data, features,
+                                                load.TIMESERIES_FEATURES, processes=processes)
+        s.rows = len(X)
+
+    index = idindex.IdIndex.from_rows(data_rows)
+    labels_by_position = index.align(label_rows)
+    row_labels = [labels_by_position[position]
+                  for position in index.positions(row['id'] for row in data_rows)]
+    labelled = np.flatnonzero([label_row is not None for label_row in row_labels])
+    ids = [data_rows[i]['id'] for i in labelled]
+    y = np.array([np.float64(1 if row_labels[i][load.LABEL_NAME] else 0) for i in labelled])
+    features = {name: features.get(name, preprocessing.NEW_FEATURE_TEMPLATE) for name in columns}
+    return X[labelled], y, columns, ids, features
+
+
+def write_model_dataset(dataset_path, processes=1):
+    """Preprocess the training data once and save it for load_model_data, models and
+    plot_all_features to memory map"""
+    X, y, columns, ids, features = _sharded_model_data(processes)
+    with profiling.stage('write_dataset') as s:
+        dataset.write_dataset(dataset_path, X, columns, y, ids, metadata={'features': features})
+        s.rows = len(X)
+
+
+def write_test_dataset(dataset_path, segments=(), prefetch_files=False):
+    """Preprocess the test data once and save it for classify_and_predict to memory map
+
+    :param list[str] segments: columns to save the values of, to rank the customers within
+    """
+    data_rows, features = load_test_rows(True, False, True, prefetch_files=prefetch_files)
+    X = _test_matrix(data_rows, features)
+    columns = preprocessing.model_columns(data_rows[0], features)
+    metadata = {'features': {name: features[name] for name in columns},
+                'segments': {name: [row[name] for row in data_rows] for name in segments}}
+    with profiling.stage('write_dataset') as s:
+        dataset.write_dataset(dataset_path, X, columns, ids=[row['id'] for row in data_rows],
+                              metadata=metadata)
+        s.rows = len(X)
+
+
+def _open_test_dataset(dataset_path, segment=None):
+    """
+    :return: the ids, the values of the segment column if given and the matrix of a dataset
+        written by write_test_dataset
+    """
+    with profiling.stage('open_dataset') as s:
+        test_dataset = dataset.open_dataset(dataset_path)
+        s.rows = len(test_dataset)
+    segments = None
+    if segment:
+        saved = test_dataset.metadata.get('segments', {})
+        if segment not in saved:
+            raise ValueError('%s was written without the values of %s' % (dataset_path, segment))
+        # The header is json, the data files utf-8 byte strings
+        segments = [value.encode('utf-8') for value in saved[segment]]
+    return [str(id) for id in test_dataset.ids], segments, test_dataset.X
+
+
 def load_test_data():
     """
 
     """
-    training_rows, features, _ = load_training_rows(True, True, True)
-    data_rows, _ = load_test_rows(True, True, True)
+    data_rows, features = load_test_rows(True, False, True)
+    return _test_matrix(data_rows, features)
 
-    X = preprocessing.test_data(data_rows, features, training_rows)
 
+def _test_matrix(data_rows, features):
+    """Vectorise the test rows, which are left unmodified for writing the output"""
+    with profiling.stage('test_data') as s:
+        X = preprocessing.test_data(data_rows, features)
+        s.rows = len(X)
     return X
 
 
 def load_test_rows(transform_dates=True, transform_categorical_features=False,
-                   add_timeseries_features=True):
+                   add_timeseries_features=True, memory_budget=None,
+                   prefetch_files=False, data_profile=None, categorical_store=None):
     """
 
+    :param int memory_budget: if given, stream the historical data from disk using at most this
+        many bytes, rather than loading it all
+    :param bool prefetch_files: read the files in background threads while transforming the rows
+    :param drift.DataProfile data_profile: if given, profile the rows as they are loaded
+    :param categorical.CategoricalStore categorical_store: the store of the training rows, so that
+        the categorical features get the training codes, e.g. that of scoring.load_scorer
     """
-    data_rows = load.load_test_data()
-    historical_data = load.load_historical_test_data()
-    features = load.load_features()
+    if prefetch_files:
+        data_rows, features, _, _, _ = _load_prefetched_rows(
+            load.TEST_DATA_FILE, load.TEST_HISTORICAL_DATA_FILE, None, transform_dates,
+            transform_categorical_features, add_timeseries_features, memory_budget, data_profile,
+            categorical_store)
+        return data_rows, features
+
+    data_rows = _load('load_test_data', load.load_test_data)
+    historical_data = None if memory_budget else _load('load_historical_test_data',
+                                                       load.load_historical_test_data)
+    features = _load('load_features', load.load_features)
+    if data_profile is not None:
+        _profile_rows(data_profile, data_rows, historical_data)
     timeseries_features = load.TIMESERIES_FEATURES
 
-    data_rows, features = transformations(add_timeseries_features, data_rows, features,
-                                          historical_data, timeseries_features,
-                                          transform_categorical_features, transform_dates)
+    data_rows, features, _ = transformations(add_timeseries_features, data_rows, features,
+                                             historical_data, timeseries_features,
+                                             transform_categorical_features, transform_dates,
+                                             load.TEST_HISTORICAL_DATA_FILE, memory_budget,
+                                             index=idindex.IdIndex.from_rows(data_rows),
+                                             categorical_store=categorical_store)
 
     return data_rows, features
 
 
 def load_training_rows(transform_dates=True, transform_categorical_features=False,
-                       add_timeseries_features=True):
+                       add_timeseries_features=True, memory_budget=None,
+                       prefetch_files=False, data_profile=None):
     """
 
+    :param int memory_budget: if given, stream the historical data from disk using at most this
+        many bytes, rather than loading it all
+    :param bool prefetch_files: read the files in background threads while transforming the rows
+    :param drift.DataProfile data_profile: if given, profile the rows as they are loaded
     """
-    data_rows = load.load_training_data()
-    historical_data = load.load_historical_training_data()
-    features = load.load_features()
+    return _load_training_rows(transform_dates, transform_categorical_features,
+                               add_timeseries_features, memory_budget, prefetch_files,
+                               data_profile)[:3]
+
+
+def _load_training_rows(transform_dates=True, transform_categorical_features=False,
+                        add_timeseries_features=True, memory_budget=None,
+                        prefetch_files=False, data_profile=None):
+    """Like load_training_rows, but also returning the index of the data rows built to join
+    them, for the later joins to reuse, and the categorical store the rows were encoded with, if
+    they were"""
+    if prefetch_files:
+        return _load_prefetched_rows(
+            load.TRAINING_DATA_FILE, load.TRAINING_HISTORICAL_DATA_FILE, load.TRAINING_LABELS_FILE,
+            transform_dates, transform_categorical_features, add_timeseries_features,
+            memory_budget, data_profile)
+
+    data_rows = _load('load_training_data', load.load_training_data)
+    historical_data = None if memory_budget else _load('load_historical_training_data',
+                                                       load.load_historical_training_data)
+    features = _load('load_features', load.load_features)
+    if data_profile is not None:
+        _profile_rows(data_profile, data_rows, historical_data)
     timeseries_features = load.TIMESERIES_FEATURES
 
-    data_rows, features = transformations(add_timeseries_features, data_rows, features,
-                                          historical_data, timeseries_features,
-                                          transform_categorical_features, transform_dates)
+    index = idindex.IdIndex.from_rows(data_rows)
+    data_rows, features, categorical_store = transformations(
+        add_timeseries_features, data_rows, features, historical_data, timeseries_features,
+        transform_categorical_features, transform_dates, load.TRAINING_HISTORICAL_DATA_FILE,
+        memory_budget, index=index)
+
+    label_rows = _load('load_training_labels', load.load_training_labels)
+
+    return data_rows, features, label_rows, index, categorical_store
+
+
+def _load_prefetched_rows(data_file, historical_file, labels_file, transform_dates,
+                          transform_categorical_features, add_timeseries_features,
+                          memory_budget=None, data_profile=None, categorical_store=None):
+    """Load and transform the rows, reading and parsing the files in background threads while
+    the chunks that have already arrived are profiled and transformed
+
+    :return: the data rows, features, label rows if there is a labels_file, the index of the data
+        rows and the categorical store they were encoded with
+    """
+    read_historical = add_timeseries_features and not memory_budget
+    data = prefetch.prefetch_rows(data_file)
+    historical = prefetch.prefetch_rows(historical_file) if read_historical else None
+    labels = prefetch.prefetch_value(load.load_label_values, labels_file) if labels_file else None
+    features = _load('load_features', load.load_features)
+    timeseries_features = load.TIMESERIES_FEATURES
+    extractor = prefetch.TimeseriesExtractor(timeseries_features)
+
+    def add_historical(historical_chunk):
+        if data_profile is not None:
+            data_profile.update_historical(historical_chunk)
+        extractor.add(historical_chunk)
+
+    try:
+        with profiling.stage('load_prefetched_rows') as s:
+            data_rows = []
+            for chunk in data:
+                if data_profile is not None:
+                    data_profile.update(chunk)
+                if transform_dates:
+                    chunk = preprocessing.transform_dates(chunk, features)
+                data_rows.extend(chunk)
+                for historical_chunk in historical.poll() if historical else []:
+                    add_historical(historical_chunk)
+            for historical_chunk in historical or []:
+                add_historical(historical_chunk)
+            s.rows = len(data_rows) + extractor.rows
+        label_values = labels.join()[0] if labels else None
+    finally:
+        # Stops the threads still reading if a transform failed
+        for prefetcher in (data, historical, labels):
+            if prefetcher is not None:
+                prefetcher.close()
+
+    timeseries_rows = None
+    if read_historical:
+        with profiling.stage('extract_timeseries_rows') as s:
+            timeseries_rows = extractor.finish()
+            s.rows = extractor.rows
+
+    index = idindex.IdIndex.from_rows(data_rows)
+    data_rows, features, categorical_store = transformations(
+        add_timeseries_features, data_rows, features, None, timeseries_features,
+        transform_categorical_features, False, historical_file, memory_budget, timeseries_rows,
+        index, categorical_store)
+
+    label_rows = None
+    if label_values is not None:
+        label_rows = load.label_rows([row['id'] for row in data_rows], label_values)
+
+    return data_rows, features, label_rows, index, categorical_store
+
+
+def _profile_rows(data_profile, data_rows, historical_data=None):
+    with profiling.stage('profile_data') as s:
+        data_profile.update(data_rows)
+        if historical_data:
+            data_profile.update_historical(historical_data)
+        s.rows = len(data_rows) + len(historical_data or [])
+
+
+def write_training_profile(profile_path):
+    """Profile the training extract, to compare later extracts with"""
+    with profiling.stage('profile_data') as s:
+        summary = drift.profile_files(load.TRAINING_DATA_FILE, load.TRAINING_HISTORICAL_DATA_FILE)
+        s.rows = summary['rows']
+    drift.save_profile(summary, profile_path)
+    return summary
+
+
+def check_test_drift(profile_path):
+    """Flag the drift of the test extract from the training profile written by
+    write_training_profile
+
+    :rtype: list[drift.Drift]
+    """
+    with profiling.stage('profile_data') as s:
+        summary = drift.profile_files(load.TEST_DATA_FILE, load.TEST_HISTORICAL_DATA_FILE)
+        s.rows = summary['rows']
+    drifts = drift.compare_profiles(drift.load_profile(profile_path), summary)
+    print drift.format_drift(drifts)
+    return drifts
 
-    label_rows = load.load_training_labels()
 
-    return data_rows, features, label_rows
+def _load(stage_name, loader):
+    """Run a loader as a profiled stage"""
+    with profiling.stage(stage_name) as s:
+        rows = loader()
+        s.rows = len(rows)
+    return rows
 
 
 def transformations(add_timeseries_features, data_rows, features, historical_data,
-                    timeseries_features, transform_categorical_features, transform_dates):
-    """Transform the data"""
+                    timeseries_features, transform_categorical_features, transform_dates,
+                    historical_file=None, memory_budget=None, timeseries_rows=None, index=None,
+                    categorical_store=None):
+    """Transform the data
+
+    With a memory budget the timeseries features are derived by streaming historical_file,
+    otherwise from the timeseries_rows if they have already been extracted, or else from the
+    historical_data rows. The timeseries are joined to the data rows through index, the
+    positions of the data rows, which is built if not given.
+
+    The categorical features are encoded with a frozen copy of categorical_store, the store of the
+    training rows, if given, so that values not seen in training are coded as unknown.
+
+    :return: The transformed rows, their features and the store the categorical features were
+        encoded with, None if they weren't
+    :rtype: tuple[list[dict[str, Any]], dict[str, dict[str, Any]], categorical.CategoricalStore]
+    """
+    if index is None:
+        index = idindex.IdIndex.from_rows(data_rows)
+
     if transform_dates:
-        data_rows = preprocessing.transform_dates(data_rows, features)
+        with profiling.stage('transform_dates') as s:
+            data_rows = preprocessing.transform_dates(data_rows, features)
+            s.rows = len(data_rows)
 
+    store = None
     if transform_categorical_features:
-        data_rows, categorical_value_maps = preprocessing.transform_categorical_features(data_rows,
-                                                                                         features)
-
-    if add_timeseries_features:
-        timeseries_rows = preprocessing.extract_timeseries_rows(historical_data, features,
-                                                                timeseries_features)
-        data_rows, features = preprocessing.add_timeseries_features(data_rows, timeseries_rows,
-                                                                    features, timeseries_features)
-    return data_rows, features
+        with profiling.stage('transform_categorical_features') as s:
+            if categorical_store is not None:
+                store = categorical_store.frozen()
+            data_rows, store = preprocessing.transform_categorical_features(data_rows, features,
+                                                                            store)
+            s.rows = len(data_rows)
+
+    if add_timeseries_features and memory_budget:
+        with profiling.stage('add_timeseries_features_out_of_core') as s:
+            data_rows, features = outofcore.add_timeseries_features(
+                data_rows, historical_file, features, timeseries_features,
+                memory_budget=memory_budget, index=index)
+            s.rows = len(data_rows)
+    elif add_timeseries_features:
+        if timeseries_rows is None:
+            with profiling.stage('extract_timeseries_rows') as s:
+                timeseries_rows = preprocessing.extract_timeseries_rows(historical_data, features,
+                                                                        timeseries_features)
+                s.rows = len(historical_data)
+        with profiling.stage('add_timeseries_features') as s:
+            data_rows, features = preprocessing.add_timeseries_features(
+                data_rows, index.align(timeseries_rows), features, timeseries_features,
+                timeseries_index=index)
+            s.rows = len(data_rows)
+    return data_rows, features, store
 
 
 def plot_all_features(plot_categorical=True, plot_continuous=True,
-                      data_rows=None, features=None, label_rows=None):
+                      data_rows=None, features=None, label_rows=None, dataset_path=None):
     """
 
+    :param str dataset_path: if given, plot the continuous features from the dataset written by
+        write_model_dataset. The rows are then only loaded to plot categorical features.
     """
     def should_log_x(feature):
         log_x = bool(int(feature['log_x']))
         is_date = bool(int(feature['is_date']))
         return log_x and not is_date
 
-    if not all([data_rows, features, label_rows]):
-        data_rows, features, label_rows = load_training_rows(transform_dates=True,
-                                                             transform_categorical_features=False,
-                                                             add_timeseries_features=True)
+    model_dataset = dataset.open_dataset(dataset_path) if dataset_path else None
+
+    index = None
+    if model_dataset is not None and not plot_categorical:
+        features = features or model_dataset.metadata['features']
+    elif not all([data_rows, features, label_rows]):
+        data_rows, features, label_rows, index, _ = _load_training_rows(
+            transform_dates=True, transform_categorical_features=False,
+            add_timeseries_features=True)
+    if index is None and data_rows:
+        index = idindex.IdIndex.from_rows(data_rows)
+
+    if plot_categorical:
+        store = categorical.CategoricalStore.from_rows(data_rows, features)
 
     for feature_name, feature in features.iteritems():
 
@@ -129,11 +493,17 @@ def plot_all_features(plot_categorical=True, plot_continuous=True,
         print feature
 
         if int(feature['is_categorical']) and plot_categorical:
-            visualisation.categorical_plot(feature_name, data_rows, label_rows)
+            # The store leaves out the id and the features that aren't columns of the data
+            if feature_name in store:
+                visualisation.categorical_plot(feature_name, data_rows, label_rows,
+                                               column=store[feature_name], index=index)
 
         elif plot_continuous:
-            visualisation.continuous_plot(feature_name, data_rows, label_rows,
-                                          log_x=should_log_x(feature),
-                                          bandwidth=float(feature['bandwidth']) or 0.2,
-                                          is_date=bool(int(feature['is_date'])))
-
+            options = dict(log_x=should_log_x(feature),
+                           bandwidth=float(feature['bandwidth']) or 0.2,
+                           is_date=bool(int(feature['is_date'])))
+            if model_dataset is not None and feature_name in model_dataset.columns:
+                visualisation.continuous_plot_from_dataset(feature_name, model_dataset, **options)
+            elif data_rows and feature_name in data_rows[0]:
+                visualisation.continuous_plot(feature_name, data_rows, label_rows, index=index,
+                                              **options)
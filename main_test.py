@@ -0,0 +1,66 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import matplotlib
+matplotlib.use('Agg')
+
+from sklearn.tree import DecisionTreeClassifier
+
+import generate
+import load
+import main
+
+
+def fit_tree(X, y):
+    return DecisionTreeClassifier(random_state=0).fit(X, y)
+
+
+class MainTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        generate.generate(self.directory, 200, 50, months=3)
+        shutil.copy(load.FEATURES_FILE, self.directory)
+        self.cwd = os.getcwd()
+        # The pipeline reads its files from, and saves the plots to, the working directory
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_plots_from_the_training_files(self):
+        main.plot_all_features()
+
+        self.assertTrue(os.path.exists('channel_sales.png'))
+        self.assertTrue(os.path.exists('cons_12m.png'))
+
+    def test_categorical_plots_with_a_dataset(self):
+        main.write_model_dataset('model.dataset')
+        main.plot_all_features(dataset_path='model.dataset', plot_categorical=True)
+
+        self.assertTrue(os.path.exists('channel_sales.png'))
+        self.assertTrue(os.path.exists('cons_12m.png'))
+
+
+    def test_predict_from_datasets(self):
+        main.write_model_dataset('model.dataset')
+        main.write_test_dataset('test.dataset', segments=['channel_sales'])
+        for prefix, paths in [('files', {}), ('datasets', {'dataset_path': 'model.dataset',
+                                                           'test_dataset_path': 'test.dataset'})]:
+            main.classify_and_predict(output_file=prefix + '_scores', fitter=fit_tree, **paths)
+            main.classify_and_predict(output_file=prefix + '_ranked.csv', fitter=fit_tree,
+                                      top_k=5, segment='channel_sales', **paths)
+
+        for name in ('scores', 'ranked.csv'):
+            with open('files_' + name) as f, open('datasets_' + name) as g:
+                self.assertEqual(f.read(), g.read())
+        with self.assertRaises(ValueError):
+            main.classify_and_predict(fitter=fit_tree, test_dataset_path='test.dataset',
+                                      top_k=5, segment='origin_up')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,17 +5,29 @@ from sklearn.ensemble import BaggingClassifier
 from sklearn.ensemble import ExtraTreesClassifier
 from sklearn.naive_bayes import GaussianNB
 
+import balanced
+import dataset
+import histtree
 import load
 import preprocessing
 
 
-def load_data_portion(denominator=0, offset=0):
+def load_data_portion(denominator=0, offset=0, dataset_path=None):
     """Load a portion of the data.
 
     :param denominator: The number of partitions to divide the data into e.g. 3 (thirds)
     :param offset: The partition to load e.g. 2 (the second third)
+    :param dataset_path: A dataset written by main.write_model_dataset, to slice without copying
     :return:
     """
+    if dataset_path:
+        model_dataset = dataset.open_dataset(dataset_path)
+        portion_length = (len(model_dataset) / denominator) if denominator else len(model_dataset)
+        slice_start = offset * portion_length
+        slice_end = slice_start + portion_length
+        print 'Returning %s samples' % portion_length
+        return model_dataset.X[slice_start:slice_end], model_dataset.y[slice_start:slice_end]
+
     training_rows = load.load_training_data()
     training_labels = load.load_training_labels()
     features = load.load_features()
@@ -46,6 +58,22 @@ def fit_bagged_decision_tree(X, y):
     return clf
 
 
+def fit_histogram_bagged_trees(X, y):
+    """Like fit_bagged_decision_tree, but growing the trees from quantile binned features, which is
+    faster and smaller on large training sets"""
+    clf = histtree.HistogramBaggingClassifier()
+    clf.fit(X, y)
+    return clf
+
+
+def fit_balanced_bagged_decision_tree(X, y):
+    """Like fit_bagged_decision_tree, but fitting each tree to all the churners and as many
+    non-churners, with the probabilities calibrated back to the class balance of the training set"""
+    clf = balanced.BalancedBaggingClassifier()
+    clf.fit(X, y)
+    return clf
+
+
 def fit_forest(X, y):
     forest = ExtraTreesClassifier(n_estimators=250, random_state=0)
     forest.fit(X, y)
@@ -0,0 +1,236 @@
+"""Derive timeseries features from historical price files larger than memory
+
+extract_timeseries_rows groups a fully loaded list of rows with itertools.groupby, so the file must
+fit in memory and be sorted by id. Here the file is streamed and hash partitioned by id into spill
+files small enough to group in memory, so the rows can be in any order and peak memory is bounded
+by the budget rather than by the size of the file. The spill files can be compressed, trading CPU
+for temporary disk space.
+"""
+from __future__ import division
+
+import bisect
+from collections import OrderedDict
+import csv
+from itertools import chain
+import math
+import os
+import shutil
+import tempfile
+import zlib
+
+import numpy as np
+
+import compression
+import idindex
+import preprocessing
+import rowview
+
+DEFAULT_MEMORY_BUDGET = 512 * 2 ** 20
+
+# Parsed rows take several times the space of their csv text, mostly dict and str overhead
+ROW_MEMORY_FACTOR = 10
+
+# Partition files written at once, well under the usual limit of open files
+MAX_OPEN_PARTITIONS = 64
+
+
+def partitions_for_budget(file_path, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """The number of partitions needed so that each one can be grouped within the budget
+
+    :param str file_path: which may be compressed
+    :param int memory_budget: in bytes
+    :rtype: int
+    """
+    size = compression.estimated_size(file_path)
+    return max(1, int(math.ceil(size * ROW_MEMORY_FACTOR / memory_budget)))
+
+
+def partition_index(id, partitions):
+    return (zlib.crc32(id) & 0xffffffff) % partitions
+
+
+def _write_partitions(rows, paths, index, spill_compression=None):
+    """Write each csv row to the file of its partition
+
+    :param iterable[list[str]] rows:
+    :param list[str] paths: the partition files
+    :param callable index: the position in paths of a row's partition
+    """
+    files = [compression.open_file(path, 'wb', spill_compression) for path in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        for row in rows:
+            writers[index(row)].writerow(row)
+    finally:
+        for f in files:
+            f.close()
+
+
+def _partition_range(rows, id_column, start, stop, partitions, directory, spill_compression,
+                     max_open):
+    """Write the rows of the partitions start to stop - 1 to a file each, in as many passes as
+    needed to keep at most max_open files open
+
+    :return: The paths of the partition files
+    :rtype: list[str]
+    """
+    extension = compression.EXTENSIONS[spill_compression] if spill_compression else ''
+
+    def partition(row):
+        return partition_index(row[id_column], partitions)
+
+    if stop - start <= max_open:
+        paths = [os.path.join(directory, 'partition_%d.csv%s' % (i, extension))
+                 for i in xrange(start, stop)]
+        _write_partitions(rows, paths, lambda row: partition(row) - start, spill_compression)
+        return paths
+
+    # Split the partitions into max_open ranges, then split each range in another pass
+    bounds = [int(bound) for bound in np.linspace(start, stop, max_open + 1)]
+    range_paths = [os.path.join(directory, 'range_%d_%d.csv%s' % (low, high, extension))
+                   for low, high in zip(bounds, bounds[1:])]
+    _write_partitions(rows, range_paths,
+                      lambda row: bisect.bisect_right(bounds, partition(row)) - 1,
+                      spill_compression)
+    paths = []
+    for low, high, range_path in zip(bounds, bounds[1:], range_paths):
+        with compression.open_file(range_path) as f:
+            paths.extend(_partition_range(csv.reader(f), id_column, low, high, partitions,
+                                          directory, spill_compression, max_open))
+        os.remove(range_path)
+    return paths
+
+
+def partition_file(file_path, directory, partitions, spill_compression=None,
+                   max_open=MAX_OPEN_PARTITIONS):
+    """Split a csv file into partitions by a hash of the id, so that all of an id's rows are in
+    the same partition
+
+    At most max_open partition files are written at once, as each takes a file descriptor and a
+    write buffer (and compression state) outside the memory budget. More partitions are written
+    in several passes, each splitting the files of the previous pass further.
+
+    :param str file_path: which may be compressed
+    :param str directory: where to write the partition files
+    :param int partitions:
+    :param str spill_compression: if given, compress the partition files, e.g. compression.GZIP
+    :param int max_open: the most partition files to write at once
+    :return: The header and the paths of the partition files, in partition order
+    :rtype: tuple[list[str], list[str]]
+    """
+    with compression.open_file(file_path) as f:
+        reader = csv.reader(f)
+        header = reader.next()
+        paths = _partition_range(reader, header.index('id'), 0, partitions, partitions,
+                                 directory, spill_compression, max_open)
+    return header, paths
+
+
+def group_rows(rows):
+    """Group rows by id, keeping the order in which the ids first appear
+
+    :param iterable[dict[str, str]] rows:
+    :rtype: OrderedDict[str, list[dict[str, str]]]
+    """
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(row['id'], []).append(row)
+    return groups
+
+
+def iter_timeseries_rows(file_path, timeseries_features, memory_budget=DEFAULT_MEMORY_BUDGET,
+                         temp_dir=None, spill_compression=None):
+    """Yield a timeseries row, as returned by extract_timeseries_rows, for each id in the file
+
+    The file need not be sorted by id. If it is too big to group within the memory budget it is
+    first partitioned into temporary files, which are removed once the generator is exhausted or
+    closed.
+
+    :param str file_path: the historical data csv, which may be compressed
+    :param timeseries_features: the names of the timeseries
+    :param int memory_budget: in bytes
+    :param str temp_dir: where to create the partition files, the system default if None
+    :param str spill_compression: if given, compress the partition files
+    :rtype: iterable[dict[str, Any]]
+    """
+    partitions = partitions_for_budget(file_path, memory_budget)
+    if partitions == 1:
+        with compression.open_file(file_path) as f:
+            for id, id_rows in group_rows(csv.DictReader(f)).iteritems():
+                yield preprocessing.build_timeseries_row(id, id_rows, timeseries_features)
+        return
+
+    print 'Partitioning %s into %s parts' % (file_path, partitions)
+    directory = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        header, paths = partition_file(file_path, directory, partitions, spill_compression)
+        for path in paths:
+            with compression.open_file(path) as f:
+                groups = group_rows(csv.DictReader(f, fieldnames=header))
+            os.remove(path)
+            for id, id_rows in groups.iteritems():
+                yield preprocessing.build_timeseries_row(id, id_rows, timeseries_features)
+    finally:
+        shutil.rmtree(directory)
+
+
+def iter_timeseries_feature_rows(file_path, timeseries_features, new_feature_names=None,
+                                 memory_budget=DEFAULT_MEMORY_BUDGET, temp_dir=None,
+                                 spill_compression=None):
+    """Yield the derived timeseries features of each id in the file, one id at a time
+
+    :rtype: iterable[dict[str, Any]]
+    """
+    derived_features = preprocessing.select_derived_features(new_feature_names)
+    for timeseries_row in iter_timeseries_rows(file_path, timeseries_features, memory_budget,
+                                               temp_dir, spill_compression):
+        output_row = preprocessing.derive_timeseries_features(timeseries_row, timeseries_features,
+                                                              derived_features)
+        output_row['id'] = timeseries_row['id']
+        yield output_row
+
+
+def add_timeseries_features(rows, file_path, features, timeseries_features,
+                            new_feature_names=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                            temp_dir=None, spill_compression=None, index=None):
+    """Like preprocessing.add_timeseries_features, but streaming the historical data from a file
+
+    Only the derived features are kept in memory, not the timeseries themselves. The features are
+    added to views of the rows, the input rows aren't modified. Rows that share an id all get the
+    features of the id, as with preprocessing.add_timeseries_features.
+
+    :param list[dict[str, Any]] rows: a list of data
+    :param str file_path: the historical data csv
+    :param dict[str, dict[str, bool] features:
+    :param timeseries_features: the names of the timeseries
+    :param idindex.IdIndex index: the positions of the rows, if already built
+    :return The rows with extra features added, along with the extra features' details
+    :rtype tuple(list[dict[str, Any], dict[str, dict[str, Any]])
+    """
+    print 'Adding timeseries features from %s' % file_path
+    rows = [rowview.RowView(row) for row in rows]
+    row_index = index if index is not None else idindex.IdIndex.from_rows(rows)
+    rows_by_position = [[] for _ in xrange(len(row_index))]
+    for row, position in zip(rows, row_index.positions(row['id'] for row in rows)):
+        rows_by_position[position].append(row)
+    found = np.zeros(len(row_index), dtype=bool)
+    new_features = {}
+    for feature_row in iter_timeseries_feature_rows(file_path, timeseries_features,
+                                                    new_feature_names, memory_budget, temp_dir,
+                                                    spill_compression):
+        position = row_index.get(feature_row.pop('id'))
+        if position == idindex.MISSING:
+            continue
+        found[position] = True
+        for row in rows_by_position[position]:
+            row.update(feature_row)
+        for new_feature_name in feature_row:
+            new_features[new_feature_name] = preprocessing.NEW_FEATURE_TEMPLATE
+
+    missing = np.flatnonzero(~found)
+    if len(missing):
+        raise KeyError('No historical data for %s ids e.g. %s'
+                       % (len(missing), row_index.id(missing[0])))
+
+    features = dict(chain(features.items(), new_features.items()))
+    return rows, features
@@ -0,0 +1,103 @@
+import csv
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import compression
+import outofcore
+import preprocessing
+
+
+class OutOfCoreTest(unittest.TestCase):
+
+    timeseries_features = ['price_1', 'price_2']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'hist.csv')
+
+        self.rows = []
+        for i in range(40):
+            for month in range(1, 4):
+                self.rows.append({'id': 'id%02d' % i, 'price_date': '2015-%02d-01' % month,
+                                  'price_1': str(i + month), 'price_2': str(month % 2)})
+        shuffled = list(self.rows)
+        random.Random(0).shuffle(shuffled)
+        with open(self.file_path, 'wb') as f:
+            writer = csv.DictWriter(f, ['id', 'price_date', 'price_1', 'price_2'])
+            writer.writeheader()
+            writer.writerows(shuffled)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_partitions_for_budget(self):
+        size = os.path.getsize(self.file_path)
+        self.assertEqual(1, outofcore.partitions_for_budget(self.file_path, size * 100))
+        self.assertEqual(4, outofcore.partitions_for_budget(
+            self.file_path, size * outofcore.ROW_MEMORY_FACTOR / 4.0))
+
+    def test_unsorted_file_matches_in_memory_extraction(self):
+        expected = preprocessing.extract_timeseries_rows(self.rows, {}, self.timeseries_features)
+
+        for memory_budget in (10 ** 9, 1000):
+            rows = list(outofcore.iter_timeseries_rows(self.file_path, self.timeseries_features,
+                                                       memory_budget, temp_dir=self.directory))
+            self.assertItemsEqual(expected, rows)
+        self.assertEqual(['hist.csv'], os.listdir(self.directory))
+
+    def test_compressed_input_and_spill_files(self):
+        expected = preprocessing.extract_timeseries_rows(self.rows, {}, self.timeseries_features)
+        compressed_path = os.path.join(self.directory, 'hist.csv.gz')
+        with open(self.file_path) as f, compression.open_file(compressed_path, 'w') as g:
+            g.write(f.read())
+        os.remove(self.file_path)
+
+        rows = list(outofcore.iter_timeseries_rows(compressed_path, self.timeseries_features,
+                                                   1000, temp_dir=self.directory,
+                                                   spill_compression=compression.BZ2))
+        self.assertItemsEqual(expected, rows)
+        self.assertEqual(['hist.csv.gz'], os.listdir(self.directory))
+
+    def test_partitions_above_the_open_file_limit(self):
+        header, paths = outofcore.partition_file(self.file_path, self.directory, 10, max_open=3)
+        self.assertEqual(10, len(paths))
+        self.assertEqual(sorted(paths + [self.file_path]),
+                         sorted(os.path.join(self.directory, name)
+                                for name in os.listdir(self.directory)))
+
+        partitioned = []
+        for i, path in enumerate(paths):
+            with open(path) as f:
+                rows = list(csv.DictReader(f, fieldnames=header))
+            self.assertTrue(all(outofcore.partition_index(row['id'], 10) == i for row in rows))
+            partitioned.extend(rows)
+        self.assertItemsEqual(self.rows, partitioned)
+
+    def test_add_timeseries_features(self):
+        rows = [{'id': 'id03'}, {'id': 'id01'}]
+        output_rows, features = outofcore.add_timeseries_features(
+            rows, self.file_path, {}, {'price_1'}, ['max', 'sum_returns'], memory_budget=1000,
+            temp_dir=self.directory)
+
+        self.assertEqual([{'id': 'id03', 'price_1_max': 6.0, 'price_1_sum_returns': 2.0},
+                          {'id': 'id01', 'price_1_max': 4.0, 'price_1_sum_returns': 2.0}],
+                         output_rows)
+        self.assertEqual({'price_1_max', 'price_1_sum_returns'}, set(features))
+
+    def test_rows_sharing_an_id(self):
+        rows = [{'id': 'id03'}, {'id': 'id03', 'extra': '1'}]
+        output_rows, _ = outofcore.add_timeseries_features(rows, self.file_path, {}, {'price_1'},
+                                                           ['max'])
+        self.assertEqual([{'id': 'id03', 'price_1_max': 6.0},
+                          {'id': 'id03', 'extra': '1', 'price_1_max': 6.0}], output_rows)
+
+    def test_missing_history(self):
+        with self.assertRaises(KeyError):
+            outofcore.add_timeseries_features([{'id': 'unknown'}], self.file_path, {}, {'price_1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
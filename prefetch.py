@@ -0,0 +1,191 @@
+"""Read input files in background threads, so that reading and parsing overlap the transforms
+
+A Prefetcher parses a csv file in its own thread and hands over chunks of rows through a bounded
+queue, so the main thread can transform each chunk as it arrives while the remaining files are
+still being read. Threads overlap the I/O (including cold caches and network filesystems) with
+the transforms, which is where the time goes; csv parsing itself still holds the GIL.
+"""
+from itertools import groupby
+import Queue
+import sys
+import threading
+
+import load
+import preprocessing
+
+CHUNK_SIZE = 10000
+MAX_QUEUED_CHUNKS = 8
+
+# How often a thread waiting on a full queue checks whether the consumer has stopped, in seconds
+PUT_TIMEOUT = 0.1
+
+_DONE = object()
+
+
+class _Failure(object):
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class Prefetcher(object):
+    """Produce the results of a function in a background thread, started on creation
+
+    Iterate over the prefetcher for the results as they arrive. An exception in the thread is
+    raised again in the consumer. A consumer that stops before the end must close the
+    prefetcher, or use it as a context manager, so that the thread stops and lets go of its file.
+    """
+
+    def __init__(self, produce, max_queued=MAX_QUEUED_CHUNKS):
+        """
+        :param callable produce: returns an iterable of results, run in the thread
+        :param int max_queued: the number of results that can wait to be consumed
+        """
+        self._queue = Queue.Queue(max_queued)
+        self._finished = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(produce,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, result):
+        """Wait for room in the queue, unless the consumer stops
+
+        :return: whether the result was queued
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(result, timeout=PUT_TIMEOUT)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(self, produce):
+        results = None
+        try:
+            results = iter(produce())
+            for result in results:
+                if not self._put(result):
+                    return
+        except Exception:
+            self._put(_Failure(sys.exc_info()))
+        else:
+            self._put(_DONE)
+        finally:
+            # Closing a generator runs its finally blocks, closing the files it opened
+            if hasattr(results, 'close'):
+                results.close()
+
+    def _unwrap(self, result):
+        if result is _DONE:
+            self._finished = True
+            return False
+        if isinstance(result, _Failure):
+            self._finished = True
+            exc_type, exc_value, traceback = result.exc_info
+            raise exc_type, exc_value, traceback
+        return True
+
+    def __iter__(self):
+        while not self._finished:
+            result = self._queue.get()
+            if self._unwrap(result):
+                yield result
+
+    def poll(self):
+        """Yield the results that have already arrived, without waiting for more"""
+        while not self._finished:
+            try:
+                result = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            if self._unwrap(result):
+                yield result
+
+    def join(self):
+        """Wait for and concatenate all the results
+
+        :rtype: list
+        """
+        output = []
+        for result in self:
+            output.extend(result)
+        return output
+
+    def close(self):
+        """Stop the thread, discarding any results not consumed yet"""
+        self._stop.set()
+        self._thread.join()
+        self._finished = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def prefetch_rows(file_path, chunk_size=CHUNK_SIZE):
+    """Start reading a csv file in chunks of rows
+
+    :rtype: Prefetcher
+    """
+    return Prefetcher(lambda: load.iter_row_chunks(file_path, chunk_size))
+
+
+def prefetch_value(function, *args):
+    """Start computing a single value, e.g. a small file, in the background
+
+    :rtype: Prefetcher
+    """
+    return Prefetcher(lambda: [[function(*args)]])
+
+
+class TimeseriesExtractor(object):
+    """Extract the timeseries rows from chunks of historical rows as they arrive
+
+    Gives the same rows as extract_timeseries_rows over the concatenated chunks: the rows of the
+    last id in a chunk are held back until the id's run ends.
+    """
+
+    def __init__(self, timeseries_features):
+        self.timeseries_features = timeseries_features
+        self.timeseries_rows = []
+        self.rows = 0
+        self._pending = []
+
+    def _extract(self, rows):
+        for id, id_rows in groupby(rows, key=lambda row: row['id']):
+            self.timeseries_rows.append(preprocessing.build_timeseries_row(
+                id, list(id_rows), self.timeseries_features))
+
+    def add(self, chunk):
+        self.rows += len(chunk)
+        rows = self._pending + chunk
+        split = len(rows)
+        while split > 0 and rows[split - 1]['id'] == rows[-1]['id']:
+            split -= 1
+        self._extract(rows[:split])
+        self._pending = rows[split:]
+
+    def finish(self):
+        """
+        :rtype: list[dict[str, Any]]
+        """
+        self._extract(self._pending)
+        self._pending = []
+        return self.timeseries_rows
+
+
+def extract_timeseries_chunks(chunks, timeseries_features):
+    """Extract the timeseries rows from chunks of historical rows
+
+    :param iterable[list[dict[str, Any]]] chunks:
+    :param timeseries_features: the names of the timeseries
+    :rtype: list[dict[str, Any]]
+    """
+    extractor = TimeseriesExtractor(timeseries_features)
+    for chunk in chunks:
+        extractor.add(chunk)
+    return extractor.finish()
@@ -0,0 +1,82 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import prefetch
+import preprocessing
+
+
+class PrefetchTest(unittest.TestCase):
+
+    timeseries_features = ['price_1']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'hist.csv')
+
+        self.rows = []
+        for i in range(25):
+            for month in range(1, 1 + i % 4 + 1):
+                self.rows.append({'id': 'id%02d' % i, 'price_date': '2015-%02d-01' % month,
+                                  'price_1': str(i * month)})
+        with open(self.file_path, 'wb') as f:
+            writer = csv.DictWriter(f, ['id', 'price_date', 'price_1'])
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_prefetch_rows_keeps_order(self):
+        for chunk_size in (1, 7, 1000):
+            chunks = list(prefetch.prefetch_rows(self.file_path, chunk_size))
+            self.assertTrue(all(len(chunk) <= chunk_size for chunk in chunks))
+            self.assertEqual(self.rows, [row for chunk in chunks for row in chunk])
+
+    def test_chunked_extraction_matches_extract_timeseries_rows(self):
+        expected = preprocessing.extract_timeseries_rows(self.rows, {}, self.timeseries_features)
+        for chunk_size in (1, 3, 7, 1000):
+            timeseries_rows = prefetch.extract_timeseries_chunks(
+                prefetch.prefetch_rows(self.file_path, chunk_size), self.timeseries_features)
+            self.assertEqual(expected, timeseries_rows)
+
+    def test_poll_does_not_wait(self):
+        prefetcher = prefetch.prefetch_rows(self.file_path, 20)
+        prefetcher._thread.join()
+        polled = [row for chunk in prefetcher.poll() for row in chunk]
+        self.assertEqual(self.rows, polled)
+        self.assertEqual([], list(prefetcher.poll()))
+        self.assertEqual([], prefetcher.join())
+
+    def test_exceptions_are_raised_in_the_consumer(self):
+        def produce():
+            yield [1]
+            raise ValueError('bad chunk')
+
+        prefetcher = prefetch.Prefetcher(produce)
+        self.assertRaisesRegexp(ValueError, 'bad chunk', prefetcher.join)
+
+    def test_prefetch_value(self):
+        self.assertEqual([3], prefetch.prefetch_value(sum, [1, 2]).join())
+
+    def test_close_stops_a_blocked_thread(self):
+        closed = []
+
+        def produce():
+            try:
+                for i in range(100):
+                    yield [i]
+            finally:
+                closed.append(True)
+
+        with prefetch.Prefetcher(produce, max_queued=1) as prefetcher:
+            self.assertEqual([0], next(iter(prefetcher)))
+        self.assertFalse(prefetcher._thread.is_alive())
+        self.assertEqual([True], closed)
+        self.assertEqual([], prefetcher.join())
+
+
+if __name__ == '__main__':
+    unittest.main()
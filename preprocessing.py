@@ -4,52 +4,54 @@ import collections
 from datetime import date
 from itertools import chain
 from itertools import groupby
+import json
 import time
 
 import numpy as np
 import scipy.sparse as sparse
 from sklearn.preprocessing import OneHotEncoder
 
+import categorical
+import idindex
+import rowview
+
 EMPTY_DATE_POLICY = 0
 EMPTY_DATUM_POLICY = 0
 
 DATE_FORMAT = '%Y-%m-%d'
 
+NORMALISATION_CHUNK_SIZE = 100000
+
+
+def transform_categorical_features(rows, features, store=None):
+    """Return views of the rows with the categorical features transformed into integers, along with
+    the store of the codes, whose value_maps() map the integers to the values
 
-def transform_categorical_features(rows, features):
-    """Return a new list of rows with the categorical features transformed into integers, along with
-    a mapping from the integers to the values
+    The input rows aren't modified, and the views share their other columns.
 
     :param list[dict[str, Any]] rows: a list of data
     :param dict[str, dict[str, bool] features:
-    :rtype: tuple[list[dict[str, Any]], dict[int, str]]
+    :param categorical.CategoricalStore store: a store to add the rows to and encode them with,
+        e.g. the frozen store of the training data when transforming test data. By default a
+        store is built from the rows.
+    :rtype: tuple[list[dict[str, Any]], categorical.CategoricalStore]
     """
     print 'Transforming categorical features'
-    categorical_features = {feature_name: {}
-                            for feature_name, feature in features.iteritems()
-                            if int(feature['is_categorical']) and feature_name != 'id'}
-
-    def transform(feature, value):
-        if feature not in categorical_features:
-            return value
-        elif value in categorical_features[feature]:
-            return categorical_features[feature][value]
-        else:
-            categorical_features[feature][value] = len(categorical_features[feature].keys()) + 1
-            return np.float64(categorical_features[feature][value])
+    if store is None:
+        store = categorical.CategoricalStore.from_rows(rows, features)
+    else:
+        store.extend(rows)
 
+    # The store may already hold the codes of earlier rows
+    codes = {feature: column.codes[len(column) - len(rows):]
+             for feature, column in store.columns.iteritems()}
     output = []
-    for row in rows:
-        transformed_row = {}
-        for feature, value in row.iteritems():
-            transformed_row[feature] = transform(feature, value)
-        output.append(transformed_row)
-
-    value_maps = {feature: {transformed_value: original_value
-                            for original_value, transformed_value in values.iteritems()}
-                  for feature, values in categorical_features.iteritems()}
+    for i, row in enumerate(rows):
+        overrides = {feature: int(feature_codes[i])
+                     for feature, feature_codes in codes.iteritems() if feature in row}
+        output.append(rowview.RowView(row, overrides))
 
-    return output, value_maps
+    return output, store
 
 
 def parse_date(value, date_format=DATE_FORMAT):
@@ -57,7 +59,9 @@ def parse_date(value, date_format=DATE_FORMAT):
 
 
 def transform_dates(rows, features, date_format=DATE_FORMAT):
-    """Return a new list of rows with the dates transformed into epoch seconds
+    """Return views of the rows with the dates transformed into epoch seconds
+
+    The input rows aren't modified, and the views share their other columns.
 
     :param list[dict[str, Any]] rows: a list of data
     :param dict[str, dict[str, bool] features:
@@ -65,24 +69,25 @@ def transform_dates(rows, features, date_format=DATE_FORMAT):
     :rtype: tuple[list[dict[str, Any]]
     """
     print 'Transforming dates'
-    def transform(feature, value):
-        if feature not in features:
-            raise ValueError('Unknown feature')
-        elif not int(features[feature]['is_date']):
-            return value
-        elif not value:
-            return EMPTY_DATE_POLICY
-        else:
-            return parse_date(value, date_format)
+    return [rowview.RowView(row, date_overrides(row, features, date_format)) for row in rows]
 
-    output = []
-    for row in rows:
-        transformed_row = {}
-        for feature, value in row.iteritems():
-            transformed_row[feature] = transform(feature, value)
-        output.append(transformed_row)
 
-    return output
+def date_overrides(row, features, date_format=DATE_FORMAT):
+    """The date columns of a row transformed into epoch seconds
+
+    :param dict[str, Any] row:
+    :param dict[str, dict[str, bool] features:
+    :rtype: dict[str, float]
+    :raises ValueError: if the row has a column that isn't a feature
+    """
+    overrides = {}
+    for feature in row:
+        if feature not in features:
+            raise ValueError('Unknown feature')
+        elif int(features[feature]['is_date']):
+            value = row[feature]
+            overrides[feature] = parse_date(value, date_format) if value else EMPTY_DATE_POLICY
+    return overrides
 
 
 def format_timestamp(timestamp):
@@ -96,17 +101,106 @@ def format_timestamp(timestamp):
     return date.fromtimestamp(timestamp).isoformat()
 
 
-def normalise_features(rows, features):
-    """Return a new list of rows with numerical features normalised to mean = 0 and std = 1
+def normalisation_statistics(statistics, chunk):
+    """Merge a chunk of rows into running per column (count, mean, sum of squared deviations)
 
-    for support vector machine
+    Uses the pairwise form of Welford's algorithm, so the matrix can be streamed chunk by chunk.
 
-    :param list[dict[str, Any]] rows: a list of data
+    :param tuple statistics: as returned by this function, or None to start
+    :param np.array[np.float64] chunk: a 2d array of rows
+    :rtype: tuple[int, np.array[np.float64], np.array[np.float64]]
+    """
+    chunk_count = chunk.shape[0]
+    chunk_mean = chunk.mean(axis=0)
+    chunk_m2 = ((chunk - chunk_mean) ** 2).sum(axis=0)
+    if statistics is None or not statistics[0]:
+        return chunk_count, chunk_mean, chunk_m2
+    if not chunk_count:
+        return statistics
+
+    count, mean, m2 = statistics
+    total = count + chunk_count
+    delta = chunk_mean - mean
+    mean = mean + delta * chunk_count / total
+    m2 = m2 + chunk_m2 + delta ** 2 * count * chunk_count / total
+    return total, mean, m2
+
+
+def should_log_normalise(feature):
+    return bool(int(feature.get('log_x') or 0)) and not bool(int(feature.get('is_date') or 0))
+
+
+def log_transform(column):
+    """Replace the values of a column by their signed log, sign(x) * log(1 + |x|), in place"""
+    sign = np.sign(column)
+    np.log1p(np.abs(column, out=column), out=column)
+    column *= sign
+
+
+def fit_normalisation(X, columns, features, chunk_size=NORMALISATION_CHUNK_SIZE):
+    """Compute the parameters to normalise features to mean = 0 and std = 1, e.g. for a support
+    vector machine
+
+    Features flagged log_x are log transformed before being scaled.
+
+    :param X: a 2d array, or an iterable of 2d arrays of rows
+    :param list[str] columns: the feature name of each column of X
     :param dict[str, dict[str, bool] features:
-    :param str date_format: the format of the date for the time.strptime parser
-    :rtype: list[dict[str, Any]
+    :param int chunk_size: the number of rows to process at a time
+    :rtype: dict[str, list]
+    """
+    chunks = X
+    if isinstance(X, np.ndarray):
+        chunks = (X[i:i + chunk_size] for i in xrange(0, X.shape[0], chunk_size))
+    log = [should_log_normalise(features.get(name, {})) for name in columns]
+
+    statistics = None
+    for chunk in chunks:
+        if any(log):
+            chunk = np.array(chunk, dtype=np.float64)
+            for j in np.flatnonzero(log):
+                log_transform(chunk[:, j])
+        statistics = normalisation_statistics(statistics, chunk)
+
+    if statistics is None or not statistics[0]:
+        raise ValueError('Cannot fit normalisation without any rows')
+    count, mean, m2 = statistics
+    std = np.sqrt(m2 / count)
+    std[std == 0] = 1
+    return {'columns': list(columns), 'log': log, 'mean': list(mean), 'std': list(std)}
+
+
+def normalise_features(X, columns, features=None, parameters=None):
+    """Normalise the features of a vectorised matrix in place, to mean = 0 and std = 1
+
+    :param np.array[np.float64] X: the matrix, modified in place
+    :param list[str] columns: the feature name of each column of X
+    :param dict[str, dict[str, bool] features: used to fit the parameters if none are given
+    :param dict[str, list] parameters: as returned by fit_normalisation, e.g. from the training
+        data when normalising test data
+    :return: The parameters used
+    :rtype: dict[str, list]
     """
-    pass
+    if parameters is None:
+        parameters = fit_normalisation(X, columns, features)
+    elif list(columns) != parameters['columns']:
+        raise ValueError('The columns differ from those the normalisation was fitted to')
+
+    for j in np.flatnonzero(parameters['log']):
+        log_transform(X[:, j])
+    X -= np.array(parameters['mean'])
+    X /= np.array(parameters['std'])
+    return parameters
+
+
+def save_normalisation(parameters, file_path):
+    with open(file_path, 'w') as f:
+        json.dump(parameters, f)
+
+
+def load_normalisation(file_path):
+    with open(file_path) as f:
+        return json.load(f)
 
 
 def timeseries_max(_, y):
@@ -130,6 +224,20 @@ def timeseries_sum_returns(_, y):
         return 0
 
 
+DERIVED_FEATURES = {
+    'max': {'name': 'max', 'is_date': 0, 'is_categorical': 0,
+            'function': timeseries_max},
+    'min': {'name': 'min', 'is_date': 0, 'is_categorical': 0,
+            'function': timeseries_min},
+    'range': {'name': 'range', 'is_date': 0, 'is_categorical': 0,
+              'function': timeseries_range},
+    'sum_returns': {'name': 'sum_returns', 'is_date': 0,
+                    'is_categorical': 0, 'function': timeseries_sum_returns},
+}
+
+NEW_FEATURE_TEMPLATE = {'is_date': 0, 'is_categorical': 0, 'log_x': False, 'bandwidth': 0.2}
+
+
 def extract_timeseries_rows(timeseries_rows, features, timeseries_features):
     """Extract the timeseries
 
@@ -142,16 +250,26 @@ def extract_timeseries_rows(timeseries_rows, features, timeseries_features):
     print 'Extracting timeseries rows'
     output = []
     for id, id_rows in groupby(timeseries_rows, key=lambda row: row['id']):
-        output_row = {'id': id}
-        id_rows = list(id_rows)
-        for feature_name in timeseries_features:
-            timeseries = {parse_date(id_row['price_date']): id_row[feature_name]
-                          for id_row in id_rows}
-            output_row[feature_name] = timeseries
-        output.append(output_row)
+        output.append(build_timeseries_row(id, list(id_rows), timeseries_features))
     return output
 
 
+def build_timeseries_row(id, id_rows, timeseries_features):
+    """Collect one customer's historical rows into a timeseries per feature
+
+    :param str id:
+    :param list[dict[str, Any]] id_rows: the historical rows with this id
+    :param timeseries_features: the names of the timeseries
+    :rtype: dict[str, Any]
+    """
+    output_row = {'id': id}
+    timestamps = [parse_date(id_row['price_date']) for id_row in id_rows]
+    for feature_name in timeseries_features:
+        output_row[feature_name] = dict(zip(timestamps,
+                                            (id_row[feature_name] for id_row in id_rows)))
+    return output_row
+
+
 def make_xy(feature_name, row):
     """Extract the timestamps and values (x, y) from a timeseries row"""
     try:
@@ -165,51 +283,72 @@ def make_xy(feature_name, row):
 
 
 def add_timeseries_features(rows, timeseries_rows, features,
-                            timeseries_features, new_feature_names=None):
+                            timeseries_features, new_feature_names=None, timeseries_index=None):
     """Extract some features from timeseries features and add them to the features set
 
+    The features are added to views of the rows, the input rows aren't modified.
+
     :param list[dict[str, Any]] rows: a list of data
     :param dict[str, dict[str, bool] features:
     :param dict[str, dict[str, bool] timeseries_features:
+    :param idindex.IdIndex timeseries_index: the positions of the timeseries rows, if already built
+        e.g. the index of the data rows, with the timeseries rows aligned to it
     :return The rows with extra features added, along with the extra features' details
     :rtype tuple(list[dict[str, Any], list[list[str]])
     """
     print 'Adding timeseries features'
-    derived_features = {
-        'max': {'name': 'max', 'is_date': 0, 'is_categorical': 0,
-                'function': timeseries_max},
-        'min': {'name': 'min', 'is_date': 0, 'is_categorical': 0,
-                'function': timeseries_min},
-        'range': {'name': 'range', 'is_date': 0, 'is_categorical': 0,
-                  'function': timeseries_range},
-        'sum_returns': {'name': 'sum_returns', 'is_date': 0,
-                        'is_categorical': 0, 'function': timeseries_sum_returns},
-    }
-    if new_feature_names:
-        derived_features = {k: derived_features[k]
-                            for k in new_feature_names if k in derived_features}
-
-    new_feature_template = {'is_date': 0, 'is_categorical': 0, 'log_x': False, 'bandwidth': 0.2}
+    derived_features = select_derived_features(new_feature_names)
+
     new_features = {}
 
-    timeseries_rows_index = {row['id']: int(i) for i, row in enumerate(timeseries_rows)}
+    if timeseries_index is None:
+        timeseries_index = idindex.IdIndex.from_rows(timeseries_rows)
 
+    output = []
     for i, row in enumerate(rows):
-        ts_index = int(timeseries_rows_index[row['id']])
-        timeseries_row = timeseries_rows[ts_index]
+        row = rowview.RowView(row)
+        output.append(row)
+        timeseries_row = timeseries_rows[timeseries_index.position(row['id'])]
+        if timeseries_row is None:
+            raise KeyError(row['id'])
         assert timeseries_row['id'] == row['id']
-        for timeseries_name, timeseries in timeseries_row.iteritems():
-            if timeseries_name in timeseries_features:
-                for feature_name in derived_features:
-                    x, y = make_xy(timeseries_name, timeseries_row)
-                    derived_value = derived_features[feature_name]['function'](x, y)
-                    new_feature_name = timeseries_name + '_' + feature_name
-                    row[new_feature_name] = derived_value
-                    new_features[new_feature_name] = new_feature_template
+        for new_feature_name, derived_value in derive_timeseries_features(
+                timeseries_row, timeseries_features, derived_features).iteritems():
+            row[new_feature_name] = derived_value
+            new_features[new_feature_name] = NEW_FEATURE_TEMPLATE
 
     # Add timeseries features to features
     features = dict(chain(features.items(), new_features.items()))
-    return rows, features
+    return output, features
+
+
+def select_derived_features(new_feature_names=None):
+    """Return the derived timeseries features to compute, all of them by default
+
+    :param list[str] new_feature_names: e.g. ['max', 'min']
+    :rtype: dict[str, dict[str, Any]]
+    """
+    if not new_feature_names:
+        return DERIVED_FEATURES
+    return {k: DERIVED_FEATURES[k] for k in new_feature_names if k in DERIVED_FEATURES}
+
+
+def derive_timeseries_features(timeseries_row, timeseries_features, derived_features):
+    """Compute the derived features of a single customer's timeseries
+
+    :param dict[str, Any] timeseries_row: a row as returned by extract_timeseries_rows
+    :param timeseries_features: the names of the timeseries to derive features from
+    :param dict[str, dict[str, Any]] derived_features: as returned by select_derived_features
+    :return: The derived values by new feature name e.g. 'price_p1_var_max'
+    :rtype: dict[str, float]
+    """
+    output = {}
+    for timeseries_name in timeseries_row:
+        if timeseries_name in timeseries_features:
+            x, y = make_xy(timeseries_name, timeseries_row)
+            for feature_name, derived_feature in derived_features.iteritems():
+                output[timeseries_name + '_' + feature_name] = derived_feature['function'](x, y)
+    return output
 
 
 def vectorise(rows, features):
@@ -220,9 +359,20 @@ def vectorise(rows, features):
     :rtype: np.array[np.float64]
     """
     features = sorted(set(features.keys()).intersection(set(rows[0].keys())))
-    X = np.zeros([len(rows), len(features)])
+    return vectorise_columns(rows, features)
+
+
+def vectorise_columns(rows, columns, out=None):
+    """Return a numpy array of the given columns of the rows, in that order
+
+    :param list[dict[str, float]] rows:
+    :param list[str] columns:
+    :param np.array[np.float64] out: an array of shape (len(rows), len(columns)) to fill
+    :rtype: np.array[np.float64]
+    """
+    X = np.zeros([len(rows), len(columns)]) if out is None else out
     for i, row in enumerate(rows):
-        for j, feature in enumerate(features):
+        for j, feature in enumerate(columns):
             value = row.get(feature)
             if value == '':
                 value = EMPTY_DATUM_POLICY
@@ -247,33 +397,48 @@ def encode_categorical_features(data, features):
     return enc.fit_transform(data)
 
 
-def labelled_training_data(data_rows, label_rows, features, label_name):
+def categorical_feature_names(features):
+    """
+    :param dict[str, dict[str, bool]] features:
+    :rtype: frozenset[str]
+    """
+    return frozenset(name for name, feature in features.iteritems()
+                     if bool(int(feature['is_categorical'])))
+
+
+def model_columns(row, features):
+    """The columns of the matrices labelled_training_data and test_data return, in order: the
+    features of the row other than the id and the categorical features
+
+    :param dict[str, Any] row: a transformed data row
+    :param dict[str, dict[str, bool]] features:
+    :rtype: list[str]
+    """
+    hidden = categorical_feature_names(features) | {'id'}
+    return sorted(name for name in row if name in features and name not in hidden)
+
+
+def labelled_training_data(data_rows, label_rows, features, label_name, data_index=None):
     """Return processed and vectorised data and labels
 
     :param list[dict[str, Any]] data_rows:
     :param list[dict[str, Any]] label_rows:
     :param dict[str, dict[str, bool]] features:
     :param str label_name:
+    :param idindex.IdIndex data_index: the positions of the data rows, if already built
     :rtype: tuple[np.array, np.array]
     """
-    for row in data_rows:
-        for name, feature in features.iteritems():
-            if bool(int(feature['is_categorical'])):
-                if name in row and name != 'id':
-                    row.pop(name)
-
-    data_by_id = {row['id']: row for row in data_rows}
-    labels_by_id = {row['id']: row for row in label_rows}
-    ids = list(set(data_by_id.keys()).intersection(set(labels_by_id.keys())))
+    if data_index is None:
+        data_index = idindex.IdIndex.from_rows(data_rows)
+    hidden = categorical_feature_names(features) | {'id'}
 
     # Guarantee the labels are correct
     rows, labels = [], []
-    for id in ids:
-        row = data_by_id[id]
-        if row.get('id'):
-            row.pop('id')
-        rows.append(row)
-        labels.append(labels_by_id[id][label_name])
+    for row, label_row in zip(data_index.align(data_rows), data_index.align(label_rows)):
+        if label_row is None:
+            continue
+        rows.append(rowview.RowView(row, hidden=hidden))
+        labels.append(label_row[label_name])
 
     features = {name: features[name] for name in rows[0].iterkeys() if name != 'id'}
     data = vectorise(rows, features)
@@ -303,17 +468,12 @@ def test_data(data_rows, features):
     #             s = category_sets[name]
     #             s.union({row[name]})
 
-    for row in data_rows:
-        row.pop('id')
-        for name, feature in features.iteritems():
-            if bool(int(feature['is_categorical'])):
-                if name in row:
-                    row.pop(name)
-        # for name, category_set in category_sets.iteritems():
-        #     if row[name] not in category_set:
-        #         row[name] = ''
-
-    data = vectorise(data_rows, features)
+    rows = rowview.project_rows(data_rows, categorical_feature_names(features) | {'id'})
+    # for name, category_set in category_sets.iteritems():
+    #     if row[name] not in category_set:
+    #         row[name] = ''
+
+    data = vectorise(rows, features)
     return data
 
     # X = encode_categorical_features(data, features).toarray()
@@ -1,5 +1,10 @@
 import unittest
 
+import numpy as np
+
+import fixtures
+import load
+import prefetch
 import preprocessing
 
 
@@ -29,10 +34,10 @@ class PreprocessingTest(unittest.TestCase):
                 3: 'big'
             }
         }
-        transformed_rows, value_map = preprocessing.transform_categorical_features(rows, features)
+        transformed_rows, store = preprocessing.transform_categorical_features(rows, features)
 
         self.assertEqual(expected_rows, transformed_rows)
-        self.assertEqual(expected_value_map, value_map)
+        self.assertEqual(expected_value_map, store.value_maps())
 
     def test_missing_categorical_features(self):
         features = {'type': {'is_categorical': True}}
@@ -55,6 +60,19 @@ class PreprocessingTest(unittest.TestCase):
 
         self.assertEqual(expected_rows, transformed_rows)
 
+    def test_test_rows_get_the_training_codes(self):
+        features = {'type': {'is_categorical': True}}
+        _, store = preprocessing.transform_categorical_features(
+            [{'type': 'small'}, {'type': 'big'}], features)
+
+        test_store = store.frozen()
+        for batch, expected_codes in [([{'type': 'big'}, {'type': 'huge'}], [2, 0]),
+                                      ([{'type': 'small'}], [1])]:
+            transformed_rows, _ = preprocessing.transform_categorical_features(batch, features,
+                                                                               test_store)
+            self.assertEqual(expected_codes, [row['type'] for row in transformed_rows])
+        self.assertEqual({'type': {1: 'small', 2: 'big'}}, test_store.value_maps())
+
     def test_simple_dates(self):
 
         features = {'date': {'is_date': True},
@@ -248,6 +266,30 @@ class PreprocessingTest(unittest.TestCase):
 
         data, labels = preprocessing.labelled_training_data(rows, label_rows, features, 'churned')
 
+    def test_transforms_do_not_modify_rows(self):
+        features = {'id': {'is_categorical': '1', 'is_date': '0'},
+                    'type': {'is_categorical': '1', 'is_date': '0'},
+                    'date': {'is_categorical': '0', 'is_date': '1'},
+                    'weight': {'is_categorical': '0', 'is_date': '0'}}
+        rows = [
+            {'type': 'small', 'weight': '100', 'date': '2016-10-02', 'id': '1'},
+            {'type': 'big', 'weight': '150', 'date': '', 'id': '2'},
+        ]
+        label_rows = [{'id': '2', 'churned': 1}, {'id': '1', 'churned': 0}]
+        original_rows = [dict(row) for row in rows]
+
+        date_rows = preprocessing.transform_dates(rows, features)
+        date_rows, _ = preprocessing.transform_categorical_features(date_rows, features)
+        data, labels = preprocessing.labelled_training_data(date_rows, label_rows, features,
+                                                            'churned')
+        test_data = preprocessing.test_data(date_rows, features)
+
+        self.assertEqual(original_rows, rows)
+        self.assertEqual(1, date_rows[0]['type'])
+        self.assert_array_elements_equal(data, [[1475362800.0, 100], [0, 150]])
+        self.assertEqual([0, 1], list(labels))
+        self.assert_array_elements_equal(test_data, data)
+
     def assert_array_elements_equal(self, array, expected_array):
         for i, row in enumerate(array):
             for j, value in enumerate(row):
@@ -312,6 +354,178 @@ class PreprocessingTest(unittest.TestCase):
             rows, timeseries_rows, features, timeseries_features, ['max'])
         self.assertEqual(expected_rows, output_rows)
 
+    def test_normalise_features(self):
+        features = {'weight': {'log_x': '0', 'is_date': '0'},
+                    'margin': {'log_x': '1', 'is_date': '0'}}
+        columns = ['margin', 'weight']
+        X = np.array([[-10.0, 100], [0, 120], [10, 150], [1000, 190], [5, 190]])
+        original = X.copy()
+
+        parameters = preprocessing.fit_normalisation(X, columns, features, chunk_size=2)
+        self.assertEqual([True, False], parameters['log'])
+        self.assert_array_elements_equal(X, original)
+
+        output = preprocessing.normalise_features(X, columns, features)
+        np.testing.assert_allclose(X.mean(axis=0), [0, 0], atol=1e-12)
+        np.testing.assert_allclose(X.std(axis=0), [1, 1])
+        np.testing.assert_allclose(parameters['mean'], output['mean'])
+        np.testing.assert_allclose(
+            parameters['mean'][0], np.mean(np.sign(original[:, 0]) * np.log1p(abs(original[:, 0]))))
+
+        test_X = original[:2].copy()
+        preprocessing.normalise_features(test_X, columns, parameters=parameters)
+        np.testing.assert_allclose(test_X, X[:2])
+
+        with self.assertRaises(ValueError):
+            preprocessing.normalise_features(test_X, ['weight', 'margin'], parameters=parameters)
+
+    def test_normalisation_statistics_merge_chunks(self):
+        X = np.random.RandomState(0).normal(3, 2, (101, 3))
+        statistics = None
+        for i in range(0, 101, 10):
+            statistics = preprocessing.normalisation_statistics(statistics, X[i:i + 10])
+        count, mean, m2 = statistics
+        self.assertEqual(101, count)
+        np.testing.assert_allclose(X.mean(axis=0), mean)
+        np.testing.assert_allclose(X.var(axis=0), m2 / count)
+
+
+class RealDataTest(unittest.TestCase):
+
+    def test_model_data(self):
+        X, y, columns = fixtures.model_data()
+        categorical = preprocessing.categorical_feature_names(fixtures.features())
+
+        self.assertEqual((len(fixtures.data_rows()), len(columns)), X.shape)
+        self.assertEqual(len(load.load_label_values(fixtures._path(load.TRAINING_LABELS_FILE))),
+                         len(y))
+        self.assertEqual({0.0, 1.0}, set(y))
+        self.assertFalse(categorical & set(columns))
+        self.assertIn('price_p1_var_max', columns)
+        self.assertTrue(np.isfinite(X).all())
+
+    def test_fixtures_are_read_only(self):
+        X, y, _ = fixtures.model_data()
+        with self.assertRaises(ValueError):
+            X[0, 0] = 1.0
+        with self.assertRaises(ValueError):
+            y[0] = 1.0
+
+        rows = fixtures.data_rows()
+        rows[0]['cons_12m'] = 'changed'
+        del rows[1]['id']
+        self.assertNotEqual('changed', fixtures.data_rows()[0]['cons_12m'])
+        self.assertIn('id', fixtures.data_rows()[1])
+
+
+class BatchEquivalenceTest(unittest.TestCase):
+    """The batch paths against the per row functions, on rows sampled like the real extract"""
+
+    seeds = range(5)
+
+    def random_rows(self, seed):
+        rng = np.random.RandomState(seed)
+        data_rows = fixtures.random_data_rows(seed, rng.randint(1, 60))
+        ids = [row['id'] for row in data_rows]
+        historical_rows = fixtures.random_historical_rows(seed, ids, rng.randint(1, 13))
+        return data_rows, historical_rows
+
+    def test_transform_dates(self):
+        features = fixtures.features()
+        for seed in self.seeds:
+            rows, _ = self.random_rows(seed)
+            for row, date_row in zip(rows, preprocessing.transform_dates(rows, features)):
+                for name, value in row.iteritems():
+                    if int(features[name]['is_date']):
+                        expected = (preprocessing.parse_date(value) if value
+                                    else preprocessing.EMPTY_DATE_POLICY)
+                    else:
+                        expected = value
+                    self.assertEqual(expected, date_row[name], 'seed %s' % seed)
+
+    def test_extract_timeseries_rows(self):
+        names = load.TIMESERIES_FEATURES
+        for seed in self.seeds:
+            _, historical_rows = self.random_rows(seed)
+            expected = []
+            for row in historical_rows:
+                if not expected or expected[-1]['id'] != row['id']:
+                    expected.append({'id': row['id'], 'rows': []})
+                expected[-1]['rows'].append(row)
+            expected = [preprocessing.build_timeseries_row(group['id'], group['rows'], names)
+                        for group in expected]
+
+            self.assertEqual(expected, preprocessing.extract_timeseries_rows(
+                historical_rows, fixtures.features(), names), 'seed %s' % seed)
+            chunk_size = np.random.RandomState(seed).randint(1, 30)
+            chunks = [historical_rows[i:i + chunk_size]
+                      for i in range(0, len(historical_rows), chunk_size)]
+            self.assertEqual(expected, prefetch.extract_timeseries_chunks(chunks, names),
+                             'seed %s' % seed)
+
+    def test_add_timeseries_features(self):
+        names = load.TIMESERIES_FEATURES
+        derived_features = preprocessing.select_derived_features()
+        for seed in self.seeds:
+            data_rows, historical_rows = self.random_rows(seed)
+            timeseries_rows = preprocessing.extract_timeseries_rows(historical_rows, {}, names)
+            # The timeseries rows needn't be in the order of the data rows
+            np.random.RandomState(seed).shuffle(timeseries_rows)
+            by_id = {row['id']: row for row in timeseries_rows}
+
+            rows, _ = preprocessing.add_timeseries_features(data_rows, timeseries_rows,
+                                                            fixtures.features(), names)
+            for data_row, row in zip(data_rows, rows):
+                expected = dict(data_row)
+                expected.update(preprocessing.derive_timeseries_features(
+                    by_id[data_row['id']], names, derived_features))
+                self.assertEqual(expected, dict(row), 'seed %s' % seed)
+
+    def test_transform_categorical_features(self):
+        features = fixtures.features()
+        for seed in self.seeds:
+            rows, _ = self.random_rows(seed)
+            transformed, store = preprocessing.transform_categorical_features(rows, features)
+            value_maps = store.value_maps()
+            for name in value_maps:
+                # Codes from 1, in the order the values are first seen
+                codes = {}
+                for row, transformed_row in zip(rows, transformed):
+                    code = codes.setdefault(row[name], len(codes) + 1)
+                    self.assertEqual(code, transformed_row[name], 'seed %s' % seed)
+                self.assertEqual({code: value for value, code in codes.iteritems()},
+                                 value_maps[name])
+
+    def test_vectorise_columns(self):
+        for seed in self.seeds:
+            rows, _ = self.random_rows(seed)
+            rows = preprocessing.transform_dates(rows, fixtures.features())
+            columns = preprocessing.model_columns(rows[0], fixtures.features())
+            X = preprocessing.vectorise_columns(rows, columns)
+            for i, row in enumerate(rows):
+                expected = [np.float64(row[name]) if row[name] != ''
+                            else preprocessing.EMPTY_DATUM_POLICY for name in columns]
+                np.testing.assert_array_equal(expected, X[i], 'seed %s' % seed)
+
+    def test_labelled_training_data(self):
+        features = fixtures.features()
+        for seed in self.seeds:
+            rows, _ = self.random_rows(seed)
+            rows = preprocessing.transform_dates(rows, features)
+            rng = np.random.RandomState(seed)
+            # Labels in another order, some of them missing
+            label_rows = [{'id': row['id'], 'churned': rng.randint(2)} for row in rows
+                          if rng.random_sample() < 0.8] or [{'id': rows[0]['id'], 'churned': 1}]
+            labels = {row['id']: row['churned'] for row in label_rows}
+            rng.shuffle(label_rows)
+
+            X, y = preprocessing.labelled_training_data(rows, label_rows, features, 'churned')
+            labelled = [row for row in rows if row['id'] in labels]
+            columns = preprocessing.model_columns(rows[0], features)
+            np.testing.assert_array_equal(preprocessing.vectorise_columns(labelled, columns), X,
+                                          'seed %s' % seed)
+            np.testing.assert_array_equal([labels[row['id']] for row in labelled], y)
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
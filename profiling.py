@@ -0,0 +1,201 @@
+"""Stage-level timing of the pipelines in main
+
+Wrap a stage in ``with profiling.stage('name') as s:`` and set ``s.rows`` to the number of rows it
+processed. Each finished stage produces a record which is passed to every registered hook. With no
+hooks registered, stage returns a shared no-op object, so the instrumentation costs nothing.
+
+    report = profiling.Report()
+    with profiling.hooks(report, profiling.log_hook):
+        main.classify_and_predict()
+    print report.format()
+"""
+from __future__ import division
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import os
+import resource
+import time
+
+_hooks = []
+
+
+def add_hook(hook):
+    """Register a callable to be passed each finished stage record
+
+    :param callable hook: called with a dict[str, Any]
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def enabled():
+    return bool(_hooks)
+
+
+@contextmanager
+def hooks(*stage_hooks):
+    """Register the hooks for the duration of a with block"""
+    for hook in stage_hooks:
+        add_hook(hook)
+    try:
+        yield
+    finally:
+        for hook in stage_hooks:
+            remove_hook(hook)
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_bytes():
+    """The resident set size of this process, or the peak if the current size is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Stage(object):
+    """Measures one run of a stage, and reports it to the hooks on exit"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        self._rss = _rss_bytes()
+        self._cpu = _cpu_time()
+        self._wall = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.time() - self._wall
+        record = {
+            'stage': self.name,
+            'wall_time': wall_time,
+            'cpu_time': _cpu_time() - self._cpu,
+            'rows': self.rows,
+            'rows_per_second': self.rows / wall_time if self.rows and wall_time else None,
+            'memory_delta': _rss_bytes() - self._rss,
+            'failed': exc_type is not None,
+        }
+        for hook in list(_hooks):
+            hook(record)
+        return False
+
+
+class _NullStage(object):
+
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """Return a context manager measuring the named stage
+
+    :param str name:
+    :rtype: Stage
+    """
+    return Stage(name) if _hooks else _NULL_STAGE
+
+
+def log_hook(record):
+    """Print a one line summary of each stage"""
+    print 'Finished %s in %.3fs (cpu %.3fs, %s rows, memory %+.1f MB)' % (
+        record['stage'], record['wall_time'], record['cpu_time'],
+        record['rows'] if record['rows'] is not None else '?',
+        record['memory_delta'] / 2 ** 20)
+
+
+class JsonLinesHook(object):
+    """Append each stage record to a file as a line of JSON"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def __call__(self, record):
+        with open(self.file_path, 'a') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+class Report(object):
+    """Collect stage records in process and summarise them"""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def summary(self):
+        """Totals per stage, in the order the stages first finished
+
+        :rtype: OrderedDict[str, dict[str, Any]]
+        """
+        totals = OrderedDict()
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {
+                'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'rows': 0, 'memory_delta': 0})
+            total['calls'] += 1
+            total['wall_time'] += record['wall_time']
+            total['cpu_time'] += record['cpu_time']
+            total['rows'] += record['rows'] or 0
+            total['memory_delta'] += record['memory_delta']
+        for total in totals.itervalues():
+            total['rows_per_second'] = (total['rows'] / total['wall_time']
+                                        if total['rows'] and total['wall_time'] else None)
+        return totals
+
+    def format(self):
+        """A plain text table of the summary, slowest stage first
+
+        :rtype: str
+        """
+        summary = self.summary()
+        overall = sum(total['wall_time'] for total in summary.itervalues()) or 1
+        lines = ['%-36s %6s %10s %10s %6s %10s %12s %10s' % (
+            'stage', 'calls', 'wall (s)', 'cpu (s)', '%', 'rows', 'rows/s', 'mem (MB)')]
+        for name, total in sorted(summary.iteritems(), key=lambda item: -item[1]['wall_time']):
+            lines.append('%-36s %6d %10.3f %10.3f %6.1f %10d %12s %10.1f' % (
+                name, total['calls'], total['wall_time'], total['cpu_time'],
+                100 * total['wall_time'] / overall, total['rows'],
+                '%.0f' % total['rows_per_second'] if total['rows_per_second'] else '-',
+                total['memory_delta'] / 2 ** 20))
+        return '\n'.join(lines)
+
+    def save(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump({'records': self.records, 'summary': self.summary()}, f, indent=2)
+
+
+def report_from_json_lines(file_path):
+    """Rebuild a report from a file written by JsonLinesHook
+
+    :rtype: Report
+    """
+    report = Report()
+    if os.path.exists(file_path):
+        with open(file_path) as f:
+            for line in f:
+                if line.strip():
+                    report(json.loads(line))
+    return report
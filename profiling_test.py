@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+
+import profiling
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_disabled_stage_is_shared_no_op(self):
+        self.assertFalse(profiling.enabled())
+        with profiling.stage('a') as s:
+            s.rows = 10
+        self.assertIs(s, profiling.stage('b'))
+        self.assertIsNone(s.rows)
+
+    def test_report(self):
+        report = profiling.Report()
+        with profiling.hooks(report):
+            for _ in range(2):
+                with profiling.stage('parse') as s:
+                    s.rows = 5
+            with profiling.stage('fit'):
+                pass
+        self.assertFalse(profiling.enabled())
+
+        summary = report.summary()
+        self.assertEqual(['parse', 'fit'], list(summary.keys()))
+        self.assertEqual(2, summary['parse']['calls'])
+        self.assertEqual(10, summary['parse']['rows'])
+        self.assertEqual(0, summary['fit']['rows'])
+        self.assertIn('parse', report.format())
+
+    def test_failed_stage_is_recorded(self):
+        records = []
+        with profiling.hooks(records.append):
+            with self.assertRaises(ValueError):
+                with profiling.stage('broken'):
+                    raise ValueError()
+        self.assertTrue(records[0]['failed'])
+
+    def test_json_lines(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            with profiling.hooks(profiling.JsonLinesHook(path)):
+                with profiling.stage('load') as s:
+                    s.rows = 3
+            with open(path) as f:
+                self.assertEqual('load', json.loads(f.readline())['stage'])
+            self.assertEqual(3, profiling.report_from_json_lines(path).summary()['load']['rows'])
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
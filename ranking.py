@@ -0,0 +1,101 @@
+"""Rank the customers most at risk of churning within each segment, without sorting every score
+
+A SegmentRanker keeps a heap of at most k customers per segment (e.g. per channel_sales) as scores
+arrive, a row or a batch at a time. Within a batch, np.partition finds each segment's kth best
+score in linear time, so only the rows above it are pushed through the heap. Memory and the sorting
+at the end are proportional to k per segment, not to the number of customers.
+
+    ranker = ranking.SegmentRanker(100)
+    ranker.add_batch(ids, segments, churn_probabilities)
+    ranking.write_rankings(ranker.ranked(), 'retention_targets.csv')
+"""
+import csv
+import heapq
+import itertools
+
+import numpy as np
+
+import compression
+
+RANKING_COLUMNS = ['segment', 'rank', 'id', 'probability']
+
+
+def top_indices(scores, k):
+    """The positions of the k highest scores, highest first
+
+    :param np.array scores:
+    :param int k:
+    :rtype: np.array[int]
+    """
+    scores = np.asarray(scores)
+    if k < len(scores):
+        # Ties with the kth highest score go to the earlier positions
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        candidates = np.concatenate([above, np.flatnonzero(scores == kth)[:k - len(above)]])
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+class SegmentRanker(object):
+    """The k highest scoring ids of each segment, of the scores added so far"""
+
+    def __init__(self, k):
+        """
+        :param int k: the most ids to keep per segment
+        """
+        if k < 1:
+            raise ValueError('k must be positive, got %s' % k)
+        self.k = k
+        self.heaps = {}
+        # Breaks ties in favour of the ids added first
+        self._order = itertools.count()
+
+    def add(self, segment, id, score):
+        heap = self.heaps.setdefault(segment, [])
+        entry = (score, -next(self._order), id)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def add_batch(self, ids, segments, scores):
+        """
+        :param list[str] ids:
+        :param list segments: the segment of each id, or None to rank them all together
+        :param np.array scores:
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        if segments is None:
+            groups = [(None, np.arange(len(scores)))]
+        else:
+            values, inverse = np.unique(np.asarray(segments), return_inverse=True)
+            groups = [(value, np.flatnonzero(inverse == i)) for i, value in enumerate(values)]
+        for segment, positions in groups:
+            best = positions[top_indices(scores[positions], self.k)]
+            # Keep the order the rows arrived in, so ties in the heap go to the earlier rows
+            for position in np.sort(best):
+                self.add(segment, ids[position], float(scores[position]))
+
+    def ranked(self):
+        """
+        :return: the (id, score) of the k highest scoring ids of each segment, highest first
+        :rtype: dict[Any, list[(str, float)]]
+        """
+        return {segment: [(id, score) for score, _, id in sorted(heap, reverse=True)]
+                for segment, heap in self.heaps.iteritems()}
+
+
+def write_rankings(rankings, file_path):
+    """Write the ranked ids of each segment, as csv
+
+    :param dict[Any, list[(str, float)]] rankings: as returned by SegmentRanker.ranked
+    :param str file_path: compressed if the name ends in .gz, .bz2, .xz or .zst
+    """
+    with compression.open_file(file_path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(RANKING_COLUMNS)
+        for segment in sorted(rankings):
+            for rank, (id, score) in enumerate(rankings[segment], 1):
+                writer.writerow(['' if segment is None else segment, rank, id, repr(score)])
@@ -0,0 +1,81 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import ranking
+
+
+class RankingTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        # Rounded so that there are ties
+        self.scores = np.round(rng.rand(1000), 2)
+        self.segments = list(rng.choice(['direct', 'online', 'phone'], 1000))
+        self.ids = ['id%04d' % i for i in range(1000)]
+
+    def expected(self, k):
+        """The top k of each segment by sorting everything, ties going to the earlier ids"""
+        rankings = {}
+        for segment in set(self.segments):
+            rows = [(-score, id) for id, row_segment, score
+                    in zip(self.ids, self.segments, self.scores) if row_segment == segment]
+            rankings[segment] = [(id, -score) for score, id in sorted(rows)[:k]]
+        return rankings
+
+    def test_top_indices(self):
+        for k in (1, 10, 999, 1000, 2000):
+            expected = sorted(range(1000), key=lambda i: (-self.scores[i], i))[:k]
+            np.testing.assert_array_equal(expected, ranking.top_indices(self.scores, k))
+
+    def test_batch_matches_sorting(self):
+        ranker = ranking.SegmentRanker(25)
+        ranker.add_batch(self.ids, self.segments, self.scores)
+        self.assertEqual(self.expected(25), ranker.ranked())
+
+    def test_streamed_batches_and_rows_match_one_batch(self):
+        batched = ranking.SegmentRanker(25)
+        for start in range(0, 1000, 64):
+            batched.add_batch(self.ids[start:start + 64], self.segments[start:start + 64],
+                              self.scores[start:start + 64])
+        streamed = ranking.SegmentRanker(25)
+        for id, segment, score in zip(self.ids, self.segments, self.scores):
+            streamed.add(segment, id, score)
+
+        self.assertEqual(self.expected(25), batched.ranked())
+        self.assertEqual(self.expected(25), streamed.ranked())
+        # Only k entries are kept per segment
+        self.assertEqual([25, 25, 25], [len(heap) for heap in batched.heaps.values()])
+
+    def test_unsegmented(self):
+        ranker = ranking.SegmentRanker(5)
+        ranker.add_batch(self.ids, None, self.scores)
+        top = ranking.top_indices(self.scores, 5)
+        self.assertEqual({None: [(self.ids[i], self.scores[i]) for i in top]}, ranker.ranked())
+
+    def test_rejects_non_positive_k(self):
+        self.assertRaises(ValueError, ranking.SegmentRanker, 0)
+
+    def test_write_rankings(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'rankings.csv')
+            ranking.write_rankings({'online': [('b', 0.9), ('a', 0.5)], 'direct': [('c', 0.7)]},
+                                   file_path)
+            with open(file_path) as f:
+                rows = list(csv.DictReader(f))
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual([('direct', '1', 'c', '0.7'), ('online', '1', 'b', '0.9'),
+                          ('online', '2', 'a', '0.5')],
+                         [tuple(row[column] for column in ranking.RANKING_COLUMNS)
+                          for row in rows])
+
+
+if __name__ == '__main__':
+    unittest.main()
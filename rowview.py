@@ -0,0 +1,76 @@
+"""Lightweight views of row dicts, so transforms neither mutate nor copy their input rows
+
+A RowView reads through to its base row, except for the columns it overrides or hides. Writes
+and deletes only change the view. A transform that changes a few columns returns views holding
+just those columns, and the untouched columns stay shared with the loaded rows, so the same
+loaded data can serve training, scoring and plotting.
+"""
+import collections
+
+
+class RowView(collections.MutableMapping):
+    """A row that overrides and hides some columns of a base row"""
+
+    __slots__ = ('base', 'overrides', 'hidden')
+
+    def __init__(self, base, overrides=None, hidden=frozenset()):
+        """
+        :param dict[str, Any] base: the row to read through to, which is never modified
+        :param dict[str, Any] overrides: columns with new values
+        :param frozenset[str] hidden: columns of the base row to leave out, which can be shared
+            between views
+        """
+        if isinstance(base, RowView):
+            merged = {key: value for key, value in base.overrides.iteritems()
+                      if key not in hidden}
+            merged.update(overrides or {})
+            overrides = merged
+            hidden = (base.hidden - frozenset(overrides)) | hidden
+            base = base.base
+        self.base = base
+        self.overrides = overrides if overrides is not None else {}
+        self.hidden = hidden
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        if key in self.hidden:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __contains__(self, key):
+        return key in self.overrides or (key in self.base and key not in self.hidden)
+
+    def __setitem__(self, key, value):
+        self.overrides[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.overrides.pop(key, None)
+        if key in self.base:
+            self.hidden = self.hidden | frozenset([key])
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self.overrides and key not in self.hidden:
+                yield key
+        for key in self.overrides:
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'RowView(%r)' % dict(self.iteritems())
+
+
+def project_rows(rows, hidden=frozenset()):
+    """Views of the rows without the hidden columns
+
+    :param list[dict[str, Any]] rows:
+    :param hidden: the columns to leave out
+    :rtype: list[RowView]
+    """
+    hidden = frozenset(hidden)
+    return [RowView(row, hidden=hidden) for row in rows]
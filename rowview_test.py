@@ -0,0 +1,41 @@
+import unittest
+
+import rowview
+
+
+class RowViewTest(unittest.TestCase):
+
+    def test_overrides_and_hidden_columns(self):
+        base = {'id': 'a', 'type': 'big', 'date': '2016-10-01', 'weight': '100'}
+        view = rowview.RowView(base, {'date': 1475276400.0}, frozenset(['type']))
+
+        self.assertEqual({'id': 'a', 'date': 1475276400.0, 'weight': '100'}, dict(view))
+        self.assertEqual(3, len(view))
+        self.assertNotIn('type', view)
+        with self.assertRaises(KeyError):
+            view['type']
+        self.assertEqual('default', view.get('type', 'default'))
+
+        view['weight_log'] = 2.0
+        del view['id']
+        self.assertEqual({'date': 1475276400.0, 'weight': '100', 'weight_log': 2.0}, view)
+        self.assertEqual({'id': 'a', 'type': 'big', 'date': '2016-10-01', 'weight': '100'}, base)
+
+    def test_views_of_views_share_the_base(self):
+        base = {'id': 'a', 'type': 'big'}
+        view = rowview.RowView(rowview.RowView(base, {'type': 1}), hidden=frozenset(['id']))
+        self.assertIs(base, view.base)
+        self.assertEqual({'type': 1}, view)
+
+        view = rowview.RowView(rowview.RowView(base, {'type': 1}), hidden=frozenset(['type']))
+        self.assertEqual({'id': 'a'}, view)
+
+    def test_project_rows(self):
+        rows = [{'id': 'a', 'type': 'big'}, {'id': 'b', 'type': 'small'}]
+        views = rowview.project_rows(rows, ['type'])
+        self.assertEqual([{'id': 'a'}, {'id': 'b'}], views)
+        self.assertIs(views[0].hidden, views[1].hidden)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,365 @@
+"""A long running service scoring customers for churn with a persisted model
+
+The model and the preprocessing state it was trained with are loaded once. Each request carries
+customer records, as in the data files, along with their price history:
+
+    POST /score
+    {"records": [{"customer": {"id": "...", "date_activ": "2012-11-07", ...},
+                  "history": [{"price_date": "2015-01-01", "price_p1_var": "0.125", ...}, ...]}]}
+
+    {"scores": [{"id": "...", "probability": 0.12, "churned": false}]}
+
+Records are preprocessed in the request threads, then a batching thread coalesces the rows of
+concurrent requests into a single predict_proba call. Rows that arrive while a batch is being
+scored make up the next batch, and optionally a batch waits up to max_delay for more rows. GET
+/stats returns the request, batch and latency counters.
+
+    main.train_and_save_model('model')
+    python scoring.py model --port 8000
+"""
+from __future__ import division
+
+import argparse
+import BaseHTTPServer
+import collections
+import cPickle
+import json
+import os
+import Queue
+import SocketServer
+import threading
+import time
+
+import numpy as np
+
+import categorical
+import preprocessing
+import rowview
+
+MODEL_FILE = 'model.pkl'
+STATE_FILE = 'preprocessing.json'
+
+MAX_BATCH_ROWS = 256
+MAX_DELAY = 0.0
+LATENCY_WINDOW = 10000
+
+DEFAULT_PORT = 8000
+
+
+def save_model(directory, model, columns, features, timeseries_features, new_feature_names=None,
+               categorical_store=None):
+    """Persist a fitted model with the preprocessing state needed to score new customers
+
+    :param directory: created if necessary
+    :param model: a fitted classifier with predict_proba
+    :param list[str] columns: the feature name of each column the model was fitted to
+    :param dict[str, dict[str, Any]] features: the features, including the derived ones
+    :param timeseries_features: the names of the timeseries
+    :param list[str] new_feature_names: the derived timeseries features, all of them by default
+    :param categorical.CategoricalStore categorical_store: the store the training rows were encoded
+        with, whose categories are saved so records get the same codes
+    """
+    categories = None
+    if categorical_store is not None:
+        categories = {name: column.categories()
+                      for name, column in categorical_store.columns.iteritems()}
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, MODEL_FILE), 'wb') as f:
+        cPickle.dump(model, f, cPickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(directory, STATE_FILE), 'w') as f:
+        json.dump({'columns': list(columns), 'features': features,
+                   'timeseries_features': list(timeseries_features),
+                   'new_feature_names': new_feature_names, 'categories': categories}, f)
+
+
+def load_scorer(directory):
+    """
+    :rtype: Scorer
+    """
+    with open(os.path.join(directory, MODEL_FILE), 'rb') as f:
+        model = cPickle.load(f)
+    with open(os.path.join(directory, STATE_FILE)) as f:
+        state = json.load(f, object_hook=_str_keys)
+    categories = state.get('categories')
+    if categories is not None:
+        # The data files are read as utf-8 byte strings
+        categories = {name: [value.encode('utf-8') for value in values]
+                      for name, values in categories.iteritems()}
+    return Scorer(model, state['columns'], state['features'], state['timeseries_features'],
+                  state['new_feature_names'], categories)
+
+
+def _str_keys(obj):
+    return {str(key): value for key, value in obj.iteritems()}
+
+
+class Scorer(object):
+    """Preprocess records as the training data was, and score them in batches"""
+
+    def __init__(self, model, columns, features, timeseries_features, new_feature_names=None,
+                 categories=None):
+        """
+        :param dict[str, list[str]] categories: the categories of each categorical feature in
+            training, in code order
+        """
+        self.model = model
+        self.columns = columns
+        self.features = features
+        self.timeseries_features = timeseries_features
+        self.derived_features = preprocessing.select_derived_features(new_feature_names)
+        self.churned_column = list(model.classes_).index(1)
+        # Frozen, so the codes don't change or grow however many records are scored
+        self.categorical_store = categorical.CategoricalStore(
+            {name: categorical.CategoricalColumn.from_categories(values)
+             for name, values in (categories or {}).iteritems()})
+
+    def prepare(self, record):
+        """Vectorise one record, as a row of the matrix the model was fitted to
+
+        :param dict[str, Any] record: {'customer': data row, 'history': historical rows}
+        :rtype: np.array[np.float64]
+        :raises ValueError: if the record doesn't have the columns the model needs
+        """
+        customer = record['customer']
+        row = rowview.RowView(customer, preprocessing.date_overrides(customer, self.features))
+        for name, column in self.categorical_store.columns.iteritems():
+            if name in customer:
+                row[name] = column.encode(customer[name])
+        timeseries_row = preprocessing.build_timeseries_row(
+            customer['id'], record.get('history', []), self.timeseries_features)
+        row.update(preprocessing.derive_timeseries_features(timeseries_row,
+                                                            self.timeseries_features,
+                                                            self.derived_features))
+        missing = [column for column in self.columns if column not in row]
+        if missing:
+            raise ValueError('Missing columns %s' % ', '.join(missing))
+        return preprocessing.vectorise_columns([row], self.columns)[0]
+
+    def score(self, X):
+        """The churn probabilities of the rows of a matrix
+
+        :rtype: np.array[np.float64]
+        """
+        return self.model.predict_proba(X)[:, self.churned_column]
+
+
+class ScoringStats(object):
+    """Counters of the requests, records and batches scored, and recent request latencies"""
+
+    def __init__(self, latency_window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.records = 0
+        self.batches = 0
+        self.batch_rows = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+
+    def request(self, records, latency):
+        with self._lock:
+            self.requests += 1
+            self.records += records
+            self.latencies.append(latency)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def batch(self, rows):
+        with self._lock:
+            self.batches += 1
+            self.batch_rows += rows
+
+    def summary(self):
+        """
+        :rtype: dict[str, float]
+        """
+        with self._lock:
+            latencies = np.array(self.latencies)
+            uptime = time.time() - self.started
+            summary = {'uptime': uptime, 'requests': self.requests, 'errors': self.errors,
+                       'records': self.records, 'batches': self.batches,
+                       'records_per_second': self.records / uptime if uptime else 0.0,
+                       'mean_batch_rows': self.batch_rows / self.batches if self.batches else 0.0}
+        for percentile in (50, 90, 99):
+            value = np.percentile(latencies, percentile) if len(latencies) else 0.0
+            summary['latency_p%d_ms' % percentile] = value * 1000
+        return summary
+
+
+class _Pending(object):
+    """Rows waiting for their scores"""
+
+    def __init__(self, X):
+        self.X = X
+        self.scores = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher(object):
+    """Coalesce the rows submitted by concurrent threads into batches, scored in one call"""
+
+    def __init__(self, score, max_batch_rows=MAX_BATCH_ROWS, max_delay=MAX_DELAY, stats=None):
+        """
+        :param callable score: scores a matrix, returning a value per row
+        :param int max_batch_rows: the rows at which a batch is scored without waiting further
+        :param float max_delay: the longest a batch waits for more rows, in seconds. By default
+            a batch is whatever has arrived by the time the previous one is scored, so a lone
+            request never waits.
+        :param ScoringStats stats: counts the batches if given
+        """
+        self.score = score
+        self.max_batch_rows = max_batch_rows
+        self.max_delay = max_delay
+        self.stats = stats
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, X):
+        """Score the rows of a matrix along with any other rows submitted meanwhile
+
+        :rtype: np.array
+        """
+        pending = _Pending(X)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.scores
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        rows = len(batch[0].X)
+        deadline = time.time() + self.max_delay
+        while rows < self.max_batch_rows:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    pending = self._queue.get(timeout=timeout)
+                else:
+                    pending = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            batch.append(pending)
+            rows += len(pending.X)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                scores = self.score(np.vstack([pending.X for pending in batch]))
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+                    pending.done.set()
+                continue
+            if self.stats:
+                self.stats.batch(len(scores))
+            start = 0
+            for pending in batch:
+                pending.scores = scores[start:start + len(pending.X)]
+                start += len(pending.X)
+                pending.done.set()
+
+
+class ScoringHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    # Send each response in one write, without waiting on Nagle's algorithm, as keep-alive
+    # connections would otherwise stall on delayed acknowledgements
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._respond(200, self.server.stats.summary())
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._respond(404, {'error': 'Not found'})
+            return
+        start = time.time()
+        try:
+            body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+            records = json.loads(body)['records']
+            if not all(isinstance(record, dict) for record in records):
+                raise TypeError('Each record must be an object')
+            X = np.array([self.server.scorer.prepare(record) for record in records])
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            self.server.stats.error()
+            self._respond(400, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        try:
+            scores = self.server.batcher.submit(X) if len(X) else []
+        except Exception as e:
+            # The model failed, not the request, but the client still gets an answer
+            self.server.stats.error()
+            self._respond(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+        content = {'scores': [
+            {'id': record['customer']['id'], 'probability': score, 'churned': score >= 0.5}
+            for record, score in zip(records, map(float, scores))]}
+        self.server.stats.request(len(records), time.time() - start)
+        self._respond(200, content)
+
+    def _respond(self, status, content):
+        body = json.dumps(content)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Logging every request to stderr would dominate the latency, see /stats instead
+        pass
+
+
+class ScoringServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server scoring with a thread per connection and a shared micro-batcher"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, scorer, max_batch_rows=MAX_BATCH_ROWS, max_delay=MAX_DELAY):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ScoringHandler)
+        self.scorer = scorer
+        self.stats = ScoringStats()
+        self.batcher = MicroBatcher(scorer.score, max_batch_rows, max_delay, self.stats)
+
+
+def serve(model_directory, host='localhost', port=DEFAULT_PORT, max_batch_rows=MAX_BATCH_ROWS,
+          max_delay=MAX_DELAY):
+    """Score requests until interrupted
+
+    :param str model_directory: as written by save_model
+    """
+    server = ScoringServer((host, port), load_scorer(model_directory), max_batch_rows, max_delay)
+    print 'Scoring with %s on %s:%s' % (model_directory, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model_directory')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-batch-rows', type=int, default=MAX_BATCH_ROWS)
+    parser.add_argument('--max-delay', type=float, default=MAX_DELAY)
+    args = parser.parse_args()
+    serve(args.model_directory, args.host, args.port, args.max_batch_rows, args.max_delay)
@@ -0,0 +1,167 @@
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+
+import categorical
+import preprocessing
+import scoring
+
+
+def feature(is_date=0, is_categorical=0):
+    return {'is_date': is_date, 'is_categorical': is_categorical, 'log_x': 0, 'bandwidth': 0.2}
+
+
+class ScoringTest(unittest.TestCase):
+
+    features = {'id': feature(), 'date_activ': feature(is_date=1), 'cons_12m': feature(),
+                'channel_sales': feature(is_categorical=1)}
+    timeseries_features = ['price_p1_var']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.records = []
+        for i in range(60):
+            customer = {'id': 'id%02d' % i, 'date_activ': '2012-%02d-01' % (i % 12 + 1),
+                        'cons_12m': str(rng.randint(1000)), 'channel_sales': 'abc'[i % 3]}
+            history = [{'price_date': '2015-%02d-01' % month,
+                        'price_p1_var': str(round(rng.uniform(0.1, 0.2), 3))}
+                       for month in range(1, 4)]
+            self.records.append({'customer': customer, 'history': history})
+
+        data_rows = [record['customer'] for record in self.records]
+        historical_rows = [dict(historical_row, id=record['customer']['id'])
+                           for record in self.records for historical_row in record['history']]
+        rows = preprocessing.transform_dates(data_rows, self.features)
+        timeseries_rows = preprocessing.extract_timeseries_rows(historical_rows, self.features,
+                                                                self.timeseries_features)
+        rows, features = preprocessing.add_timeseries_features(rows, timeseries_rows,
+                                                               self.features,
+                                                               self.timeseries_features)
+        self.X = preprocessing.test_data(rows, features)
+        y = np.arange(len(self.X)) % 2
+        model = DecisionTreeClassifier(random_state=0).fit(self.X, y)
+        scoring.save_model(self.directory, model, preprocessing.model_columns(rows[0], features),
+                           features, self.timeseries_features)
+        self.scorer = scoring.load_scorer(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_prepare_matches_batch_preprocessing(self):
+        X = np.array([self.scorer.prepare(record) for record in self.records])
+        np.testing.assert_array_equal(self.X, X)
+
+    def test_training_categories_are_saved(self):
+        data_rows = [record['customer'] for record in self.records]
+        _, store = preprocessing.transform_categorical_features(data_rows, self.features)
+        scoring.save_model(self.directory, self.scorer.model, self.scorer.columns, self.features,
+                           self.timeseries_features, categorical_store=store)
+        scorer = scoring.load_scorer(self.directory)
+
+        column = scorer.categorical_store['channel_sales']
+        self.assertEqual(store['channel_sales'].categories(), column.categories())
+        self.assertEqual(2, column.encode('b'))
+        self.assertEqual(categorical.UNKNOWN_CODE, column.encode('unseen'))
+        np.testing.assert_array_equal(self.X[:1], [scorer.prepare(self.records[0])])
+        self.assertEqual(3, column.cardinality)
+
+    def test_prepare_rejects_incomplete_records(self):
+        customer = dict(self.records[0]['customer'])
+        del customer['cons_12m']
+        with self.assertRaises(ValueError):
+            self.scorer.prepare({'customer': customer, 'history': []})
+        customer['unknown'] = '1'
+        with self.assertRaises(ValueError):
+            self.scorer.prepare({'customer': customer, 'history': []})
+
+    def test_micro_batcher_coalesces_concurrent_rows(self):
+        stats = scoring.ScoringStats()
+        batcher = scoring.MicroBatcher(self.scorer.score, max_batch_rows=1000, max_delay=0.2,
+                                       stats=stats)
+        results = [None] * 20
+
+        def submit(i):
+            results[i] = batcher.submit(self.X[i * 3:i * 3 + 3])
+
+        threads = [threading.Thread(target=submit, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        np.testing.assert_array_equal(self.scorer.score(self.X), np.concatenate(results))
+        self.assertLess(stats.batches, 20)
+        self.assertEqual(60, stats.batch_rows)
+
+    def test_micro_batcher_errors(self):
+        def score(X):
+            raise RuntimeError('model failed')
+
+        batcher = scoring.MicroBatcher(score)
+        self.assertRaises(RuntimeError, batcher.submit, self.X[:2])
+
+    def test_server(self):
+        server = scoring.ScoringServer(('localhost', 0), self.scorer)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://localhost:%d' % server.server_address[1]
+        try:
+            response = urllib2.urlopen(url + '/score', json.dumps({'records': self.records[:5]}))
+            scores = json.load(response)['scores']
+            self.assertEqual(['id00', 'id01', 'id02', 'id03', 'id04'],
+                             [score['id'] for score in scores])
+            np.testing.assert_array_equal(self.scorer.score(self.X[:5]),
+                                          [score['probability'] for score in scores])
+
+            with self.assertRaises(urllib2.HTTPError) as raised:
+                urllib2.urlopen(url + '/score', json.dumps({'records': [{'history': []}]}))
+            self.assertEqual(400, raised.exception.code)
+
+            stats = json.load(urllib2.urlopen(url + '/stats'))
+            self.assertEqual(1, stats['requests'])
+            self.assertEqual(5, stats['records'])
+            self.assertEqual(1, stats['errors'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_server_errors(self):
+        class BrokenModel(object):
+            classes_ = np.array([0, 1])
+
+            def predict_proba(self, X):
+                raise RuntimeError('model failed')
+
+        scorer = scoring.Scorer(BrokenModel(), self.scorer.columns, self.scorer.features,
+                                self.scorer.timeseries_features)
+        server = scoring.ScoringServer(('localhost', 0), scorer)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://localhost:%d' % server.server_address[1]
+        try:
+            for records, code in (([self.records[0]], 500), (['not a record'], 400),
+                                  ([{'customer': 'not a dict'}], 400)):
+                with self.assertRaises(urllib2.HTTPError) as raised:
+                    urllib2.urlopen(url + '/score', json.dumps({'records': records}))
+                self.assertEqual(code, raised.exception.code)
+                self.assertIn('error', json.load(raised.exception))
+
+            stats = json.load(urllib2.urlopen(url + '/stats'))
+            self.assertEqual(3, stats['errors'])
+            self.assertEqual(0, stats['requests'])
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
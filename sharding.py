@@ -0,0 +1,160 @@
+"""Preprocess customer rows in parallel, sharded by id across a process pool
+
+Each worker transforms the dates, extracts and derives the timeseries features and vectorises the
+rows of its shard, along with the shard's historical rows, which are partitioned by the same hash
+of the id. Workers write their rows straight into a matrix in shared memory, so only the small
+categorical summaries are pickled back to the parent.
+
+The inputs reach the workers by fork, so this needs a platform where multiprocessing forks.
+"""
+from collections import OrderedDict
+from ctypes import c_double
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+
+import outofcore
+import preprocessing
+
+_context = {}
+
+
+def matrix_columns(row, features, timeseries_features, new_feature_names=None):
+    """The columns of the matrix, as labelled_training_data would vectorise them: the
+    non-categorical features of the row plus the derived timeseries features, sorted by name
+
+    :param dict[str, Any] row: a raw data row
+    :rtype: list[str]
+    """
+    columns = [name for name in row
+               if name != 'id' and name in features
+               and not int(features[name]['is_categorical'])]
+    derived_features = preprocessing.select_derived_features(new_feature_names)
+    columns.extend(timeseries_name + '_' + feature_name
+                   for timeseries_name in timeseries_features
+                   for feature_name in derived_features)
+    return sorted(columns)
+
+
+def shard_positions(rows, shards):
+    """The positions of the rows in each shard, in their original order
+
+    :rtype: list[list[int]]
+    """
+    positions = [[] for _ in xrange(shards)]
+    for i, row in enumerate(rows):
+        positions[outofcore.partition_index(row['id'], shards)].append(i)
+    return positions
+
+
+def _init_worker(context):
+    _context.update(context)
+
+
+def _process_shard(shard):
+    """Preprocess one shard into the shared matrix
+
+    :return: For each categorical feature, the position of the first row with each value
+    :rtype: dict[str, dict[str, int]]
+    """
+    context = _context
+    features = context['features']
+    timeseries_features = context['timeseries_features']
+    positions = context['positions'][shard]
+    if not positions:
+        return {}
+
+    rows = [context['data_rows'][i] for i in positions]
+    historical_rows = [context['historical_rows'][i]
+                       for i in context['historical_positions'][shard]]
+
+    first_positions = {name: {} for name in context['categorical_features']}
+    for position, row in zip(positions, rows):
+        for name, first_position in first_positions.iteritems():
+            first_position.setdefault(row[name], position)
+
+    rows = preprocessing.transform_dates(rows, features)
+    timeseries_rows = preprocessing.extract_timeseries_rows(historical_rows, features,
+                                                            timeseries_features)
+    rows, _ = preprocessing.add_timeseries_features(rows, timeseries_rows, features,
+                                                    timeseries_features,
+                                                    context['new_feature_names'])
+
+    columns = context['columns']
+    X = np.frombuffer(context['buffer']).reshape(len(context['data_rows']), len(columns))
+    X[positions] = preprocessing.vectorise_columns(rows, columns)
+    return first_positions
+
+
+def merge_categorical_values(shard_first_positions, categorical_features):
+    """Number each category in order of its first appearance in the whole data set, just as
+    transform_categorical_features would, whatever the sharding
+
+    :param list[dict[str, dict[str, int]]] shard_first_positions: from each shard
+    :return: A value map per feature, from integer to value
+    :rtype: dict[str, dict[int, str]]
+    """
+    value_maps = {}
+    for name in categorical_features:
+        first_positions = {}
+        for shard in shard_first_positions:
+            for value, position in shard.get(name, {}).iteritems():
+                first_positions[value] = min(position, first_positions.get(value, position))
+        ordered_values = sorted(first_positions, key=first_positions.get)
+        value_maps[name] = OrderedDict((i + 1, value) for i, value in enumerate(ordered_values))
+    return value_maps
+
+
+def sharded_matrix(data_rows, historical_rows, features, timeseries_features,
+                   new_feature_names=None, processes=None):
+    """Preprocess and vectorise the data rows with a pool of processes
+
+    :param list[dict[str, str]] data_rows: raw data rows, which are not modified
+    :param list[dict[str, str]] historical_rows: raw historical rows, grouped by id
+    :param dict[str, dict[str, str]] features:
+    :param timeseries_features: the names of the timeseries
+    :param list[str] new_feature_names: the derived timeseries features, all by default
+    :param int processes: the number of workers, the number of cpus by default
+    :return: The matrix, with a row per data row in the same order, its column names and the
+        categorical value maps
+    :rtype: tuple[np.array[np.float64], list[str], dict[str, dict[int, str]]]
+    """
+    processes = processes or multiprocessing.cpu_count()
+    columns = matrix_columns(data_rows[0], features, timeseries_features, new_feature_names)
+    categorical_features = sorted(name for name in data_rows[0]
+                                  if name != 'id' and name in features
+                                  and int(features[name]['is_categorical']))
+    print 'Preprocessing %s rows in %s shards' % (len(data_rows), processes)
+
+    buffer = RawArray(c_double, len(data_rows) * len(columns))
+    context = {
+        'data_rows': data_rows,
+        'historical_rows': historical_rows,
+        'features': features,
+        'timeseries_features': timeseries_features,
+        'new_feature_names': new_feature_names,
+        'categorical_features': categorical_features,
+        'columns': columns,
+        'positions': shard_positions(data_rows, processes),
+        'historical_positions': shard_positions(historical_rows, processes),
+        'buffer': buffer,
+    }
+
+    if processes == 1:
+        _init_worker(context)
+        try:
+            shard_first_positions = [_process_shard(0)]
+        finally:
+            _context.clear()
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(context,))
+        try:
+            shard_first_positions = pool.map(_process_shard, range(processes))
+        finally:
+            pool.close()
+            pool.join()
+
+    X = np.frombuffer(buffer).reshape(len(data_rows), len(columns))
+    value_maps = merge_categorical_values(shard_first_positions, categorical_features)
+    return X, columns, value_maps
@@ -0,0 +1,59 @@
+import copy
+import unittest
+
+import numpy as np
+
+import preprocessing
+import sharding
+
+
+class ShardingTest(unittest.TestCase):
+
+    features = {'id': {'is_categorical': '1', 'is_date': '0'},
+                'type': {'is_categorical': '1', 'is_date': '0'},
+                'date': {'is_categorical': '0', 'is_date': '1'},
+                'weight': {'is_categorical': '0', 'is_date': '0'}}
+    timeseries_features = ['price_1']
+
+    def setUp(self):
+        types = ['small', 'medium', 'big', '']
+        self.data_rows = [{'id': 'id%02d' % i, 'type': types[(i * 7) % 4],
+                           'date': '2016-10-%02d' % (i % 28 + 1), 'weight': str(i * 10)}
+                          for i in range(30)]
+        self.historical_rows = [{'id': 'id%02d' % i, 'price_date': '2015-%02d-01' % month,
+                                 'price_1': str((i + 1) * month)}
+                                for i in range(30) for month in (1, 2, 3)]
+
+    def serial_matrix(self, columns):
+        rows = preprocessing.transform_dates(copy.deepcopy(self.data_rows), self.features)
+        timeseries_rows = preprocessing.extract_timeseries_rows(
+            self.historical_rows, self.features, self.timeseries_features)
+        rows, _ = preprocessing.add_timeseries_features(rows, timeseries_rows, self.features,
+                                                        self.timeseries_features)
+        return preprocessing.vectorise_columns(rows, columns)
+
+    def test_matches_serial_preprocessing(self):
+        original_rows = copy.deepcopy(self.data_rows)
+        _, store = preprocessing.transform_categorical_features(
+            copy.deepcopy(self.data_rows), {'type': self.features['type']})
+        expected_value_maps = store.value_maps()
+
+        for processes in (1, 3):
+            X, columns, value_maps = sharding.sharded_matrix(
+                self.data_rows, self.historical_rows, self.features, self.timeseries_features,
+                processes=processes)
+
+            self.assertEqual(['date', 'price_1_max', 'price_1_min', 'price_1_range',
+                              'price_1_sum_returns', 'weight'], columns)
+            np.testing.assert_array_equal(self.serial_matrix(columns), X)
+            self.assertEqual(expected_value_maps, value_maps)
+        self.assertEqual(original_rows, self.data_rows)
+
+    def test_shard_positions(self):
+        positions = sharding.shard_positions(self.data_rows, 4)
+        self.assertEqual(range(30), sorted(sum(positions, [])))
+        self.assertEqual(positions, sharding.shard_positions(self.data_rows, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
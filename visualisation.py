@@ -2,7 +2,6 @@ from __future__ import division
 
 import math
 
-from collections import Counter
 from collections import defaultdict
 from itertools import groupby
 
@@ -10,32 +9,48 @@ from matplotlib import pyplot as plt
 import numpy as np
 from sklearn.neighbors import KernelDensity
 
+import categorical
+import idindex
 import load
 import preprocessing
 
+DATE_FACTOR = 100000000
+
 
 def categorical_plot(feature_name, data_rows, label_rows, max_categories=30,
-                     show=False, save=True):
-    """Plot the ratio of labels for each category"""
-    churned = build_churned(label_rows)
+                     show=False, save=True, column=None, index=None):
+    """Plot the ratio of labels for each category
+
+    :param categorical.CategoricalColumn column: the feature's codes for the data rows, if they
+        have already been encoded
+    :param idindex.IdIndex index: the positions of the data rows, if already built
+    """
+    churned = build_churned(label_rows, index)
 
-    no_churn = Counter(r[feature_name] for r in data_rows if not churned(r))
-    churn = Counter(r[feature_name] for r in data_rows if churned(r))
+    if column is None:
+        column = categorical.CategoricalColumn(r[feature_name] for r in data_rows)
+    churned_rows = np.array([bool(churned(r)) for r in data_rows], dtype=bool)
 
-    all_categories = set(no_churn.keys()).union(set(churn.keys()))
+    num_codes = column.cardinality + 1
+    churn = np.bincount(column.codes[churned_rows], minlength=num_codes)
+    totals = np.bincount(column.codes, minlength=num_codes)
 
     def total_items(category):
-        return churn[category] + no_churn[category]
+        return totals[column.encode(category)]
 
     def churn_ratio(category):
-        return churn[category] / total_items(category)
+        return churn[column.encode(category)] / total_items(category)
 
     def enough_items(category):
         min_items = 10
         return total_items(category) >= min_items
 
-    sorted_categories = sorted(filter(enough_items, all_categories), key=churn_ratio, reverse=True)
+    sorted_categories = sorted(filter(enough_items, column.categories()), key=churn_ratio,
+                               reverse=True)
     sorted_categories = filter(None, sorted_categories)
+    if not sorted_categories:
+        print 'No category of %s has enough rows to plot' % feature_name
+        return
 
     num_categories = min(len(sorted_categories), max_categories)
     ind = np.arange(num_categories)    # the x locations for the groups
@@ -72,25 +87,29 @@ def show_or_save(feature_name, save, show):
         plt.show()
 
 
-def label_map(label_rows):
-    labels_by_id = {r['id']: r[load.LABEL_NAME] for r in label_rows}
-    return labels_by_id
-
-
-def build_churned(label_rows):
-    labels_by_id = label_map(label_rows)
+def build_churned(label_rows, index=None):
+    """
+    :param idindex.IdIndex index: the positions of the rows to look up, if already built, otherwise
+        the label rows are indexed
+    """
+    if index is None:
+        index = idindex.IdIndex.from_rows(label_rows)
+    labels = [r and r[load.LABEL_NAME] for r in index.align(label_rows)]
 
     def churned(row):
-        return labels_by_id[row['id']]
+        return labels[index.position(row['id'])]
     return churned
 
 
 def continuous_plot(feature_name, data_rows, label_rows, log_x=True, bandwidth=0.2, show=False,
-                    save=True, is_date=False, strip_zeros=False):
-    """Plot the distribution of a feature, coloured by label"""
-    date_factor = 100000000
+                    save=True, is_date=False, strip_zeros=False, index=None):
+    """Plot the distribution of a feature, coloured by label
 
-    churned = build_churned(label_rows)
+    :param idindex.IdIndex index: the positions of the data rows, if already built
+    """
+    date_factor = DATE_FACTOR
+
+    churned = build_churned(label_rows, index)
 
     churned_samples = []
     no_churned_samples = []
@@ -110,8 +129,43 @@ def continuous_plot(feature_name, data_rows, label_rows, log_x=True, bandwidth=0
         else:
             no_churned_samples.append(value)
 
-    churned_samples = np.array(churned_samples)[:, np.newaxis]
-    no_churned_samples = np.array(no_churned_samples)[:, np.newaxis]
+    plot_distributions(feature_name, np.array(churned_samples), np.array(no_churned_samples),
+                       log_x, bandwidth, show, save, is_date)
+
+
+def continuous_plot_from_dataset(feature_name, model_dataset, log_x=True, bandwidth=0.2,
+                                 show=False, save=True, is_date=False, strip_zeros=False):
+    """Plot the distribution of a feature of a memory mapped dataset, coloured by label
+
+    Empty values were vectorised as zeros, so only zero dates can be skipped as missing.
+
+    :param dataset.Dataset model_dataset:
+    """
+    values = np.asarray(model_dataset.column(feature_name), dtype=np.float64)
+    churned = np.asarray(model_dataset.y).astype(bool)
+
+    keep = np.isfinite(values)
+    if is_date:
+        keep &= values != 0
+        values = values / DATE_FACTOR
+    if log_x or strip_zeros:
+        keep &= values > 0
+    values = values[keep]
+    churned = churned[keep]
+    if log_x:
+        values = np.log10(values)
+
+    plot_distributions(feature_name, values[churned], values[~churned], log_x, bandwidth, show,
+                       save, is_date)
+
+
+def plot_distributions(feature_name, churned_samples, no_churned_samples, log_x=True,
+                       bandwidth=0.2, show=False, save=True, is_date=False):
+    """Plot kernel density estimates of the churned and not churned samples of a feature"""
+    date_factor = DATE_FACTOR
+
+    churned_samples = churned_samples[:, np.newaxis]
+    no_churned_samples = no_churned_samples[:, np.newaxis]
 
     def kde(samples):
         return KernelDensity(kernel='gaussian', bandwidth=bandwidth).fit(samples)
@@ -119,8 +173,8 @@ def continuous_plot(feature_name, data_rows, label_rows, log_x=True, bandwidth=0
     churned_dist = kde(churned_samples)
     no_churned_dist = kde(no_churned_samples)
 
-    X_plot = np.linspace(min(min(churned_samples), min(no_churned_samples)),
-                         max(max(churned_samples), max(no_churned_samples)),
+    X_plot = np.linspace(min(churned_samples.min(), no_churned_samples.min()),
+                         max(churned_samples.max(), no_churned_samples.max()),
                          1000)[1:, np.newaxis]
 
     fig, ax = plt.subplots()
@@ -151,9 +205,13 @@ def continuous_plot(feature_name, data_rows, label_rows, log_x=True, bandwidth=0
     show_or_save(feature_name, save, show)
 
 
-def timeseries_plot(feature_name, timeseries_rows, label_rows, save=True, show=False):
-    """Plot all the timeseries for a feature, coloured by label"""
-    churned = build_churned(label_rows)
+def timeseries_plot(feature_name, timeseries_rows, label_rows, save=True, show=False,
+                    index=None):
+    """Plot all the timeseries for a feature, coloured by label
+
+    :param idindex.IdIndex index: the positions of the timeseries rows' ids, if already built
+    """
+    churned = build_churned(label_rows, index)
 
     fig = plt.figure()
     ax = fig.add_subplot(111)